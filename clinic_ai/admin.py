@@ -10,13 +10,45 @@ class DoctorAvailabilityInline(admin.TabularInline):
 
 @admin.register(Doctor)
 class DoctorAdmin(admin.ModelAdmin):
-    list_display = ('name', 'specialty', 'clinic')
+    list_display = ('name', 'specialty', 'clinic', 'slot_minutes')
     inlines = [DoctorAvailabilityInline]
 
 admin.site.register(ClinicInfo)
 admin.site.register(ChatLog)
 admin.site.register(Appointment)
 
+@admin.register(ChatSession)
+class ChatSessionAdmin(admin.ModelAdmin):
+    list_display = ('title', 'user', 'message_count', 'last_activity')
+    search_fields = ('title', 'session_id', 'user__username')
+
+@admin.register(ChatMetrics)
+class ChatMetricsAdmin(admin.ModelAdmin):
+    list_display = ('chat_log', 'total_ms', 'retrieval_ms', 'llm_ms', 'tools_ms', 'db_ms', 'iterations', 'prompt_tokens', 'completion_tokens', 'created_at')
+    list_filter = ('created_at',)
+    readonly_fields = [field.name for field in ChatMetrics._meta.fields]
+    change_list_template = 'admin/clinic_ai/chatmetrics/change_list.html'
+    # Percentiles are computed in Python over the newest rows matching the filters
+    summary_rows = 1000
+
+    def changelist_view(self, request, extra_context=None):
+        from .ai_engine.metrics import summarize
+        response = super().changelist_view(request, extra_context)
+        if hasattr(response, 'context_data') and 'cl' in response.context_data:
+            queryset = response.context_data['cl'].queryset.order_by('-created_at')[:self.summary_rows]
+            response.context_data['summary'] = summarize(queryset)
+        return response
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'user', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('filename', 'error', 'worker', 'attempts', 'started_at', 'finished_at')
+    exclude = ('payload',)
+
 @admin.register(DoctorAvailability)
 class DoctorAvailabilityAdmin(admin.ModelAdmin):
     list_display = ('doctor', 'day_of_week', 'start_time', 'end_time')
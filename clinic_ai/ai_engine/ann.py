@@ -0,0 +1,92 @@
+from django.conf import settings
+import faiss
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+# Below this many vectors an IVF-PQ index cannot be trained sensibly (PQ needs
+# 256 points per codebook), so small corpora stay on the exact flat index
+MIN_TRAINING_VECTORS = 1024
+
+
+class IndexConfig:
+    """
+    FAISS index type and tuning knobs, read from settings:
+    flat (exact), hnsw (graph, tunable efSearch) or ivfpq (inverted lists with
+    product-quantized vectors, tunable nprobe). `encoding="sq8"` stores flat and
+    HNSW vectors as int8 instead of float32.
+    """
+
+    def __init__(self, index_type=None, encoding=None, hnsw_m=None, ef_construction=None,
+                 ef_search=None, nlist=None, pq_m=None, nprobe=None, train_size=None):
+        self.index_type = index_type or getattr(settings, "FAISS_INDEX_TYPE", "flat")
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown FAISS_INDEX_TYPE '{self.index_type}', expected one of {INDEX_TYPES}")
+        self.encoding = encoding or getattr(settings, "FAISS_VECTOR_ENCODING", "float")
+        self.hnsw_m = hnsw_m or getattr(settings, "FAISS_HNSW_M", 32)
+        self.ef_construction = ef_construction or getattr(settings, "FAISS_HNSW_EF_CONSTRUCTION", 80)
+        self.ef_search = ef_search or getattr(settings, "FAISS_HNSW_EF_SEARCH", 64)
+        self.nlist = nlist or getattr(settings, "FAISS_IVF_NLIST", 256)
+        self.pq_m = pq_m or getattr(settings, "FAISS_PQ_M", 48)
+        self.nprobe = nprobe or getattr(settings, "FAISS_IVF_NPROBE", 16)
+        self.train_size = train_size or getattr(settings, "FAISS_TRAIN_SIZE", 20000)
+
+    @property
+    def needs_training(self):
+        return self.index_type == "ivfpq" or self.encoding == "sq8"
+
+    @property
+    def supports_removal(self):
+        # HNSW graphs cannot drop vectors; changed files force a full rebuild
+        return self.index_type != "hnsw"
+
+    def trained(self, n_train):
+        """Whether `n_train` vectors are enough to build the IVF-PQ index itself."""
+        return self.index_type == "ivfpq" and n_train >= MIN_TRAINING_VECTORS
+
+    def signature(self, n_train=None):
+        """
+        Build-time parameters; an index built with a different signature is
+        rebuilt. With `n_train` it describes the index actually built from that
+        many training vectors: an ivfpq config below MIN_TRAINING_VECTORS builds
+        a flat index and is marked as such, so it can be upgraded later.
+        """
+        if self.index_type == "ivfpq":
+            if n_train is not None and not self.trained(n_train):
+                return f"ivfpq:untrained:{self.encoding}"
+            return f"ivfpq:nlist={self.nlist}:pq={self.pq_m}"
+        if self.index_type == "hnsw":
+            return f"hnsw:m={self.hnsw_m}:efc={self.ef_construction}:{self.encoding}"
+        return f"flat:{self.encoding}"
+
+    def factory_string(self, dimension, n_train):
+        sq = ",SQ8" if self.encoding == "sq8" else ""
+        if self.trained(n_train):
+            # ~39 training points per list is FAISS's lower bound for k-means
+            nlist = max(1, min(self.nlist, n_train // 39))
+            pq_m = self.pq_m if dimension % self.pq_m == 0 else 8
+            return f"IVF{nlist},PQ{pq_m}x8"
+        if self.index_type == "hnsw":
+            return f"HNSW{self.hnsw_m}{sq}"
+        return "SQ8" if sq else "Flat"
+
+    def create(self, dimension, training_vectors=None):
+        """New (trained, empty) index; `training_vectors` is required when needs_training."""
+        n_train = 0 if training_vectors is None else len(training_vectors)
+        index = faiss.index_factory(dimension, self.factory_string(dimension, n_train))
+        if self.index_type == "hnsw":
+            faiss.downcast_index(index).hnsw.efConstruction = self.ef_construction
+        if not index.is_trained:
+            index.train(training_vectors)
+        self.tune(index)
+        return index
+
+    def tune(self, index):
+        """Applies the search-time parameters (nprobe / efSearch) to a built or loaded index."""
+        params = faiss.ParameterSpace()
+        for name, value in (("nprobe", self.nprobe), ("efSearch", self.ef_search)):
+            try:
+                params.set_index_parameter(index, name, value)
+            except RuntimeError:
+                # Parameter does not apply to this index type
+                pass
+        return index
@@ -0,0 +1,52 @@
+import re
+
+# Harakat, superscript alef and tatweel carry no meaning for matching
+_DIACRITICS = re.compile(r'[\u064B-\u0652\u0670\u0640]')
+_PUNCTUATION = re.compile(r'[^\w\s]|_')
+_WHITESPACE = re.compile(r'\s+')
+
+_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و', 'ئ': 'ي', 'ى': 'ي',
+    'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+
+def normalize_arabic(text):
+    """
+    Canonical form used for matching Arabic text: strips diacritics and
+    punctuation, folds alef/hamza/ta-marbuta/alef-maksura variants, converts
+    Arabic-Indic digits and lower-cases Latin letters.
+    """
+    if not text:
+        return ""
+    text = _DIACRITICS.sub('', text).translate(_FOLD).lower()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+# Definite article and the conjunctions/prepositions that attach to it
+_PREFIXES = ("وال", "بال", "كال", "فال", "ولل", "لل", "ال")
+
+
+def light_stem(token):
+    """Strips one attached article prefix, keeping at least two letters ("الأسنان" -> "اسنان")."""
+    for prefix in _PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def tokenize(text):
+    """Normalized, lightly stemmed tokens for lexical matching."""
+    return [light_stem(token) for token in normalize_arabic(text).split()]
+
+
+# Function words that match almost every chunk; kept out of lexical scoring
+STOPWORDS = frozenset(tokenize(
+    "في من إلى الى على عن مع هل ما ماذا ماهي متى أين كيف كم لماذا هو هي هم هما أنا نحن أنت انتم "
+    "هذا هذه ذلك تلك هناك هنا التي الذي الذين اللذين أو ام ثم أن إن كان كانت يكون قد لا لم لن "
+    "كل بعد قبل عند أي أيضا حتى بين لدى لكن بل اذا إذا و ف ب ل يا"
+))
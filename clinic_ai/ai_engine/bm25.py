@@ -0,0 +1,88 @@
+from collections import Counter, defaultdict
+from .arabic import STOPWORDS, tokenize
+import math
+
+K1 = 1.5
+B = 0.75
+
+
+def terms(text):
+    """The tokens BM25 indexes and scores: arabic.tokenize without STOPWORDS."""
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    BM25 inverted index over Arabic-normalized tokens, kept in the same SQLite
+    file as the chunk text (see SQLiteDocstore), so it is versioned, updated
+    incrementally and memory-light exactly like the FAISS index next to it.
+    """
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+        self._stats = None
+
+    @staticmethod
+    def create_tables(conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS bm25_docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS bm25_postings (term TEXT NOT NULL, id TEXT NOT NULL, tf INTEGER NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS bm25_postings_term ON bm25_postings (term)")
+        conn.execute("CREATE INDEX IF NOT EXISTS bm25_postings_id ON bm25_postings (id)")
+
+    def add(self, conn, documents):
+        """Indexes {id: Document} inside the caller's transaction."""
+        docs, postings = [], []
+        for doc_id, doc in documents.items():
+            tokens = terms(doc.page_content)
+            docs.append((doc_id, len(tokens)))
+            postings.extend((term, doc_id, tf) for term, tf in Counter(tokens).items())
+        conn.executemany("INSERT INTO bm25_docs (id, length) VALUES (?, ?)", docs)
+        conn.executemany("INSERT INTO bm25_postings (term, id, tf) VALUES (?, ?, ?)", postings)
+        self._stats = None
+
+    def delete(self, conn, ids):
+        rows = [(doc_id,) for doc_id in ids]
+        conn.executemany("DELETE FROM bm25_docs WHERE id = ?", rows)
+        conn.executemany("DELETE FROM bm25_postings WHERE id = ?", rows)
+        self._stats = None
+
+    def _corpus_stats(self):
+        # A published version never changes, so this is computed once per store
+        if self._stats is None:
+            count, avg_length = self.docstore._read("SELECT COUNT(*), AVG(length) FROM bm25_docs")[0]
+            self._stats = (count, avg_length or 0.0)
+        return self._stats
+
+    def search(self, query, k=20):
+        """[(chunk id, score)] for the k best BM25 matches of the query."""
+        query_terms = sorted(set(terms(query)))
+        count, avg_length = self._corpus_stats()
+        if not query_terms or not count:
+            return []
+
+        placeholders = ",".join("?" * len(query_terms))
+        rows = self.docstore._read(
+            f"SELECT p.term, p.id, p.tf, d.length FROM bm25_postings p JOIN bm25_docs d ON d.id = p.id WHERE p.term IN ({placeholders})",
+            query_terms
+        )
+
+        by_term = defaultdict(list)
+        for term, doc_id, tf, length in rows:
+            by_term[term].append((doc_id, tf, length))
+
+        scores = defaultdict(float)
+        for term, postings in by_term.items():
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf, length in postings:
+                norm = K1 * (1 - B + B * length / avg_length) if avg_length else K1
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses ranked ID lists: each ID scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
@@ -0,0 +1,47 @@
+from django.db import IntegrityError, OperationalError, transaction
+from .slots import is_slot_free, to_db
+import random
+import time
+
+# Attempts for a booking whose transaction hit a lock timeout (SQLite "database is locked")
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 0.05
+
+
+class SlotTaken(Exception):
+    """The requested time overlaps a booking made by someone else."""
+
+
+def book_appointment(user, clinic, doctor, start):
+    """
+    Books `doctor` at `start` without double booking under concurrent requests.
+
+    The overlap check and the insert run in one transaction that first locks the
+    doctor's row (SELECT ... FOR UPDATE on PostgreSQL; on SQLite the IMMEDIATE
+    transaction mode takes the write lock up front), so bookings for one doctor
+    are serialized. The partial unique constraint on (doctor, appointment_date)
+    is the last line of defence. Raises SlotTaken when the time is not free.
+    """
+    from clinic_ai.models import Appointment, Doctor
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                Doctor.objects.select_for_update().filter(pk=doctor.pk).values_list("pk", flat=True).first()
+                if not is_slot_free(doctor, start):
+                    raise SlotTaken()
+                return Appointment.objects.create(
+                    user=user,
+                    clinic=clinic,
+                    doctor=doctor,
+                    # `start` is naive local time, like every time the tools work with
+                    appointment_date=to_db(start),
+                    duration_minutes=doctor.slot_length
+                )
+        except IntegrityError:
+            raise SlotTaken()
+        except OperationalError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            # Lock wait timed out; back off with jitter and try again
+            time.sleep(RETRY_DELAY * (2 ** attempt) * (1 + random.random()))
@@ -2,9 +2,59 @@ from langchain_openai import ChatOpenAI
 from langchain_classic.agents import AgentExecutor, create_openai_functions_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from .vectorstore import ClinicVectorStore
-from .tools import get_doctor_availability, get_clinic_general_info, book_appointment, list_user_appointments, list_clinics, generate_excel_report, generate_pdf_report, list_all_doctors
+from .tools import get_doctor_availability, find_free_slots, get_clinic_general_info, book_appointment, list_user_appointments, list_clinics, generate_report, generate_excel_report, generate_pdf_report, list_all_doctors
+from langchain_core.callbacks import BaseCallbackHandler
 from django.conf import settings
+from django.db import connection, connections
 from langchain_core.runnables import RunnableConfig
+from clinic_ai.context import current_user
+from asgiref.sync import sync_to_async
+from .metrics import RequestMetrics, current_metrics
+from .tool_cache import tool_cache
+from .router import IntentRouter
+import contextvars
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Short Arabic status lines pushed to the chat UI while a tool is running
+TOOL_STATUS_MESSAGES = {
+    "get_doctor_availability": "جاري التحقق من المواعيد المتاحة...",
+    "get_clinic_general_info": "جاري جلب معلومات المركز...",
+    "find_free_slots": "جاري البحث عن أقرب المواعيد الشاغرة...",
+    "book_appointment": "جاري تأكيد الحجز...",
+    "list_user_appointments": "جاري استرجاع مواعيدك...",
+    "list_clinics": "جاري البحث في العيادات...",
+    "list_all_doctors": "جاري تجهيز قائمة الأطباء...",
+    "generate_report": "جاري تجهيز التقرير...",
+    "generate_excel_report": "جاري إنشاء ملف Excel...",
+    "generate_pdf_report": "جاري إنشاء تقرير PDF...",
+}
+
+LOGIN_REQUIRED_MESSAGE = "عذراً، يجب عليك تسجيل الدخول لتتمكن من التحدث مع المساعد الطبي."
+
+
+class StreamingEventHandler(BaseCallbackHandler):
+    """Pushes tool starts and final-answer tokens onto a queue as they happen."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        name = (serialized or {}).get("name", "")
+        self.events.put({
+            "type": "tool",
+            "name": name,
+            "message": TOOL_STATUS_MESSAGES.get(name, "جاري المعالجة..."),
+        })
+
+    def on_llm_new_token(self, token, **kwargs):
+        # Function-call chunks arrive with empty content, only answer text is forwarded
+        if token:
+            self.events.put({"type": "token", "text": token})
+
 
 class ClinicAIChat:
     def __init__(self):
@@ -12,20 +62,26 @@ class ClinicAIChat:
             model="gpt-4o-mini", 
             temperature=0,
             openai_api_key=settings.OPENAI_API_KEY,
-            request_timeout=150 # Increased timeout
+            request_timeout=150, # Increased timeout
+            streaming=True, # Emits per-token callbacks, used by stream()
+            stream_usage=True # Token usage on streamed responses, for ChatMetrics
         )
         self.vector_store = ClinicVectorStore()
         self.tools = [
             get_doctor_availability,
+            find_free_slots,
             get_clinic_general_info,
             book_appointment,
             list_user_appointments,
             list_clinics,
+            generate_report,
             generate_excel_report,
             generate_pdf_report,
             list_all_doctors
         ]
         self.agent_executor = self._setup_agent()
+        # Reuses the loaded MiniLM model; disabled with INTENT_ROUTER = False
+        self.router = IntentRouter(self.vector_store.embeddings) if getattr(settings, "INTENT_ROUTER", True) else None
 
     def _setup_agent(self):
         system_prompt = """
@@ -51,10 +107,13 @@ class ClinicAIChat:
         - **قاعدة التواريخ الصارمة (بالغة الأهمية)**: عندما تعرض أداة `get_doctor_availability` مواعيد الطبيب، ستجد بجانب كل يوم تواريخ محددة بين قوسين (مثلاً: 2026-01-08). **يجب** أن تختار واحداً من هذه التواريخ حصراً عند الحجز. لا تحاول أبداً حساب التاريخ بنفسك أو افتراض أن تاريخاً معيناً يوافق يوماً معيناً. استخدم ما تراه في الأداة فقط.
         - **التناقض المنطقي (هام جداً)**: إذا قلت للمستخدم أن الطبيب متاح من 10 صباحاً إلى 6 مساءً، ثم طلب المستخدم الساعة 4، **لا ترفض الطلب**. الساعة 4 (16:00) هي قبل الساعة 6 (18:00). استخدم لغة الأرقام (16:00 < 18:00) للتأكد.
         - التحقق من الجنس: لا تخاطب الطبيب بصيغة المذكر أو المؤنث إلا إذا تأكدت من المعلومات المسترجعة.
+        - **المواعيد الشاغرة**: إذا سأل المستخدم عن أقرب موعد متاح أو عن وقت فارغ، استخدم `find_free_slots`؛ فهي تستبعد المواعيد المحجوزة مسبقاً. اعرض المواعيد كما تظهر في الأداة.
         - الحجز: عند الحجز، تأكد من طلب (اسم العيادة، اسم الطبيب، الموعد YYYY-MM-DD HH:MM). الموعد **يجب** أن يتوافق مع جدول الطبيب المتاح. لا تتوقع الرفض أبداً؛ اطلب الحجز ودع الأداة تخبرك بالنتيجة.
         - **تقارير Excel و PDF المباشرة (فائقة الأهمية)**: 
-            * إذا طلب المستخدم تقريراً (Excel أو PDF) لبيانات عامة (مثل "بيانات الأطباء" أو "قائمة العيادات")، **لا تسأل عن تفاصيل**. استخدم الأدوات المعنية (مثل `list_all_doctors` أو `list_clinics`) فوراً واصنع التقرير.
+            * إذا طلب المستخدم تقريراً (Excel أو PDF) عن المواعيد أو الأطباء أو جداول الدوام، **لا تسأل عن تفاصيل**. استدعِ `generate_report` فوراً بمواصفات مختصرة (النوع، الصيغة، الفلاتر، الفترة)؛ فهي تقرأ البيانات من قاعدة البيانات مباشرة. **لا** تستدعِ `list_all_doctors` ثم تنسخ البيانات إلى أداة أخرى.
+            * استخدم `generate_excel_report` أو `generate_pdf_report` فقط لبيانات لا تغطيها `generate_report` (مثل قائمة العيادات)، مع تمرير الصفوف كـ JSON.
             * القاعدة الذهبية: **الأفعال قبل الأقوال**. نفذ الطلب فوراً إذا كان بوسعك جمع البيانات، وقدم الملف في أول رد.
+            * أدوات التقارير تُجهّز الملف في الخلفية وتعيد رابط متابعة (/api/reports/...). انسخ هذا الرابط في ردك كما هو؛ ستعرضه الواجهة كبطاقة تتحول إلى رابط التحميل عند اكتمال الملف.
         - **التفكير الاستباقي**: لا تقولي "سأحتاج لمعرفة التخصص". قولي "إليك التقرير الذي يحتوي على جميع الأطباء في جميع التخصصات".
         - عدم الاختراع: إذا لم تجد معلومة، اعترف بذلك بلطف ووجه المستخدم للتواصل مع الاستقبال.
         """
@@ -68,19 +127,13 @@ class ClinicAIChat:
         ])
         
         agent = create_openai_functions_agent(self.llm, self.tools, prompt)
-        return AgentExecutor(agent=agent, tools=self.tools, verbose=True, max_iterations=10)
+        return AgentExecutor(agent=agent, tools=self.tools, verbose=settings.DEBUG, max_iterations=10)
 
-    def ask(self, query: str, user=None, chat_history=None):
+    def _build_inputs(self, query: str, user, chat_history, docs):
         if chat_history is None:
             chat_history = []
-            
-        # First, search vector DB for context
-        retriever = self.vector_store.get_retriever()
-        docs = retriever.invoke(query)
+
         context = "\n".join([d.page_content for d in docs])
-        
-        if not user or not user.is_authenticated:
-            return "عذراً، يجب عليك تسجيل الدخول لتتمكن من التحدث مع المساعد الطبي."
 
         user_status = f"مسجل دخول باسم ({user.username})"
         
@@ -90,21 +143,218 @@ class ClinicAIChat:
         day_name = days_ar[now.weekday()]
         now_str = now.strftime('%Y-%m-%d %H:%M')
         user_status_with_time = f"{user_status}\nالتاريخ والوقت الحالي: {day_name} {now_str}"
-        
-        response = self.agent_executor.invoke({
+
+        return {
             "input": query,
             "chat_history": chat_history,
             "context": context,
             "user_status": user_status_with_time
-        })
-        
+        }
+
+    def _route(self, query: str):
+        """The Intent answering `query` with a single tool call, or None to run the agent."""
+        if self.router is None:
+            return None
+        try:
+            return self.router.classify(query)
+        except Exception as e:
+            logger.error(f"Intent routing failed: {e}")
+            return None
+
+    def ask(self, query: str, user=None, chat_history=None, metrics=None):
+        """`metrics` (a RequestMetrics) collects stage timings and token counts, if given."""
+        if not user or not user.is_authenticated:
+            return LOGIN_REQUIRED_MESSAGE
+
+        metrics = metrics or RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            intent = self._route(query)
+            if intent is not None:
+                # Answered from the tool alone: no retrieval and no LLM call
+                with connection.execute_wrapper(metrics.db_wrapper):
+                    return intent.answer(query, callbacks=[metrics])
+
+            # First, search vector DB for context
+            with metrics.stage("retrieval"):
+                docs = self.vector_store.get_retriever().invoke(query)
+            with connection.execute_wrapper(metrics.db_wrapper):
+                response = self.agent_executor.invoke(
+                    self._build_inputs(query, user, chat_history, docs),
+                    config=RunnableConfig(callbacks=[metrics])
+                )
+        finally:
+            current_metrics.reset(token)
+
         return response["output"]
 
+    async def _aretriever(self):
+        # ensure_index() may load or rebuild the FAISS index, so it runs in a worker thread
+        return await sync_to_async(self.vector_store.get_retriever, thread_sensitive=False)()
+
+    async def aask(self, query: str, user=None, chat_history=None, metrics=None):
+        """
+        Async variant of ask() for the ASGI chat endpoint. The LLM calls go through
+        ainvoke and the tools run their async implementations, so no worker thread
+        is held while waiting on OpenAI. The caller sets current_user in its task.
+        DB time is not measured here: async tools query from executor threads.
+        """
+        if not user or not user.is_authenticated:
+            return LOGIN_REQUIRED_MESSAGE
+
+        metrics = metrics or RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            # Embedding the query is CPU work, kept off the event loop
+            intent = await sync_to_async(self._route, thread_sensitive=False)(query)
+            if intent is not None:
+                return await intent.aanswer(query, callbacks=[metrics])
+
+            with metrics.stage("retrieval"):
+                retriever = await self._aretriever()
+                docs = await retriever.ainvoke(query)
+            response = await self.agent_executor.ainvoke(
+                self._build_inputs(query, user, chat_history, docs),
+                config=RunnableConfig(callbacks=[metrics])
+            )
+        finally:
+            current_metrics.reset(token)
+
+        return response["output"]
+
+    def stream(self, query: str, user=None, chat_history=None, metrics=None):
+        """
+        Generator variant of ask(). Yields event dicts while the agent runs:
+        {"type": "tool", ...} when a tool starts, {"type": "token", ...} for each
+        answer token, then a single {"type": "done", "answer": ...} (or "error").
+        """
+        if not user or not user.is_authenticated:
+            yield {"type": "done", "answer": LOGIN_REQUIRED_MESSAGE}
+            return
+
+        events = queue.Queue()
+        handler = StreamingEventHandler(events)
+        metrics = metrics or RequestMetrics()
+
+        def run():
+            # Runs in its own thread, so the user context has to be set here
+            current_user.set(user)
+            current_metrics.set(metrics)
+            try:
+                intent = self._route(query)
+                if intent is not None:
+                    with connection.execute_wrapper(metrics.db_wrapper):
+                        answer = intent.answer(query, callbacks=[handler, metrics])
+                    events.put({"type": "done", "answer": answer})
+                    return
+
+                with metrics.stage("retrieval"):
+                    docs = self.vector_store.get_retriever().invoke(query)
+                inputs = self._build_inputs(query, user, chat_history, docs)
+                with connection.execute_wrapper(metrics.db_wrapper):
+                    response = self.agent_executor.invoke(inputs, config=RunnableConfig(callbacks=[handler, metrics]))
+                events.put({"type": "done", "answer": response["output"]})
+            except Exception as e:
+                events.put({"type": "error", "message": str(e)})
+            finally:
+                connections.close_all()
+
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+        worker.start()
+        while True:
+            event = events.get()
+            yield event
+            if event["type"] in ("done", "error"):
+                break
+        worker.join()
+
+    async def astream(self, query: str, user=None, chat_history=None, metrics=None):
+        """Async generator variant of stream(), yielding the same event dicts."""
+        if not user or not user.is_authenticated:
+            yield {"type": "done", "answer": LOGIN_REQUIRED_MESSAGE}
+            return
+
+        metrics = metrics or RequestMetrics()
+        metrics_token = current_metrics.set(metrics)
+        try:
+            intent = await sync_to_async(self._route, thread_sensitive=False)(query)
+            if intent is not None:
+                yield {
+                    "type": "tool",
+                    "name": intent.tool.name,
+                    "message": TOOL_STATUS_MESSAGES.get(intent.tool.name, "جاري المعالجة..."),
+                }
+                yield {"type": "done", "answer": await intent.aanswer(query, callbacks=[metrics])}
+                return
+
+            with metrics.stage("retrieval"):
+                retriever = await self._aretriever()
+                docs = await retriever.ainvoke(query)
+            inputs = self._build_inputs(query, user, chat_history, docs)
+            answer = None
+            config = RunnableConfig(callbacks=[metrics])
+            async for event in self.agent_executor.astream_events(inputs, version="v2", config=config):
+                kind = event["event"]
+                if kind == "on_tool_start":
+                    name = event["name"]
+                    yield {
+                        "type": "tool",
+                        "name": name,
+                        "message": TOOL_STATUS_MESSAGES.get(name, "جاري المعالجة..."),
+                    }
+                elif kind == "on_chat_model_stream":
+                    token = event["data"]["chunk"].content
+                    if token:
+                        yield {"type": "token", "text": token}
+                elif kind == "on_chain_end" and event["name"] == "AgentExecutor":
+                    answer = event["data"]["output"]["output"]
+            yield {"type": "done", "answer": answer}
+        except Exception as e:
+            yield {"type": "error", "message": str(e)}
+        finally:
+            current_metrics.reset(metrics_token)
+
 # Singleton instance for the AI assistant - updated to apply strict logic rules
 _ai_chat_instance = None
+_ai_chat_lock = threading.Lock()
 
 def get_ai_chat():
     global _ai_chat_instance
     if _ai_chat_instance is None:
-        _ai_chat_instance = ClinicAIChat()
+        # Double-checked so concurrent first requests build a single instance
+        with _ai_chat_lock:
+            if _ai_chat_instance is None:
+                ai_chat = ClinicAIChat()
+                ai_chat.vector_store.ensure_index()
+                _ai_chat_instance = ai_chat
     return _ai_chat_instance
+
+def preload_ai_chat():
+    """
+    Builds the singleton (embedding model, FAISS index, agent) at process start,
+    called from wsgi.py / asgi.py before the worker accepts traffic. Failures
+    are logged only; get_ai_chat() retries lazily on the first request.
+    """
+    if not getattr(settings, "AI_ENGINE_PRELOAD", False):
+        return
+    try:
+        get_ai_chat()
+        logger.info("AI engine preloaded")
+    except Exception as e:
+        logger.error(f"AI engine preload failed: {e}")
+
+def get_engine_status():
+    """Readiness of each component of the singleton, without triggering a load."""
+    ai_chat = _ai_chat_instance
+    status = {
+        "model": ai_chat is not None and ai_chat.vector_store.embeddings is not None,
+        "index": ai_chat is not None and ai_chat.vector_store.vector_db is not None,
+        "agent": ai_chat is not None and ai_chat.agent_executor is not None,
+        "loading": _ai_chat_lock.locked(),
+    }
+    status["ready"] = status["model"] and status["index"] and status["agent"]
+    if ai_chat is not None:
+        status["index_version"] = ai_chat.vector_store.version
+        status["query_cache"] = ai_chat.vector_store.cache_stats()
+    status["tool_cache"] = tool_cache.stats()
+    return status
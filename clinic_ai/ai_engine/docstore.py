@@ -0,0 +1,108 @@
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+from .bm25 import BM25Index
+from collections.abc import Mapping
+import json
+import sqlite3
+import threading
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Chunk text and metadata for the FAISS index, stored in a SQLite file next to
+    index.faiss. Only the documents of the k hits are read, so chunk text does not
+    live in each worker's heap. Also stores the FAISS position -> chunk ID table
+    and the BM25 lexical index over the same chunks.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = str(path)
+        self.read_only = read_only
+        # sqlite3 connections are per thread; tools and views run in several threads
+        self._local = threading.local()
+        self.bm25 = BM25Index(self)
+        if read_only:
+            # A published version is read through one connection opened now and
+            # shared by every thread, so it stays readable after _prune_versions
+            # deletes its directory (a new connection to it would fail)
+            self._shared = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._lock = threading.Lock()
+        else:
+            with self._conn() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)")
+                conn.execute("CREATE TABLE IF NOT EXISTS positions (position INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+                BM25Index.create_tables(conn)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _read(self, sql, params=()):
+        """All rows of a query, through the shared connection of a read-only store."""
+        if self.read_only:
+            with self._lock:
+                return self._shared.execute(sql, params).fetchall()
+        return self._conn().execute(sql, params).fetchall()
+
+    def search(self, search):
+        rows = self._read("SELECT content, metadata FROM documents WHERE id = ?", (search,))
+        if not rows:
+            # Same contract as InMemoryDocstore
+            return f"ID {search} not found."
+        content, metadata = rows[0]
+        return Document(id=search, page_content=content, metadata=json.loads(metadata))
+
+    def add(self, texts):
+        rows = [(doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for doc_id, doc in texts.items()]
+        try:
+            with self._conn() as conn:
+                conn.executemany("INSERT INTO documents (id, content, metadata) VALUES (?, ?, ?)", rows)
+                self.bm25.add(conn, texts)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Tried to add ids that already exist: {e}")
+
+    def delete(self, ids):
+        with self._conn() as conn:
+            conn.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self.bm25.delete(conn, ids)
+
+    def positions(self):
+        """The full position -> ID table, for an index that is going to be modified."""
+        return dict(self._read("SELECT position, id FROM positions"))
+
+    def save_positions(self, index_to_docstore_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM positions")
+            conn.executemany(
+                "INSERT INTO positions (position, id) VALUES (?, ?)",
+                [(int(position), doc_id) for position, doc_id in index_to_docstore_id.items()]
+            )
+
+    def close(self):
+        conn = self._shared if self.read_only else getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SQLitePositionMap(Mapping):
+    """Read-only index_to_docstore_id that looks positions up on demand."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position):
+        rows = self.docstore._read("SELECT id FROM positions WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __iter__(self):
+        for (position,) in self.docstore._read("SELECT position FROM positions ORDER BY position"):
+            yield position
+
+    def __len__(self):
+        return self.docstore._read("SELECT COUNT(*) FROM positions")[0][0]
@@ -0,0 +1,124 @@
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+
+def extract_chunks(path, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Loads and splits one source file. Module-level so it can run in a worker
+    process. Returns (page count, chunks); a text file counts as one page.
+    """
+    if path.lower().endswith(".pdf"):
+        pages = PyPDFLoader(path).load()
+    else:
+        pages = TextLoader(path, encoding='utf-8').load()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return len(pages), splitter.split_documents(pages)
+
+
+class IngestionStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = 0
+        self.failed = 0
+        self.pages = 0
+        self.chunks = 0
+
+    def as_dict(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "files": self.files,
+            "failed": self.failed,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "seconds": round(elapsed, 2),
+            "pages_per_s": round(self.pages / elapsed, 2),
+            "chunks_per_s": round(self.chunks / elapsed, 2),
+        }
+
+
+class IngestionPipeline:
+    """
+    Streams source files into a FAISS store: text extraction and splitting run in
+    a process pool (when workers > 1), and chunks are embedded and appended in
+    fixed-size batches as they arrive. At most `2 * workers` files are in flight,
+    so peak memory depends on the batch size, not on the corpus.
+    """
+
+    def __init__(self, embeddings, batch_size=64, workers=1, progress=None):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.progress = progress
+        self.stats = IngestionStats()
+
+    def _extracted(self, paths):
+        """Yields (name, page count, chunks, error) for each file as it is done."""
+        if self.workers == 1:
+            for name, path in paths:
+                try:
+                    yield (name, *extract_chunks(path), None)
+                except Exception as e:
+                    yield name, 0, [], e
+            return
+
+        pending = iter(paths)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = {}
+            while True:
+                while len(in_flight) < 2 * self.workers:
+                    item = next(pending, None)
+                    if item is None:
+                        break
+                    in_flight[pool.submit(extract_chunks, item[1])] = item[0]
+                if not in_flight:
+                    return
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = in_flight.pop(future)
+                    try:
+                        yield (name, *future.result(), None)
+                    except Exception as e:
+                        yield name, 0, [], e
+
+    def run(self, paths, add_batch, chunk_ids):
+        """
+        Ingests `paths` ([(name, path)]). `chunk_ids(name, n)` names the chunks of
+        a file, `add_batch(texts, vectors, metadatas, ids)` stores one embedded
+        batch. Returns {name: [chunk ids]} for the files that were ingested.
+        """
+        ingested = {}
+        batch = []
+        for name, pages, chunks, error in self._extracted(paths):
+            if error is not None:
+                logger.warning(f"Error loading {name}: {error}")
+                self.stats.failed += 1
+                continue
+            self.stats.files += 1
+            self.stats.pages += pages
+            if not chunks:
+                continue
+            ids = chunk_ids(name, len(chunks))
+            ingested[name] = ids
+            batch.extend(zip(ids, chunks))
+            while len(batch) >= self.batch_size:
+                self._flush(batch[:self.batch_size], add_batch)
+                batch = batch[self.batch_size:]
+        if batch:
+            self._flush(batch, add_batch)
+        return ingested
+
+    def _flush(self, batch, add_batch):
+        texts = [chunk.page_content for _, chunk in batch]
+        vectors = self.embeddings.embed_documents(texts)
+        add_batch(texts, vectors, [chunk.metadata for _, chunk in batch], [chunk_id for chunk_id, _ in batch])
+        self.stats.chunks += len(batch)
+        if self.progress:
+            self.progress(self.stats.as_dict())
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+from .reports import RENDERERS, table_from_dicts
+from . import report_cache
+from . import report_specs
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Claims of a job before it is given up on (each crash of a worker mid-build costs one)
+MAX_ATTEMPTS = 3
+
+
+def enqueue_report(user, kind, rows=None, spec=None):
+    """
+    Queues a `kind` ("pdf" / "xlsx") report and returns its ReportJob. The data
+    is either `rows` (a list of dicts) or a parsed report spec, whose rows the
+    worker reads from the database (see report_specs). When the same rows were
+    rendered before, the job is created already done with the cached file.
+    """
+    from clinic_ai.models import ReportJob
+
+    if kind not in RENDERERS:
+        raise ValueError(f"Unknown report kind: {kind}")
+    job = ReportJob(
+        user=user if user is not None and user.is_authenticated else None,
+        kind=kind,
+        payload=rows or [],
+        spec=spec
+    )
+    if rows:
+        cached = report_cache.lookup(kind, report_cache.report_key(kind, *table_from_dicts(rows)))
+        if cached:
+            job.status, job.filename, job.finished_at = 'done', cached, timezone.now()
+    job.save()
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Puts back jobs left running for longer than REPORT_JOB_TIMEOUT seconds (their
+    worker died or was killed), or fails them once MAX_ATTEMPTS is reached.
+    """
+    from clinic_ai.models import ReportJob
+
+    now = timezone.now()
+    stale = ReportJob.objects.filter(
+        status='running',
+        started_at__lt=now - timedelta(seconds=getattr(settings, "REPORT_JOB_TIMEOUT", 600))
+    )
+    stale.filter(attempts__lt=MAX_ATTEMPTS).update(status='pending', worker='')
+    stale.update(status='failed', error="Worker did not finish the report", finished_at=now)
+
+
+def claim_next_job(worker):
+    """
+    Marks the oldest pending job as running for `worker` and returns it, or None
+    when the queue is empty. The claim is a conditional UPDATE, so concurrent
+    workers never take the same job and no broker or row lock is needed.
+    """
+    from clinic_ai.models import ReportJob
+
+    while True:
+        job_id = (
+            ReportJob.objects.filter(status='pending')
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        claimed = ReportJob.objects.filter(pk=job_id, status='pending').update(
+            status='running',
+            worker=worker,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return ReportJob.objects.get(pk=job_id)
+        # Another worker was faster; try the next job
+
+
+def run_job(job):
+    """
+    Produces a claimed job's file and records the outcome on it. The rows are
+    hashed while they are rendered; a report with the same format and rows
+    keeps using the cached file.
+    """
+    from clinic_ai.models import ReportJob
+
+    try:
+        if job.spec:
+            # Streamed from the database in a single pass
+            headers, rows = report_specs.build_rows(job.spec, job.user)
+        else:
+            headers, rows = table_from_dicts(job.payload)
+        filename = report_cache.store(job.kind, headers, rows, RENDERERS[job.kind])
+    except Exception as e:
+        logger.exception(f"Report job {job.pk} failed")
+        ReportJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), finished_at=timezone.now())
+    else:
+        ReportJob.objects.filter(pk=job.pk).update(status='done', filename=filename, error='', finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,193 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from django.conf import settings
+import logging
+import math
+import tiktoken
+import time
+
+logger = logging.getLogger(__name__)
+
+# Model whose tokenizer is used for the budget (the agent's LLM)
+TOKENIZER_MODEL = "gpt-4o-mini"
+
+# Turns merged into the summary per request at most (after a long backlog,
+# e.g. the first request of an old session, older turns are dropped)
+MAX_FOLD_TURNS = 20
+
+# Role and separator tokens the chat format adds around every message
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = """أنت تلخص محادثة بين مريض ومساعد مركز طبي.
+حدّث الملخص الحالي بإضافة الرسائل الجديدة. احتفظ بالحقائق المهمة فقط: اسم المريض، الأعراض، العيادات والأطباء المذكورون، المواعيد المحجوزة أو المقترحة، والطلبات المعلقة. لا تذكر روابط الملفات أو الجداول الكاملة.
+اكتب الملخص بالعربية في فقرة واحدة لا تتجاوز {max_words} كلمة.
+
+الملخص الحالي:
+{summary}
+
+الرسائل الجديدة:
+{turns}"""
+
+
+# Without the tokenizer, token counts are estimated from the length; Arabic
+# averages more than 3 characters per token, so this errs on the high side
+CHARS_PER_TOKEN = 3
+
+# Seconds before loading a tokenizer that failed to load is tried again
+ENCODING_RETRY_INTERVAL = 300
+
+_encoding = None
+_encoding_retry_at = 0.0
+
+
+def get_encoding():
+    """
+    The tokenizer, or None while it cannot be loaded. tiktoken downloads its
+    files on first use unless TIKTOKEN_CACHE_DIR holds them (the Docker image
+    fetches them at build time); without network that fails, and chat history
+    falls back to estimated counts instead of failing the request.
+    """
+    global _encoding, _encoding_retry_at
+    if _encoding is None and time.monotonic() >= _encoding_retry_at:
+        try:
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            _encoding_retry_at = time.monotonic() + ENCODING_RETRY_INTERVAL
+            logger.warning(f"Tokenizer unavailable, estimating token counts: {e}")
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return math.ceil(len(text or "") / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD
+    return len(encoding.encode(text or "", disallowed_special=())) + MESSAGE_OVERHEAD
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = get_encoding()
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        return text if len(text or "") <= limit else text[:limit] + " …"
+    tokens = encoding.encode(text or "", disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + " …"
+
+
+class ConversationMemory:
+    """
+    Builds the agent's chat_history for one session within a token budget:
+    the most recent turns verbatim, newest first, until HISTORY_TOKEN_BUDGET is
+    reached, preceded by a rolling summary of everything older. Turns that fall
+    out of the budget are folded into ChatSession.summary once and marked with
+    summarized_until, so each request reads only the unsummarized tail.
+    """
+
+    def __init__(self, budget=None, summary_tokens=None):
+        self.budget = budget or getattr(settings, "HISTORY_TOKEN_BUDGET", 2000)
+        self.summary_tokens = summary_tokens or getattr(settings, "HISTORY_SUMMARY_TOKENS", 400)
+        self._llm = None
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+            self._llm = ChatOpenAI(model=TOKENIZER_MODEL, temperature=0, max_tokens=self.summary_tokens, timeout=60)
+        return self._llm
+
+    def messages(self, user, session_id):
+        """chat_history messages for the next turn of `session_id`, oldest first."""
+        from clinic_ai.models import ChatLog, ChatSession
+
+        if not session_id:
+            return []
+        session = ChatSession.objects.filter(user=user, session_id=session_id).first()
+        if session is None:
+            return []
+
+        # Unsummarized turns only; folding keeps this tail close to the budget
+        tail = ChatLog.objects.filter(user=user, session_id=session_id)
+        if session.summarized_until:
+            tail = tail.filter(id__gt=session.summarized_until)
+        tail = tail.order_by("-created_at", "-id").only("id", "question", "answer")
+
+        budget = self.budget - (count_tokens(session.summary) if session.summary else 0)
+        turns, total = [], 0
+        for log in tail.iterator():
+            cost = count_tokens(log.question) + count_tokens(log.answer)
+            turns.append((log, cost))
+            total += cost
+            if total > budget and len(turns) > MAX_FOLD_TURNS:
+                # Older turns are dropped rather than summarized, which bounds the summary call
+                break
+
+        # Within budget: everything verbatim. Over budget: keep the newest turns up to
+        # half the budget and fold the rest, so the next few turns need no fold
+        keep = len(turns)
+        if total > budget:
+            keep, kept_cost = 0, 0
+            while keep < len(turns) and kept_cost + turns[keep][1] <= budget // 2:
+                kept_cost += turns[keep][1]
+                keep += 1
+
+        recent = [(log.question, log.answer) for log, _ in turns[:keep]]
+        if not recent and turns:
+            # The newest turn alone is too big (a report, a long schedule): keep its start
+            log = turns[0][0]
+            recent = [(log.question, truncate_tokens(log.answer, max(budget // 2 - count_tokens(log.question), self.budget // 4)))]
+            keep = 1
+
+        summary = session.summary
+        overflow = [log for log, _ in turns[keep:keep + MAX_FOLD_TURNS]]
+        if overflow:
+            summary = self._fold(session, list(reversed(overflow)), until=turns[keep][0].id)
+
+        history = []
+        if summary:
+            history.append(SystemMessage(content=f"ملخص ما سبق من المحادثة: {summary}"))
+        for question, answer in reversed(recent):
+            history.append(HumanMessage(content=question))
+            history.append(AIMessage(content=answer))
+        return history
+
+    def _fold(self, session, logs, until):
+        """
+        Merges `logs` (oldest first) into the session summary and persists it as
+        covering every turn up to the ChatLog id `until`.
+        """
+        from clinic_ai.models import ChatSession
+
+        turns = "\n".join(
+            f"المريض: {log.question}\nالمساعد: {truncate_tokens(log.answer, self.summary_tokens)}" for log in logs
+        )
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.summary_tokens // 2,
+            summary=session.summary or "(لا يوجد)",
+            turns=turns
+        )
+        try:
+            summary = self.llm.invoke(prompt).content.strip()
+        except Exception as e:
+            # The turns stay unsummarized and are retried on the next request
+            logger.error(f"Could not summarize chat session {session.pk}: {e}")
+            return session.summary
+
+        # Only the first of two concurrent requests folding the same turns wins
+        ChatSession.objects.filter(pk=session.pk, summarized_until=session.summarized_until).update(
+            summary=summary,
+            summarized_until=until
+        )
+        return summary
+
+
+_memory = None
+
+
+def get_memory():
+    global _memory
+    if _memory is None:
+        _memory = ConversationMemory()
+    return _memory
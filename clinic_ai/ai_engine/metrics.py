@@ -0,0 +1,162 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from collections import defaultdict
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+
+# Metrics of the chat request being served, so code below the agent (the
+# vector store) can record its stages without new parameters
+current_metrics = contextvars.ContextVar("current_metrics", default=None)
+
+STAGES = ("history", "retrieval", "embedding", "search", "llm", "tools", "db")
+
+
+@contextmanager
+def record_stage(name):
+    """Times the block into the current request's metrics, if there is one."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+class RequestMetrics(BaseCallbackHandler):
+    """
+    Timings and token counts of one chat request. Stages are timed explicitly
+    (history, retrieval and its embedding/search parts) or from callbacks (each
+    LLM call and each tool run); DB time comes from an execute wrapper. The
+    result is stored as a ChatMetrics row next to the request's ChatLog.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.tools = []
+        self.llm_calls = 0
+        self.db_queries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._runs = {}
+        # Callbacks of async runs are called from executor threads
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            self.stages[stage] += ms
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def _finish(self, run_id):
+        kind, name, start = self._runs.pop(run_id, (None, None, None))
+        return kind, name, (time.perf_counter() - start) * 1000 if start else 0.0
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = ("llm", None, time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = ("llm", None, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        _, _, ms = self._finish(run_id)
+        prompt_tokens, completion_tokens = self._token_usage(response)
+        with self._lock:
+            self.stages["llm"] += ms
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        _, _, ms = self._finish(run_id)
+        self.add("llm", ms)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._runs[run_id] = ("tool", (serialized or {}).get("name", ""), time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        _, name, ms = self._finish(run_id)
+        with self._lock:
+            self.stages["tools"] += ms
+            self.tools.append({"name": name, "ms": round(ms, 1)})
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        _, name, ms = self._finish(run_id)
+        with self._lock:
+            self.stages["tools"] += ms
+            self.tools.append({"name": name, "ms": round(ms, 1), "error": True})
+
+    @staticmethod
+    def _token_usage(response):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        # Streaming responses report usage on the final message instead
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+        return prompt_tokens, completion_tokens
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook timing every query run by the agent's thread."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.stages["db"] += (time.perf_counter() - start) * 1000
+                self.db_queries += 1
+
+    def as_fields(self):
+        fields = {f"{stage}_ms": round(self.stages.get(stage, 0.0), 1) for stage in STAGES}
+        fields.update({
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "iterations": self.llm_calls,
+            "db_queries": self.db_queries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tools": self.tools,
+        })
+        return fields
+
+    def save(self, chat_log):
+        from clinic_ai.models import ChatMetrics
+        return ChatMetrics.objects.create(chat_log=chat_log, **self.as_fields())
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty sorted list."""
+    return values[max(0, min(len(values) - 1, -(-len(values) * p // 100) - 1))]
+
+
+def summarize(metrics_rows):
+    """
+    p50/p95 per stage and per tool over ChatMetrics rows, for the admin
+    changelist: {"count", "stages": [(stage, p50, p95)], "tools": [(name, calls, p50, p95)]}.
+    """
+    rows = list(metrics_rows)
+    if not rows:
+        return {"count": 0, "stages": [], "tools": []}
+    stages = []
+    for field in ("total_ms",) + tuple(f"{stage}_ms" for stage in STAGES) + ("iterations", "prompt_tokens", "completion_tokens", "db_queries"):
+        values = sorted(getattr(row, field) for row in rows)
+        stages.append((field, percentile(values, 50), percentile(values, 95)))
+    by_tool = defaultdict(list)
+    for row in rows:
+        for call in row.tools or ():
+            by_tool[call.get("name", "")].append(call.get("ms", 0))
+    tools = []
+    for name, durations in sorted(by_tool.items(), key=lambda item: -len(item[1])):
+        durations.sort()
+        tools.append((name, len(durations), percentile(durations, 50), percentile(durations, 95)))
+    return {"count": len(rows), "stages": stages, "tools": tools}
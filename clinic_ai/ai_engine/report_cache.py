@@ -0,0 +1,142 @@
+from django.conf import settings
+from .reports import Rows
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Reports live under MEDIA_ROOT/reports/, named by the hash of their content
+REPORTS_DIR = "reports"
+
+# Files written before reports were content-addressed, directly under MEDIA_ROOT
+LEGACY_PREFIXES = ("report_", "premium_report_")
+
+
+def new_digest(kind, headers):
+    """A report_key digest with the format and headers added; rows go through add_row()."""
+    return hashlib.sha256(json.dumps([kind, list(headers)], ensure_ascii=False).encode())
+
+
+def add_row(digest, row):
+    digest.update(b"\n")
+    digest.update(json.dumps(row, ensure_ascii=False, default=str).encode())
+
+
+def report_key(kind, headers, rows):
+    """SHA-256 of a report's format, headers and rows; identical reports share a key."""
+    digest = new_digest(kind, headers)
+    for row in rows:
+        add_row(digest, row)
+    return digest.hexdigest()
+
+
+def artifact_name(kind, key):
+    """Path of a report relative to MEDIA_ROOT, as stored in ReportJob.filename."""
+    return f"{REPORTS_DIR}/{key[:32]}.{kind}"
+
+
+def lookup(kind, key):
+    """The cached report's name if it exists, marking it as recently used."""
+    name = artifact_name(kind, key)
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        # The mtime is the last use, which eviction goes by
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return name
+
+
+def store(kind, headers, rows, render):
+    """
+    Renders a report with render(headers, rows, path) and returns its name. The
+    rows are hashed as the renderer reads them, so they are read only once, and
+    the file is then renamed into its content-addressed place; if an identical
+    report is already cached, the new copy is dropped and the cached one used.
+    A concurrent reader never sees a partial file, and two workers rendering
+    the same report simply replace one copy with the other.
+    """
+    reports_dir = os.path.join(settings.MEDIA_ROOT, REPORTS_DIR)
+    os.makedirs(reports_dir, exist_ok=True)
+    partial = os.path.join(reports_dir, f"{uuid.uuid4().hex}.partial")
+    digest = new_digest(kind, headers)
+
+    def hashed():
+        for row in rows:
+            add_row(digest, row)
+            yield row
+
+    try:
+        render(headers, Rows(hashed(), lambda: len(rows)), partial)
+        key = digest.hexdigest()
+        name = lookup(kind, key)
+        if name is None:
+            name = artifact_name(kind, key)
+            os.replace(partial, os.path.join(settings.MEDIA_ROOT, name))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return name
+
+
+def report_files():
+    """[(name, size, mtime)] of every report file, legacy ones included, oldest use first."""
+    files = []
+    reports_dir = os.path.join(settings.MEDIA_ROOT, REPORTS_DIR)
+    candidates = []
+    if os.path.isdir(reports_dir):
+        candidates += [(f"{REPORTS_DIR}/{entry}", os.path.join(reports_dir, entry)) for entry in os.listdir(reports_dir)]
+    if os.path.isdir(settings.MEDIA_ROOT):
+        candidates += [
+            (entry, os.path.join(settings.MEDIA_ROOT, entry)) for entry in os.listdir(settings.MEDIA_ROOT)
+            if entry.startswith(LEGACY_PREFIXES) and entry.endswith((".pdf", ".xlsx"))
+        ]
+    for name, path in candidates:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if os.path.isfile(path):
+            files.append((name, stat.st_size, stat.st_mtime))
+    return sorted(files, key=lambda item: item[2])
+
+
+def evict(max_age=None, max_bytes=None, now=None):
+    """
+    Deletes reports unused for more than `max_age` seconds, then the least
+    recently used ones until the rest fit in `max_bytes`. Jobs whose file was
+    deleted are marked expired. Returns {"deleted", "freed", "kept", "bytes"}.
+    """
+    from clinic_ai.models import ReportJob
+
+    max_age = max_age if max_age is not None else getattr(settings, "REPORT_CACHE_MAX_AGE", 7 * 24 * 3600)
+    max_bytes = max_bytes if max_bytes is not None else getattr(settings, "REPORT_CACHE_MAX_BYTES", 1 << 30)
+    now = now or time.time()
+
+    files = report_files()
+    total = sum(size for _, size, _ in files)
+    deleted, freed = [], 0
+    render_timeout = getattr(settings, "REPORT_JOB_TIMEOUT", 600)
+    for name, size, mtime in files:
+        if name.endswith(".partial"):
+            # Still being written, unless its worker is long gone
+            if now - mtime <= render_timeout:
+                continue
+        elif now - mtime <= max_age and total - freed <= max_bytes:
+            continue
+        try:
+            os.remove(os.path.join(settings.MEDIA_ROOT, name))
+        except FileNotFoundError:
+            continue
+        deleted.append(name)
+        freed += size
+
+    if deleted:
+        for start in range(0, len(deleted), 500):
+            ReportJob.objects.filter(status='done', filename__in=deleted[start:start + 500]).update(status='expired')
+        logger.info(f"Evicted {len(deleted)} reports ({freed} bytes)")
+    return {"deleted": len(deleted), "freed": freed, "kept": len(files) - len(deleted), "bytes": total - freed}
@@ -0,0 +1,166 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from .reports import Rows
+from .resolver import resolver
+from .schedule import DAYS_AR
+from .slots import to_db, to_local
+import json
+
+# Rows a single report may hold; larger requests are asked to narrow their filters
+MAX_REPORT_ROWS = 100000
+
+# label: column header; field: values_list() path; format: value -> cell text
+Column = namedtuple("Column", "label field format", defaults=(None,))
+
+STATUS_AR = {"pending": "قيد الانتظار", "confirmed": "مؤكد", "cancelled": "ملغي"}
+
+
+def format_datetime(value):
+    return to_local(value).strftime('%Y-%m-%d %H:%M') if value else ""
+
+
+def format_time(value):
+    return value.strftime('%H:%M') if value else ""
+
+
+ENTITIES = {
+    "appointments": {
+        "columns": {
+            "id": Column("رقم الموعد", "id"),
+            "date": Column("التاريخ والوقت", "appointment_date", format_datetime),
+            "patient": Column("المريض", "user__username"),
+            "doctor": Column("الطبيب", "doctor__name"),
+            "specialty": Column("التخصص", "doctor__specialty"),
+            "clinic": Column("العيادة", "clinic__name"),
+            "duration": Column("المدة (دقيقة)", "duration_minutes"),
+            "status": Column("الحالة", "status", lambda value: STATUS_AR.get(value, value)),
+        },
+        "default_columns": ["date", "doctor", "clinic", "status"],
+        "ordering": ("appointment_date", "id"),
+    },
+    "doctors": {
+        "columns": {
+            "name": Column("اسم الطبيب", "name"),
+            "specialty": Column("التخصص", "specialty"),
+            "clinic": Column("العيادة", "clinic__name"),
+            "slot_minutes": Column("مدة الموعد (دقيقة)", "slot_minutes"),
+        },
+        "default_columns": ["name", "specialty", "clinic"],
+        "ordering": ("clinic__name", "name", "id"),
+    },
+    "availability": {
+        "columns": {
+            "doctor": Column("الطبيب", "doctor__name"),
+            "specialty": Column("التخصص", "doctor__specialty"),
+            "clinic": Column("العيادة", "doctor__clinic__name"),
+            "day": Column("اليوم", "day_of_week", lambda value: DAYS_AR[value]),
+            "start": Column("من", "start_time", format_time),
+            "end": Column("إلى", "end_time", format_time),
+        },
+        "default_columns": ["doctor", "clinic", "day", "start", "end"],
+        "ordering": ("doctor__name", "day_of_week", "start_time", "id"),
+    },
+}
+
+FORMATS = {"pdf", "xlsx"}
+
+
+class ReportSpecError(ValueError):
+    """The spec cannot be turned into a report; the message is shown to the agent."""
+
+
+def parse_spec(spec_json):
+    """
+    Validates a report spec from the agent and returns it normalized:
+    {"entity", "format", "columns", "clinic", "doctor", "status", "from", "to"}.
+    Raises ReportSpecError.
+    """
+    try:
+        spec = json.loads(spec_json) if isinstance(spec_json, str) else dict(spec_json)
+    except (ValueError, TypeError):
+        raise ReportSpecError("يجب أن تكون مواصفات التقرير بصيغة JSON صالحة.")
+    if not isinstance(spec, dict):
+        raise ReportSpecError("يجب أن تكون مواصفات التقرير كائن JSON.")
+
+    entity = spec.get("entity")
+    if entity not in ENTITIES:
+        raise ReportSpecError(f"نوع البيانات غير معروف. الأنواع المتاحة: {', '.join(ENTITIES)}.")
+    report_format = spec.get("format", "pdf")
+    if report_format not in FORMATS:
+        raise ReportSpecError("الصيغة يجب أن تكون pdf أو xlsx.")
+
+    available = ENTITIES[entity]["columns"]
+    columns = spec.get("columns") or ENTITIES[entity]["default_columns"]
+    if not isinstance(columns, list):
+        raise ReportSpecError("columns يجب أن تكون قائمة.")
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ReportSpecError(f"أعمدة غير معروفة: {', '.join(map(str, unknown))}. الأعمدة المتاحة: {', '.join(available)}.")
+
+    normalized = {"entity": entity, "format": report_format, "columns": columns}
+    for key in ("clinic", "doctor", "status"):
+        if spec.get(key):
+            normalized[key] = str(spec[key])
+    if normalized.get("status") and normalized["status"] not in STATUS_AR:
+        raise ReportSpecError(f"الحالة يجب أن تكون إحدى: {', '.join(STATUS_AR)}.")
+    for key in ("from", "to"):
+        if spec.get(key):
+            try:
+                datetime.strptime(str(spec[key]), '%Y-%m-%d')
+            except ValueError:
+                raise ReportSpecError("التواريخ يجب أن تكون بصيغة YYYY-MM-DD.")
+            normalized[key] = str(spec[key])
+    return normalized
+
+
+def report_queryset(spec, user):
+    """The rows of a parsed spec, with its filters applied and the user's access enforced."""
+    from clinic_ai.models import Appointment, Doctor, DoctorAvailability
+
+    entity = spec["entity"]
+    if entity == "appointments":
+        queryset = Appointment.objects.all()
+        # Patients only see their own appointments; staff see everyone's
+        if user is None or not user.is_authenticated:
+            return queryset.none()
+        if not user.is_staff:
+            queryset = queryset.filter(user=user)
+        doctor_field, clinic_field = "doctor_id", "clinic_id"
+        if spec.get("status"):
+            queryset = queryset.filter(status=spec["status"])
+        if spec.get("from"):
+            queryset = queryset.filter(appointment_date__gte=to_db(datetime.strptime(spec["from"], '%Y-%m-%d')))
+        if spec.get("to"):
+            queryset = queryset.filter(appointment_date__lt=to_db(datetime.strptime(spec["to"], '%Y-%m-%d') + timedelta(days=1)))
+    elif entity == "doctors":
+        queryset = Doctor.objects.all()
+        doctor_field, clinic_field = "id", "clinic_id"
+    else:
+        queryset = DoctorAvailability.objects.all()
+        doctor_field, clinic_field = "doctor_id", "doctor__clinic_id"
+
+    # Names are matched with the same fuzzy resolver as the other tools
+    if spec.get("clinic"):
+        queryset = queryset.filter(**{f"{clinic_field}__in": resolver.clinics(spec["clinic"])})
+    if spec.get("doctor"):
+        queryset = queryset.filter(**{f"{doctor_field}__in": resolver.doctors(spec["doctor"])})
+    return queryset.order_by(*ENTITIES[entity]["ordering"])
+
+
+def build_rows(spec, user):
+    """
+    (headers, Rows) of a parsed spec; rows are streamed from the database with
+    .iterator(), and their count is only queried if the renderer asks for it.
+    """
+    columns = [ENTITIES[spec["entity"]]["columns"][name] for name in spec["columns"]]
+    queryset = report_queryset(spec, user)
+    values = queryset.values_list(*[column.field for column in columns]).iterator(chunk_size=2000)
+
+    def rows():
+        for row in values:
+            yield [
+                column.format(value) if column.format else ("" if value is None else str(value))
+                for column, value in zip(columns, row)
+            ]
+
+    return [column.label for column in columns], Rows(rows(), queryset.count)
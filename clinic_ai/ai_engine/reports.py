@@ -0,0 +1,299 @@
+from django.conf import settings
+from datetime import datetime
+from itertools import chain, islice
+import csv
+import functools
+import os
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font as XLFont
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, PageTemplate, BaseDocTemplate, Frame
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+import arabic_reshaper
+from bidi.algorithm import get_display
+
+# Register Arabic Fonts
+try:
+    pdfmetrics.registerFont(TTFont('Arabic', '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf'))
+    pdfmetrics.registerFont(TTFont('Arabic-Bold', '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Bold.ttf'))
+except TTFError:
+    pass
+
+# Report cells repeat (names, specialties, statuses), so each string is shaped once
+@functools.lru_cache(maxsize=8192)
+def fix_arabic(text):
+    if not text:
+        return ""
+    if text.isascii():
+        # IDs, dates and numbers: nothing to reshape or reorder
+        return text
+    reshaped_text = arabic_reshaper.reshape(text)
+    bidi_text = get_display(reshaped_text)
+    return bidi_text
+
+def write_xlsx(headers, rows, target, title="Report"):
+    """
+    Writes `headers` and the `rows` iterable to `target` (a path or a binary file)
+    with a write-only workbook. Rows are serialized as they are appended, so
+    memory stays flat however many there are.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = XLFont(bold=True)
+        header_cells.append(cell)
+    ws.append(header_cells)
+    for row in rows:
+        ws.append(row)
+    wb.save(target)
+
+class Echo:
+    """File-like object whose write() returns the data, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+def csv_stream(headers, rows):
+    """Yields `headers` and the `rows` iterable as CSV lines, with a BOM so Excel reads Arabic correctly."""
+    writer = csv.writer(Echo())
+    yield "\ufeff" + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+class Rows:
+    """Row iterable that knows its length up front, so it can be streamed into render_pdf."""
+
+    def __init__(self, rows, count):
+        self.rows = rows
+        # An int, or a callable run the first time the length is asked for
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        if callable(self.count):
+            self.count = self.count()
+        return self.count
+
+def table_from_dicts(data):
+    """(headers, Rows) of a list of dicts, the first one's keys as headers."""
+    headers = list(data[0].keys())
+    return headers, Rows(([str(entry.get(header, "")) for header in headers] for entry in data), len(data))
+
+def render_excel(headers, rows, filepath):
+    """Writes `headers` and the `rows` iterable (lists of cell values) as an .xlsx workbook."""
+    write_xlsx(headers, rows, filepath)
+
+# Color Palette - Premium Navy & Cyan
+NAVY = colors.HexColor("#0F172A")
+LIGHT_NAVY = colors.HexColor("#1E293B")
+CYAN = colors.HexColor("#38BDF8")
+BG_LIGHT = colors.HexColor("#F8FAFC")
+
+# Data rows per table chunk. ReportLab lays out and splits one Table at a time,
+# so a single table over all rows costs far more than linear time
+PDF_CHUNK_ROWS = 500
+# Rows sampled to size the columns, shared by every chunk
+PDF_WIDTH_SAMPLE = 200
+
+# Main table geometry: row heights are computed from each row's line count,
+# so chunks skip measuring their rows
+HEADER_FONT_SIZE = 11
+BODY_FONT_SIZE = 10
+BODY_LEADING = BODY_FONT_SIZE * 1.2
+HEADER_ROW_HEIGHT = HEADER_FONT_SIZE + 24
+BODY_ROW_HEIGHT = BODY_FONT_SIZE + 20
+CELL_PADDING = 6
+
+TITLE_STYLE = ParagraphStyle('TitleDash', fontName='Arabic-Bold', fontSize=16, textColor=LIGHT_NAVY, spaceAfter=30, alignment=TA_RIGHT)
+SUMMARY_COUNT_STYLE = ParagraphStyle('S1', fontName='Arabic', fontSize=12, textColor=NAVY)
+SUMMARY_STATUS_STYLE = ParagraphStyle('S2', fontName='Arabic', fontSize=12, textColor=colors.HexColor("#10B981")) # Emerald
+STAMP_STYLE = ParagraphStyle('Stamp', fontName='Arabic', fontSize=10, textColor=colors.lightgrey, alignment=TA_CENTER)
+
+SUMMARY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,-1), colors.HexColor("#F1F5F9")),
+    ('BOX', (0,0), (-1,-1), 1, colors.HexColor("#E2E8F0")),
+    ('PADDING', (0,0), (-1,-1), 10),
+    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+])
+
+MAIN_TABLE_STYLE = TableStyle([
+    # Modern Header
+    ('BACKGROUND', (0, 0), (-1, 0), LIGHT_NAVY),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Arabic-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), HEADER_FONT_SIZE),
+    ('LEFTPADDING', (0, 0), (-1, -1), CELL_PADDING),
+    ('RIGHTPADDING', (0, 0), (-1, -1), CELL_PADDING),
+
+    # Subtle Body
+    ('FONTNAME', (0, 1), (-1, -1), 'Arabic'),
+    ('FONTSIZE', (0, 1), (-1, -1), BODY_FONT_SIZE),
+    ('LEADING', (0, 1), (-1, -1), BODY_LEADING),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, BG_LIGHT]),
+    ('GRID', (0, 0), (-1, -1), 0.1, colors.HexColor("#CBD5E1")),
+    ('LINEBELOW', (0, 0), (-1, 0), 2, CYAN),
+])
+
+class PremiumDoc(BaseDocTemplate):
+    """A4 report with the navy header band, logo and page footer on every page."""
+
+    def __init__(self, filename, logo_path=None, **kw):
+        self.logo_path = logo_path
+        super().__init__(filename, **kw)
+        frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height - 100, id='normal')
+        self.addPageTemplates([PageTemplate(id='First', frames=frame, onPage=self.on_page)])
+
+    def on_page(self, canvas, doc):
+        canvas.saveState()
+        # Background color for header
+        canvas.setFillColor(NAVY)
+        canvas.rect(0, A4[1]-120, A4[0], 120, fill=1)
+
+        # Draw Logo if exists
+        if self.logo_path and os.path.exists(self.logo_path):
+            canvas.drawImage(self.logo_path, 40, A4[1]-100, width=80, height=80, mask='auto')
+
+        # Header Text
+        canvas.setFillColor(colors.white)
+        canvas.setFont('Arabic-Bold', 22)
+        canvas.drawRightString(A4[0]-40, A4[1]-60, fix_arabic("المركز الطبي الذكي"))
+        canvas.setFont('Arabic', 10)
+        canvas.drawRightString(A4[0]-40, A4[1]-85, fix_arabic("Smart Clinic Center - Premium AI Intelligence"))
+
+        # Bottom Decorative Line
+        canvas.setStrokeColor(CYAN)
+        canvas.setLineWidth(3)
+        canvas.line(40, A4[1]-120, A4[0]-40, A4[1]-120)
+
+        # Footer
+        canvas.setFillColor(colors.grey)
+        canvas.setFont('Arabic', 9)
+        canvas.drawString(40, 20, fix_arabic(f"تاريخ الإصدار: {datetime.now().strftime('%Y-%m-%d')}"))
+        canvas.drawRightString(A4[0]-40, 20, fix_arabic(f"صفحة {canvas.getPageNumber()}"))
+        canvas.restoreState()
+
+def column_widths(headers, rows, max_width):
+    """Widths fitting the header and a sample of rows, scaled down to `max_width` if needed."""
+    widths = [pdfmetrics.stringWidth(h, 'Arabic-Bold', HEADER_FONT_SIZE) for h in headers]
+    for row in islice(rows, PDF_WIDTH_SAMPLE):
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], pdfmetrics.stringWidth(value, 'Arabic', BODY_FONT_SIZE))
+    widths = [w + 2 * CELL_PADDING + 2 for w in widths]
+    total = sum(widths)
+    if total > max_width:
+        widths = [w * max_width / total for w in widths]
+    return widths
+
+@functools.lru_cache(maxsize=8192)
+def wrap_cell(text, width):
+    """
+    (cell text, line count) for a value in a column `width` points wide. Values
+    that do not fit are split into lines before the bidi reordering, so the
+    lines of a right-to-left value stay in reading order.
+    """
+    shaped = fix_arabic(text)
+    if pdfmetrics.stringWidth(shaped, 'Arabic', BODY_FONT_SIZE) <= width:
+        return shaped, 1
+    lines = simpleSplit(arabic_reshaper.reshape(text), 'Arabic', BODY_FONT_SIZE, width)
+    return "\n".join(get_display(line) for line in lines), len(lines)
+
+def table_chunks(headers, rows, widths):
+    """
+    One Table per PDF_CHUNK_ROWS rows of the `rows` iterable, each with the
+    header row repeated on every page it spans. Long values wrap and their row
+    grows by one leading per extra line.
+    """
+    rows = iter(rows)
+    text_widths = [w - 2 * CELL_PADDING for w in widths]
+    while chunk := list(islice(rows, PDF_CHUNK_ROWS)):
+        cells, heights = [], []
+        for row in chunk:
+            wrapped = [wrap_cell(value, width) for value, width in zip(row, text_widths)]
+            cells.append([text for text, _ in wrapped])
+            heights.append(BODY_ROW_HEIGHT + (max(lines for _, lines in wrapped) - 1) * BODY_LEADING)
+        table = Table(
+            [headers] + cells,
+            colWidths=widths,
+            rowHeights=[HEADER_ROW_HEIGHT] + heights,
+            hAlign='CENTER',
+            repeatRows=1
+        )
+        table.setStyle(MAIN_TABLE_STYLE)
+        yield table
+
+class LazyFlowables(list):
+    """
+    Flowable list for doc.build() that takes the next flowable from an iterator
+    only when the previous ones have been laid out, so the table chunks are
+    created one at a time instead of all before the build.
+    """
+
+    def __init__(self, flowables):
+        super().__init__()
+        self.pending = iter(flowables)
+
+    def __len__(self):
+        if not super().__len__():
+            self.extend(islice(self.pending, 1))
+        return super().__len__()
+
+def render_pdf(headers, rows, filepath):
+    """
+    Writes `headers` and `rows` (a list or Rows of lists of cell text) as the
+    premium dashboard-style PDF report. The rows are read as the layout
+    reaches them.
+    """
+    total = len(rows)
+    headers = [fix_arabic(h) for h in headers]
+
+    logo_path = os.path.join(settings.MEDIA_ROOT, 'assets/logo.png')
+    doc = PremiumDoc(filepath, logo_path=logo_path, pagesize=A4, rightMargin=40, leftMargin=40, topMargin=140, bottomMargin=40)
+    elements = []
+
+    # Dashboard Style Title
+    elements.append(Paragraph(fix_arabic("تقرير تحليل البيانات والفرق الطبية"), TITLE_STYLE))
+
+    # Summary Area (Mini Cards)
+    summary_data = [
+        [
+            Paragraph(fix_arabic(f"إجمالي السجلات: {total}"), SUMMARY_COUNT_STYLE),
+            Paragraph(fix_arabic("الحالة: تقرير رسمي"), SUMMARY_STATUS_STYLE)
+        ]
+    ]
+    summary_table = Table(summary_data, colWidths=[150, 150])
+    summary_table.setStyle(SUMMARY_TABLE_STYLE)
+    elements.append(summary_table)
+    elements.append(Spacer(1, 40))
+
+    # Main Data Table, in chunks built as the layout reaches them; shaping is
+    # cached, so repeated values are shaped once. The width sample is put back
+    # in front of the rows it was taken from
+    rows = iter(rows)
+    sample = list(islice(rows, PDF_WIDTH_SAMPLE))
+    widths = column_widths(headers, ([fix_arabic(value) for value in row] for row in sample), doc.width - 12)
+    rows = chain(sample, rows)
+
+    # Stamp / Signature Area
+    closing = [
+        Spacer(1, 50),
+        Paragraph(fix_arabic("تمت المصادقة الرقمية بواسطة نظام ذكاء المركز الطبي"), STAMP_STYLE),
+    ]
+
+    doc.build(LazyFlowables(chain(elements, table_chunks(headers, rows, widths), closing)))
+
+RENDERERS = {
+    "xlsx": render_excel,
+    "pdf": render_pdf,
+}
@@ -0,0 +1,152 @@
+from django.conf import settings
+from collections import Counter, defaultdict
+from .arabic import tokenize
+import threading
+import time
+
+# Honorifics and generic words that users add to names ("د. أحمد", "عيادة الأسنان");
+# they are ignored unless the query has nothing else
+STOPWORDS = {"د", "دكتور", "دكتوره", "طبيب", "طبيبه", "عياده", "عيادات", "قسم", "dr"}
+
+# Minimum trigram Jaccard similarity for a misspelled token to count as a match
+MIN_SIMILARITY = 0.45
+
+# A query token of at least MIN_PREFIX letters that starts an indexed token matches it
+MIN_PREFIX = 3
+PREFIX_SIMILARITY = 0.9
+
+
+def trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Token and trigram indexes over the normalized names of one kind of entity.
+    A query matches an entity when every query token matches one of its tokens,
+    exactly or by trigram similarity; matches are ranked by total similarity.
+    """
+
+    def __init__(self, entries):
+        self.postings = defaultdict(set)
+        for entity_id, text in entries:
+            for token in tokenize(text):
+                self.postings[token].add(entity_id)
+        self.token_grams = {token: trigrams(token) for token in self.postings}
+        self.trigram_tokens = defaultdict(set)
+        for token, grams in self.token_grams.items():
+            for gram in grams:
+                self.trigram_tokens[gram].add(token)
+
+    def similar_tokens(self, token):
+        """[(indexed token, similarity)] for a query token."""
+        grams = trigrams(token)
+        shared = Counter()
+        for gram in grams:
+            for candidate in self.trigram_tokens.get(gram, ()):
+                shared[candidate] += 1
+        matches = []
+        for candidate, count in shared.items():
+            if candidate == token:
+                similarity = 1.0
+            elif len(token) >= MIN_PREFIX and candidate.startswith(token):
+                # Partial names ("سار" for "سارة"), as icontains used to allow
+                similarity = PREFIX_SIMILARITY
+            else:
+                similarity = count / (len(grams) + len(self.token_grams[candidate]) - count)
+            if similarity >= MIN_SIMILARITY:
+                matches.append((candidate, similarity))
+        return matches
+
+    def match(self, query, allowed=None):
+        """[(entity id, score)], best first; `allowed` restricts the candidate IDs."""
+        tokens = tokenize(query)
+        tokens = [token for token in tokens if token not in STOPWORDS] or tokens
+        if not tokens:
+            return []
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for candidate, similarity in self.similar_tokens(token):
+                for entity_id in self.postings[candidate]:
+                    if similarity > token_scores.get(entity_id, 0.0):
+                        token_scores[entity_id] = similarity
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {entity_id: score + token_scores[entity_id] for entity_id, score in scores.items() if entity_id in token_scores}
+            if allowed is not None:
+                scores = {entity_id: score for entity_id, score in scores.items() if entity_id in allowed}
+            if not scores:
+                return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class EntityResolver:
+    """
+    Process-local fuzzy lookup of doctors and clinics by Arabic name, specialty
+    or clinic name, replacing chains of icontains scans in the agent tools.
+    The indexes are built lazily from two queries and dropped by the
+    post_save / post_delete signals in clinic_ai.signals. Saves made by other
+    processes are picked up after ENTITY_RESOLVER_TTL seconds.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, "ENTITY_RESOLVER_TTL", 300)
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self, **kwargs):
+        self._snapshot = None
+
+    def _build(self):
+        from clinic_ai.models import Clinic, Doctor
+
+        doctor_rows = list(Doctor.objects.values_list("id", "name", "specialty", "clinic_id", "clinic__name"))
+        return {
+            "created": time.monotonic(),
+            "clinics": NameIndex(Clinic.objects.values_list("id", "name")),
+            "doctors": NameIndex(
+                (doctor_id, f"{name} {specialty} {clinic_name or ''}")
+                for doctor_id, name, specialty, _, clinic_name in doctor_rows
+            ),
+            "doctor_names": NameIndex((doctor_id, name) for doctor_id, name, _, _, _ in doctor_rows),
+            "doctor_clinic": {doctor_id: clinic_id for doctor_id, _, _, clinic_id, _ in doctor_rows},
+        }
+
+    def _get(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot["created"] > self.ttl:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or time.monotonic() - snapshot["created"] > self.ttl:
+                    snapshot = self._build()
+                    self._snapshot = snapshot
+        return snapshot
+
+    def clinics(self, query):
+        """IDs of the clinics matching `query`, best first."""
+        return [clinic_id for clinic_id, _ in self._get()["clinics"].match(query)]
+
+    def doctors(self, query, clinic_query=None):
+        """
+        IDs of the doctors whose name, specialty or clinic name match `query`,
+        best first, optionally limited to the clinics matching `clinic_query`.
+        """
+        snapshot = self._get()
+        allowed = None
+        if clinic_query:
+            clinic_ids = {clinic_id for clinic_id, _ in snapshot["clinics"].match(clinic_query)}
+            allowed = {doctor_id for doctor_id, clinic_id in snapshot["doctor_clinic"].items() if clinic_id in clinic_ids}
+        return [doctor_id for doctor_id, _ in snapshot["doctors"].match(query, allowed)]
+
+    def doctor_in_clinic(self, name, clinic_id):
+        """ID of the best match for a doctor's name within one clinic, or None."""
+        snapshot = self._get()
+        allowed = {doctor_id for doctor_id, doctor_clinic in snapshot["doctor_clinic"].items() if doctor_clinic == clinic_id}
+        matches = snapshot["doctor_names"].match(name, allowed)
+        return matches[0][0] if matches else None
+
+
+resolver = EntityResolver()
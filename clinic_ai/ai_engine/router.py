@@ -0,0 +1,157 @@
+from django.conf import settings
+from collections import defaultdict, namedtuple
+from langchain_core.runnables import RunnableConfig
+from .arabic import tokenize
+from .metrics import record_stage
+from .tools import get_clinic_general_info, list_all_doctors, list_clinics, list_user_appointments
+import json
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Words that carry no intent of their own: politeness, question words, request verbs
+FILLER_WORDS = frozenset(tokenize(
+    "من فضلك لو سمحت ممكن اريد أبي ابغى اعطني عطني اعرض ارني ما ماهي هي هو هل كم كيف متى أين وين لي لدي عندي "
+    "عندكم لديكم في المركز الطبي شكرا يا نور مرحبا السلام عليكم"
+))
+
+
+def format_doctors(output):
+    """list_all_doctors returns JSON rows for the report tools; the chat gets one line per doctor."""
+    try:
+        doctors = json.loads(output)
+    except ValueError:
+        return output
+    return "\n".join(f"- {d['اسم الطبيب']} ({d['التخصص']}) - {d['العيادة']}" for d in doctors)
+
+
+class Intent(namedtuple("Intent", "name tool examples template format", defaults=(None,))):
+    """
+    A request answered by one read-only tool. `examples` are labelled queries,
+    `template` turns the tool output into the reply ("{output}") and `format`
+    optionally reshapes the output first.
+    """
+
+    def render(self, output):
+        return self.template.format(output=self.format(output) if self.format else output)
+
+    def answer(self, query, callbacks):
+        # Through invoke() so the callbacks (metrics, stream status) see the tool run
+        return self.render(self.tool.invoke(query, config=RunnableConfig(callbacks=callbacks)))
+
+    async def aanswer(self, query, callbacks):
+        return self.render(await self.tool.ainvoke(query, config=RunnableConfig(callbacks=callbacks)))
+
+
+INTENTS = {intent.name: intent for intent in (
+    Intent(
+        "my_appointments",
+        list_user_appointments,
+        ["مواعيدي", "ما هي مواعيدي", "اعرض مواعيدي", "مواعيدي المحجوزة", "حجوزاتي", "هل لدي موعد", "متى موعدي"],
+        "{output}\n\nهل تودّ حجز موعد جديد أو الاستفسار عن أحد هذه المواعيد؟",
+    ),
+    Intent(
+        "clinic_info",
+        get_clinic_general_info,
+        [
+            "ساعات العمل", "ما هي ساعات العمل", "أوقات الدوام", "متى تفتحون", "متى يفتح المركز",
+            "رقم الهاتف", "رقم التواصل", "كيف أتصل بكم", "أين يقع المركز", "عنوان المركز", "موقع المركز",
+        ],
+        "إليك معلومات المركز:\n{output}\n\nهل يمكنني مساعدتك في شيء آخر؟",
+    ),
+    Intent(
+        "clinics",
+        list_clinics,
+        ["قائمة العيادات", "ما هي العيادات", "العيادات المتوفرة", "اعرض العيادات", "ما العيادات الموجودة في المركز"],
+        "العيادات المتوفرة في المركز:\n{output}\n\nهل تريد معرفة أطباء إحدى هذه العيادات أو مواعيدهم؟",
+        lambda output: output or "لا توجد عيادات مسجلة حالياً.",
+    ),
+    Intent(
+        "doctors",
+        list_all_doctors,
+        ["قائمة الأطباء", "من هم الأطباء", "اعرض جميع الأطباء", "أسماء الأطباء", "الأطباء المتوفرون"],
+        "أطباء المركز:\n{output}\n\nهل تريد معرفة مواعيد أحد الأطباء أو حجز موعد؟",
+        format_doctors,
+    ),
+)}
+
+
+class IntentRouter:
+    """
+    Sends queries that map onto a single read-only tool straight to that tool,
+    skipping retrieval and the agent's LLM calls. A query is routed only when:
+    every word of it appears in the intent's examples or in FILLER_WORDS (so a
+    doctor, clinic or date in the query leaves it to the agent), its MiniLM
+    embedding (of its content words, normalized and stemmed like the
+    examples) is at least INTENT_ROUTER_THRESHOLD similar to an example, and
+    it beats the best example of any other intent by INTENT_ROUTER_MARGIN.
+    """
+
+    def __init__(self, embeddings, intents=None, threshold=None, margin=None):
+        self.embeddings = embeddings
+        self.intents = intents or INTENTS
+        self.threshold = threshold if threshold is not None else getattr(settings, "INTENT_ROUTER_THRESHOLD", 0.85)
+        self.margin = margin if margin is not None else getattr(settings, "INTENT_ROUTER_MARGIN", 0.05)
+        self.vocabulary = {
+            name: FILLER_WORDS.union(*(tokenize(example) for example in intent.examples))
+            for name, intent in self.intents.items()
+        }
+        self._known = frozenset().union(*self.vocabulary.values())
+        self._matrix = None
+        self._labels = None
+        self._lock = threading.Lock()
+
+    def _examples(self):
+        # Embedded once, on the first query that gets this far
+        if self._matrix is None:
+            with self._lock:
+                if self._matrix is None:
+                    labels, texts = [], []
+                    for name, intent in self.intents.items():
+                        labels += [name] * len(intent.examples)
+                        texts += [self._content(tokenize(example)) for example in intent.examples]
+                    self._labels = labels
+                    self._matrix = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return self._matrix, self._labels
+
+    def _words(self, tokens):
+        # A leading conjunction ("وما", "ورقم") is dropped from words not known as they are
+        return [
+            token[1:] if token not in self._known and token[:1] in ("و", "ف") and len(token) > 2 else token
+            for token in tokens
+        ]
+
+    @staticmethod
+    def _content(words):
+        # What is embedded: the words that carry the request, so politeness does not dilute the match
+        return " ".join(word for word in words if word not in FILLER_WORDS)
+
+    def classify(self, query):
+        """The Intent `query` maps to with enough confidence, or None to run the agent."""
+        words = self._words(tokenize(query))
+        # Most agent queries stop here, before any embedding
+        if not words or any(word not in self._known for word in words):
+            return None
+        content = self._content(words)
+        if not content:
+            return None
+
+        with record_stage("embedding"):
+            matrix, labels = self._examples()
+            # Embeddings are normalized, so the dot product is the cosine similarity
+            scores = matrix @ np.asarray(self.embeddings.embed_query(content), dtype=np.float32)
+        best = defaultdict(lambda: -1.0)
+        for label, score in zip(labels, scores.tolist()):
+            best[label] = max(best[label], score)
+        ranked = sorted(best.items(), key=lambda item: -item[1])
+        name, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+
+        if score < self.threshold or score - runner_up < self.margin:
+            return None
+        if any(word not in self.vocabulary[name] for word in words):
+            return None
+        logger.debug(f"Routed {query!r} to {name} ({score:.3f})")
+        return self.intents[name]
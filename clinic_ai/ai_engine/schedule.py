@@ -0,0 +1,60 @@
+from django.conf import settings
+from datetime import timedelta
+import threading
+import time
+
+DAYS_AR = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+NO_SCHEDULE_MESSAGE = "لا توجد مواعيد محددة حالياً"
+
+
+def render_schedule(availabilities, today):
+    """
+    The schedule block shown to the agent for one doctor: each weekly slot with
+    its next two dates counted from `today`.
+    """
+    sched_parts = []
+    for a in availabilities:
+        day_name = DAYS_AR[a.day_of_week]
+        # Next occurrence of this day_of_week and the one after it
+        days_ahead = a.day_of_week - today.weekday()
+        if days_ahead < 0:
+            days_ahead += 7
+        next_date = today + timedelta(days=days_ahead)
+        upcoming_dates = [next_date.strftime('%Y-%m-%d'), (next_date + timedelta(days=7)).strftime('%Y-%m-%d')]
+
+        dates_str = " (" + ", ".join(upcoming_dates) + ")"
+        sched_parts.append(f"{day_name}: {a.start_time.strftime('%I:%M %p (%H:%M)')} - {a.end_time.strftime('%I:%M %p (%H:%M)')}{dates_str}")
+    return " | ".join(sched_parts) if sched_parts else NO_SCHEDULE_MESSAGE
+
+
+class ScheduleCache:
+    """
+    Rendered schedule blocks per doctor for the current day. An entry is dropped
+    by the DoctorAvailability signals in clinic_ai.signals, when the date changes,
+    or after SCHEDULE_CACHE_TTL seconds (for edits made by other processes).
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, "SCHEDULE_CACHE_TTL", 300)
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def get(self, doctor_id, today):
+        entry = self._blocks.get(doctor_id)
+        if entry is None or entry["date"] != today or time.monotonic() - entry["created"] > self.ttl:
+            return None
+        return entry["block"]
+
+    def set(self, doctor_id, today, block):
+        with self._lock:
+            self._blocks[doctor_id] = {"date": today, "block": block, "created": time.monotonic()}
+
+    def invalidate(self, doctor_id=None):
+        with self._lock:
+            if doctor_id is None:
+                self._blocks.clear()
+            else:
+                self._blocks.pop(doctor_id, None)
+
+
+schedule_cache = ScheduleCache()
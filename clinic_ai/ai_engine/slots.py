@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+import heapq
+
+# How far ahead "next free slots" looks when no end date is given
+SEARCH_DAYS = 14
+
+Slot = namedtuple("Slot", "doctor start end")
+
+
+def to_local(value):
+    """Naive local datetime, the form the tools compare against datetime.now()."""
+    if timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def to_db(value):
+    if settings.USE_TZ and timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+class BusyIntervals:
+    """
+    A doctor's booked time as sorted, merged [start, end) intervals. Overlap
+    checks are a binary search, so a day's slots are tested in O(log n) each.
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def overlaps(self, start, end):
+        # First interval that ends after `start`; it overlaps if it also begins before `end`
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def busy_intervals(doctor_ids, start, end):
+    """{doctor id: BusyIntervals} of the non-cancelled appointments overlapping [start, end), in one query."""
+    from clinic_ai.models import Appointment
+
+    rows = (
+        Appointment.objects
+        .filter(doctor_id__in=doctor_ids, appointment_date__lt=to_db(end), appointment_date__gte=to_db(start - timedelta(days=1)))
+        .exclude(status='cancelled')
+        .values_list('doctor_id', 'appointment_date', 'duration_minutes')
+    )
+    intervals = defaultdict(list)
+    for doctor_id, appointment_date, duration in rows:
+        appointment_start = to_local(appointment_date)
+        intervals[doctor_id].append((appointment_start, appointment_start + timedelta(minutes=duration)))
+    return {doctor_id: BusyIntervals(intervals.get(doctor_id, ())) for doctor_id in doctor_ids}
+
+
+def working_windows(doctor):
+    """{weekday: [(start time, end time)]}, merged and sorted, from the doctor's prefetched availabilities."""
+    by_day = defaultdict(list)
+    for availability in doctor.availabilities.all():
+        by_day[availability.day_of_week].append((availability.start_time, availability.end_time))
+    windows = {}
+    for day, spans in by_day.items():
+        merged = []
+        for span_start, span_end in sorted(spans):
+            if merged and span_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+            else:
+                merged.append((span_start, span_end))
+        windows[day] = merged
+    return windows
+
+
+def free_slots(doctor, start, end, busy):
+    """
+    Yields the doctor's free slots starting in [start, end), in time order.
+    Slots are `doctor.slot_length` minutes long and aligned to the start of
+    each availability window.
+    """
+    length = timedelta(minutes=doctor.slot_length)
+    windows = working_windows(doctor)
+    day = start.date()
+    while day <= end.date():
+        for window_start, window_end in windows.get(day.weekday(), ()):
+            slot_start = datetime.combine(day, window_start)
+            close = datetime.combine(day, window_end)
+            if slot_start < start:
+                # Jump to the first slot on the window's grid at or after `start`
+                slot_start += length * -(-(start - slot_start) // length)
+            while slot_start + length <= close and slot_start < end:
+                if not busy.overlaps(slot_start, slot_start + length):
+                    yield Slot(doctor, slot_start, slot_start + length)
+                slot_start += length
+        day += timedelta(days=1)
+
+
+def is_slot_start(doctor, start):
+    """
+    Whether a `doctor.slot_length` appointment at `start` is one of the slots
+    free_slots() offers: it lies inside an availability window, end included,
+    and is aligned to that window's grid. Uses the prefetched availabilities.
+    """
+    length = timedelta(minutes=doctor.slot_length)
+    for window_start, window_end in working_windows(doctor).get(start.weekday(), ()):
+        opens = datetime.combine(start.date(), window_start)
+        if opens <= start and start + length <= datetime.combine(start.date(), window_end):
+            return (start - opens) % length == timedelta(0)
+    return False
+
+
+def next_free_slots(doctors, n=5, start=None, end=None):
+    """
+    The first `n` free slots across `doctors`, earliest first, between `start`
+    (default now) and `end` (default SEARCH_DAYS later). Runs two queries:
+    the doctors' availabilities and their appointments in the range.
+    """
+    doctors = list(doctors)
+    start = start or datetime.now()
+    end = end or start + timedelta(days=SEARCH_DAYS)
+    prefetch_related_objects(doctors, 'availabilities')
+    busy = busy_intervals([doctor.id for doctor in doctors], start, end)
+    streams = [free_slots(doctor, start, end, busy[doctor.id]) for doctor in doctors]
+    merged = heapq.merge(*streams, key=lambda slot: (slot.start, slot.doctor.id))
+    return list(islice(merged, n))
+
+
+def is_slot_free(doctor, start):
+    """Whether a `doctor.slot_length` appointment at `start` overlaps no existing booking."""
+    end = start + timedelta(minutes=doctor.slot_length)
+    return not busy_intervals([doctor.id], start, end)[doctor.id].overlaps(start, end)
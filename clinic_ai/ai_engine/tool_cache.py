@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+from collections import defaultdict
+import threading
+import time
+
+KEY_PREFIX = "clinic_ai:tools"
+GENERATION_KEY = f"{KEY_PREFIX}:generation"
+
+
+class ToolCache:
+    """
+    Read-through cache, in Django's default cache, of tool outputs built only
+    from rarely edited rows (clinics, doctors, ClinicInfo). Keys carry a
+    generation number kept in the same cache. The model signals in
+    clinic_ai.signals bump it, so with a shared backend an admin edit
+    invalidates every worker at once; with the local-memory backend other
+    processes see it after TOOL_CACHE_TTL seconds.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _generation(self):
+        # A fresh, unique generation if the key was evicted, so old entries are never read back
+        return cache.get_or_set(GENERATION_KEY, time.time_ns, timeout=None)
+
+    def get_or_build(self, name, build):
+        """The cached output of tool `name`, or build() stored for the next calls."""
+        key = f"{KEY_PREFIX}:{self._generation()}:{name}"
+        value = cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses[name] += 1
+            else:
+                self.hits[name] += 1
+        if value is None:
+            value = build()
+            ttl = self.ttl if self.ttl is not None else getattr(settings, "TOOL_CACHE_TTL", 3600)
+            cache.set(key, value, ttl)
+        return value
+
+    def invalidate(self):
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, time.time_ns(), None)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "tools": {
+                    name: {"hits": self.hits[name], "misses": self.misses[name]}
+                    for name in sorted(set(self.hits) | set(self.misses))
+                },
+            }
+
+
+tool_cache = ToolCache()
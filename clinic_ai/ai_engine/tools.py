@@ -1,54 +1,50 @@
 from langchain.tools import tool
-from clinic_ai.models import Doctor, ClinicInfo, Appointment, Clinic, DoctorAvailability
-from django.db.models import Q
-from datetime import datetime
+from asgiref.sync import sync_to_async
+from clinic_ai.models import Doctor, ClinicInfo, Appointment, Clinic
+from datetime import datetime, timedelta
 from clinic_ai.context import current_user
-from django.conf import settings
-import os
-import uuid
-import openpyxl
-from openpyxl.styles import Font as XLFont
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, HRFlowable, Image, PageTemplate, BaseDocTemplate, Frame
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-from reportlab.lib.units import cm, inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import arabic_reshaper
-from bidi.algorithm import get_display
+from .resolver import resolver
+from .schedule import render_schedule, schedule_cache, DAYS_AR
+from .slots import is_slot_start, next_free_slots, working_windows
+from .tool_cache import tool_cache
+from . import booking
+from . import jobs
+from . import report_specs
+from django.db.models import prefetch_related_objects
+from django.urls import reverse
 
-# Register Arabic Fonts
-try:
-    pdfmetrics.registerFont(TTFont('Arabic', '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf'))
-    pdfmetrics.registerFont(TTFont('Arabic-Bold', '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Bold.ttf'))
-except:
-    pass
+# Free slots listed by find_free_slots
+FREE_SLOTS_SHOWN = 8
 
-def fix_arabic(text):
-    if not text:
-        return ""
-    reshaped_text = arabic_reshaper.reshape(text)
-    bidi_text = get_display(reshaped_text)
-    return bidi_text
+def clinic_tool(func):
+    """
+    Same as @tool, but also registers an async implementation so the agent can
+    ainvoke the tool. The Django ORM is synchronous, so the body runs through
+    sync_to_async, which also carries `current_user` over to the worker thread.
+    Not thread-sensitive: each executor thread has its own DB connection, and
+    tool calls of concurrent requests run in parallel instead of one at a time.
+    """
+    t = tool(func)
+    t.coroutine = sync_to_async(func, thread_sensitive=False)
+    return t
 
-@tool
+@clinic_tool
 def list_clinics(query: str):
     """List all available clinics in the medical center."""
-    clinics = Clinic.objects.all()
-    return "\n".join([f"العيادة: {c.name}, الموقع: {c.location}" for c in clinics])
+    return tool_cache.get_or_build("list_clinics", lambda: "\n".join(
+        f"العيادة: {c.name}, الموقع: {c.location}" for c in Clinic.objects.all()
+    ))
 
-@tool
+@clinic_tool
 def list_all_doctors(query: str):
     """
     استرجاع قائمة بجميع الأطباء في المركز الطبي مع تخصصاتهم وعياداتهم.
     استخدم هذه الأداة عندما يطلب المستخدم تقريراً أو قائمة عامة لجميع الأطباء.
     """
+    return tool_cache.get_or_build("list_all_doctors", _all_doctors_json)
+
+def _all_doctors_json():
     docs = Doctor.objects.select_related('clinic').all()
-    if not docs.exists():
-        return "لا يوجد أطباء مسجلون حالياً."
-    
     results = []
     for d in docs:
         results.append({
@@ -56,10 +52,12 @@ def list_all_doctors(query: str):
             "التخصص": d.specialty,
             "العيادة": d.clinic.name if d.clinic else "غير محدد"
         })
+    if not results:
+        return "لا يوجد أطباء مسجلون حالياً."
     import json
     return json.dumps(results, ensure_ascii=False)
 
-@tool
+@clinic_tool
 def get_doctor_availability(doctor_info: str):
     """
     البحث عن توافر الأطباء في المركز. 
@@ -70,73 +68,79 @@ def get_doctor_availability(doctor_info: str):
     query = parts[0]
     clinic_name = parts[1] if len(parts) > 1 else None
 
-    def search_with_keywords(model, search_query, extra_filter=None):
-        words = search_query.split()
-        q_obj = Q()
-        for word in words:
-            clean_word = word[2:] if word.startswith('ال') and len(word) > 3 else word
-            # Handle specialty/name/clinic name in one go for doctors
-            if model == Doctor:
-                q_obj &= (Q(name__icontains=clean_word) | Q(specialty__icontains=clean_word) | Q(clinic__name__icontains=clean_word))
-            else:
-                q_obj &= Q(name__icontains=clean_word)
-        
-        results = model.objects.filter(q_obj)
-        if extra_filter:
-            results = results.filter(extra_filter)
-        return results
+    doctor_ids = resolver.doctors(query, clinic_name)
+    if not doctor_ids:
+        return "لا يوجد أطباء بهذا الوصف حالياً."
 
-    doctors = search_with_keywords(Doctor, query)
-    if clinic_name:
-        doctors = doctors.filter(clinic__name__icontains=clinic_name)
+    found = Doctor.objects.select_related('clinic').in_bulk(doctor_ids)
+    doctors = [found[doc_id] for doc_id in doctor_ids if doc_id in found]
+
+    # One query for the schedules that are not cached yet, however many doctors matched
+    today = datetime.now().date()
+    blocks = {doc.id: schedule_cache.get(doc.id, today) for doc in doctors}
+    uncached = [doc for doc in doctors if blocks[doc.id] is None]
+    prefetch_related_objects(uncached, 'availabilities')
+    for doc in uncached:
+        blocks[doc.id] = render_schedule(doc.availabilities.all(), today)
+        schedule_cache.set(doc.id, today, blocks[doc.id])
 
-    if not doctors.exists():
-        return "لا يوجد أطباء بهذا الوصف حالياً."
-    
     results = []
     for doc in doctors:
         clinic_str = f"في {doc.clinic.name}" if doc.clinic else ""
-        avail_list = doc.availabilities.all()
-        if avail_list.exists():
-            from datetime import timedelta
-            now = datetime.now()
-            days_ar = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
-            sched_parts = []
-            for a in avail_list:
-                day_name = days_ar[a.day_of_week]
-                # Calculate next 2 dates for this day_of_week
-                upcoming_dates = []
-                days_ahead = a.day_of_week - now.weekday()
-                if days_ahead < 0:
-                    days_ahead += 7
-                
-                # Next occurrence
-                next_date = now + timedelta(days=days_ahead)
-                upcoming_dates.append(next_date.strftime('%Y-%m-%d'))
-                # Occurrence after that
-                second_date = next_date + timedelta(days=7)
-                upcoming_dates.append(second_date.strftime('%Y-%m-%d'))
-                
-                dates_str = " (" + ", ".join(upcoming_dates) + ")"
-                sched_parts.append(f"{day_name}: {a.start_time.strftime('%I:%M %p (%H:%M)')} - {a.end_time.strftime('%I:%M %p (%H:%M)')}{dates_str}")
-            sched_str = " | ".join(sched_parts)
-        else:
-            sched_str = "لا توجد مواعيد محددة حالياً"
-        
+        sched_str = blocks[doc.id]
         results.append(f"الطبيب: {doc.name}, التخصص: {doc.specialty}, {clinic_str}, الجدول: {sched_str}")
     
     return "\n".join(results)
 
-@tool
+def format_slot(slot):
+    return f"{DAYS_AR[slot.start.weekday()]} {slot.start.strftime('%Y-%m-%d %H:%M')} - {slot.end.strftime('%H:%M')}"
+
+@clinic_tool
+def find_free_slots(slot_query: str):
+    """
+    البحث عن أقرب المواعيد الشاغرة فعلياً (بعد استبعاد المواعيد المحجوزة) لطبيب أو تخصص أو عيادة.
+    المدخل: 'اسم الطبيب أو التخصص، اسم العيادة (اختياري)، من تاريخ YYYY-MM-DD (اختياري)'.
+    مثال: 'أسنان' أو 'د. سارة، عيادة الأسنان، 2026-05-20'.
+    استخدم أحد هذه المواعيد كما هو عند الحجز عبر book_appointment.
+    """
+    parts = [p.strip() for p in slot_query.replace('،', ',').split(',') if p.strip()]
+    start = None
+    if parts:
+        try:
+            start = max(datetime.strptime(parts[-1], '%Y-%m-%d'), datetime.now())
+            parts = parts[:-1]
+        except ValueError:
+            pass
+    if not parts:
+        return "يرجى تحديد اسم الطبيب أو التخصص أو العيادة."
+
+    doctor_ids = resolver.doctors(parts[0], parts[1] if len(parts) > 1 else None)
+    if not doctor_ids:
+        return "لا يوجد أطباء بهذا الوصف حالياً."
+
+    doctors = Doctor.objects.select_related('clinic').filter(pk__in=doctor_ids)
+    slots = next_free_slots(doctors, n=FREE_SLOTS_SHOWN, start=start)
+    if not slots:
+        return "لا توجد مواعيد شاغرة خلال الأسبوعين القادمين."
+
+    return "\n".join(
+        f"{s.doctor.name} ({s.doctor.clinic.name if s.doctor.clinic else 'غير محدد'}): {format_slot(s)}"
+        for s in slots
+    )
+
+@clinic_tool
 def get_clinic_general_info(query: str):
     """Get general clinic information like working hours, location, and phone."""
+    return tool_cache.get_or_build("get_clinic_general_info", _general_info)
+
+def _general_info():
     info = ClinicInfo.objects.first()
     if not info:
         return "لا تتوفر معلومات عامة عن العيادة حالياً."
     
     return f"ساعات العمل: {info.working_hours}\nالموقع: {info.location}\nالهاتف: {info.phone}"
 
-@tool
+@clinic_tool
 def book_appointment(appointment_info: str):
     """
     حجز موعد جديد للمريض. 
@@ -156,25 +160,13 @@ def book_appointment(appointment_info: str):
         
         cl_name, doc_name, date_str = parts[0], parts[1], parts[2]
         
-        clinic = Clinic.objects.filter(name__icontains=cl_name).first()
+        clinic_ids = resolver.clinics(cl_name)
+        clinic = Clinic.objects.filter(pk=clinic_ids[0]).first() if clinic_ids else None
         if not clinic:
-            # Try keyword search for clinic
-            words = cl_name.split()
-            q_cl = Q()
-            for w in words:
-                cw = w[2:] if w.startswith('ال') and len(w) > 3 else w
-                q_cl &= Q(name__icontains=cw)
-            clinic = Clinic.objects.filter(q_cl).first()
-            if not clinic:
-                return f"لم يتم العثور على عيادة باسم '{cl_name}'."
+            return f"لم يتم العثور على عيادة باسم '{cl_name}'."
 
-        # Flexible doctor search
-        words_doc = doc_name.split()
-        q_doc = Q(clinic=clinic)
-        for w in words_doc:
-            cw = w[2:] if w.startswith('ال') and len(w) > 3 else w
-            q_doc &= Q(name__icontains=cw)
-        doctor = Doctor.objects.filter(q_doc).first()
+        doctor_id = resolver.doctor_in_clinic(doc_name, clinic.id)
+        doctor = Doctor.objects.select_related('clinic').filter(pk=doctor_id).first() if doctor_id else None
         if not doctor:
             return f"لم يتم العثور على طبيب باسم '{doc_name}' في {clinic.name}."
         
@@ -189,41 +181,36 @@ def book_appointment(appointment_info: str):
         if appt_date.hour < 9 or appt_date.hour >= 21:
             return "عذراً، المواعيد المتاحة فقط من 9 صباحاً حتى 9 مساءً."
 
-        # 3. Check doctor availability schedule
+        # 3. The whole appointment must fit a window of the doctor's schedule, on its slot grid
         # day_of_week in python is 0=Mon to 6=Sun, same as our choices
         day_val = appt_date.weekday()
-        time_val = appt_date.time()
-        
-        available_slots = DoctorAvailability.objects.filter(
-            doctor=doctor, 
-            day_of_week=day_val,
-            start_time__lte=time_val,
-            end_time__gte=time_val
-        )
-        
-        if not available_slots.exists():
-            days_ar = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
-            day_name_ar = days_ar[day_val]
-            
-            all_slots = DoctorAvailability.objects.filter(doctor=doctor, day_of_week=day_val)
-            if all_slots.exists():
-                slots_str = " | ".join([f"{s.start_time.strftime('%I:%M %p')} - {s.end_time.strftime('%I:%M %p')}" for s in all_slots])
-                return f"عذراً، {doctor.name} غير متاح في هذا الوقت. المواعيد المتاحة في يوم {day_name_ar} هي: {slots_str}."
-            else:
+        prefetch_related_objects([doctor], 'availabilities')
+        if not is_slot_start(doctor, appt_date):
+            day_name_ar = DAYS_AR[day_val]
+            windows = working_windows(doctor).get(day_val)
+            if not windows:
                 return f"عذراً، {doctor.name} لا يعمل في يوم {day_name_ar}. يرجى اختيار يوم آخر."
+            slots_str = " | ".join(f"{start.strftime('%I:%M %p')} - {end.strftime('%I:%M %p')}" for start, end in windows)
+            reply = f"عذراً، لا يمكن حجز موعد مع {doctor.name} يبدأ في هذا الوقت (مدة الموعد {doctor.slot_length} دقيقة). المواعيد المتاحة في يوم {day_name_ar} هي: {slots_str}."
+            alternatives = next_free_slots([doctor], n=3, start=max(appt_date - timedelta(minutes=doctor.slot_length), datetime.now()))
+            if alternatives:
+                reply += f" أقرب المواعيد الشاغرة: {' | '.join(format_slot(s) for s in alternatives)}."
+            return reply
 
-        appointment = Appointment.objects.create(
-            user=user,
-            clinic=clinic,
-            doctor=doctor,
-            appointment_date=appt_date
-        )
+        # 4. Book, unless the slot is already taken
+        try:
+            appointment = booking.book_appointment(user, clinic, doctor, appt_date)
+        except booking.SlotTaken:
+            alternatives = next_free_slots([doctor], n=3, start=appt_date)
+            if alternatives:
+                return f"عذراً، هذا الموعد محجوز مسبقاً مع {doctor.name}. أقرب المواعيد الشاغرة: {' | '.join(format_slot(s) for s in alternatives)}."
+            return f"عذراً، هذا الموعد محجوز مسبقاً مع {doctor.name}، ولا توجد مواعيد شاغرة قريبة."
         
         return f"تم حجز الموعد بنجاح في {clinic.name}! رقم الموعد: {appointment.id}. الموعد: {appt_date.strftime('%Y-%m-%d %H:%M')} مع {doctor.name}."
     except Exception as e:
         return f"حدث خطأ أثناء حجز الموعد: {str(e)}"
 
-@tool
+@clinic_tool
 def list_user_appointments(query: str):
     """List appointments for the current user."""
     user = current_user.get()
@@ -240,174 +227,68 @@ def list_user_appointments(query: str):
     
     return "\n".join(results)
 
-@tool
+def _enqueue_report(kind, data_json):
+    """Queues a report for the run_report_worker command and returns the agent's reply."""
+    import json
+    try:
+        data = json.loads(data_json)
+    except ValueError:
+        return "يجب أن تكون البيانات بصيغة JSON صالحة."
+    if not data or not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return "يجب أن تكون البيانات قائمة من القواميس."
+
+    job = jobs.enqueue_report(current_user.get(), kind, rows=data)
+    return _queued_reply(job, len(data))
+
+def _queued_reply(job, count):
+    label = "تقرير PDF" if job.kind == "pdf" else "ملف Excel"
+    if job.status == 'done':
+        # The same report was generated before and is still cached
+        return f"تم تجهيز {label} ({count} سجل). يمكنك تحميله من الرابط التالي: {job.file_url}"
+    status_url = reverse('api-report', args=[job.id])
+    return f"تم استلام طلب إنشاء {label} ({count} سجل) وجاري تجهيزه الآن. رابط المتابعة: {status_url} (سيتحول تلقائياً إلى رابط تحميل عند اكتمال الملف)."
+
+@clinic_tool
+def generate_report(spec_json: str):
+    """
+    إنشاء تقرير PDF أو Excel مباشرة من قاعدة البيانات دون نسخ البيانات. المدخل JSON مختصر:
+    {"entity": "appointments" أو "doctors" أو "availability", "format": "pdf" أو "xlsx",
+     "clinic": اسم العيادة (اختياري), "doctor": اسم الطبيب أو التخصص (اختياري),
+     "status": "pending" أو "confirmed" أو "cancelled" (للمواعيد، اختياري),
+     "from": "YYYY-MM-DD", "to": "YYYY-MM-DD" (للمواعيد، اختياري), "columns": [...] (اختياري)}.
+    الأعمدة: appointments: id, date, patient, doctor, specialty, clinic, duration, status.
+    doctors: name, specialty, clinic, slot_minutes. availability: doctor, specialty, clinic, day, start, end.
+    مثال: '{"entity": "appointments", "format": "xlsx", "from": "2026-01-01", "to": "2026-12-31", "clinic": "عيادة الأسنان"}'
+    تعيد الأداة رابط متابعة؛ انسخ الرابط كما هو في ردك.
+    """
+    try:
+        spec = report_specs.parse_spec(spec_json)
+        count = report_specs.report_queryset(spec, current_user.get()).count()
+    except report_specs.ReportSpecError as e:
+        return str(e)
+    if not count:
+        return "لا توجد بيانات مطابقة لهذه المواصفات."
+    if count > report_specs.MAX_REPORT_ROWS:
+        return f"التقرير كبير جداً ({count} سجل). يرجى تضييق الفترة الزمنية أو إضافة عيادة أو طبيب."
+
+    job = jobs.enqueue_report(current_user.get(), spec["format"], spec=spec)
+    return _queued_reply(job, count)
+
+@clinic_tool
 def generate_excel_report(data_json: str):
     """
     إنشاء ملف Excel من البيانات المقدمة.
     يجب أن تكون المدخلات عبارة عن JSON يمثل قائمة من القواميس (List of Dictionaries).
     مثال: '[{"اسم المريض": "أحمد", "الموعد": "2026-01-01"}]'
-    ستقوم هذه الأداة بحفظ الملف وإرجاع رابط التحميل.
+    ستقوم هذه الأداة بجدولة إنشاء الملف وإرجاع رابط متابعة؛ انسخ الرابط كما هو في ردك.
     """
-    import json
-    try:
-        data = json.loads(data_json)
-        if not data or not isinstance(data, list):
-            return "يجب أن تكون البيانات قائمة من القواميس."
-        
-        # Create workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Report"
-        
-        # Extract headers from the first row
-        headers = list(data[0].keys())
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = XLFont(bold=True)
-            
-        # Add data rows
-        for row_num, entry in enumerate(data, 2):
-            for col_num, header in enumerate(headers, 1):
-                ws.cell(row=row_num, column=col_num, value=str(entry.get(header, "")))
-        
-        # Save file to media root
-        filename = f"report_{uuid.uuid4().hex[:8]}.xlsx"
-        filepath = os.path.join(settings.MEDIA_ROOT, filename)
-        wb.save(filepath)
-        
-        file_url = f"{settings.MEDIA_URL}{filename}"
-        return f"تم إنشاء ملف Excel بنجاح. يمكنك تحميله من الرابط التالي: {file_url}"
-    except Exception as e:
-        return f"حدث خطأ أثناء إنشاء ملف Excel: {str(e)}"
+    return _enqueue_report("xlsx", data_json)
 
-@tool
+@clinic_tool
 def generate_pdf_report(data_json: str):
     """
     إنشاء ملف PDF استثنائي واحترافي بتصميم Dashboard حديث.
     يجب أن تكون المدخلات عبارة عن JSON يمثل قائمة من القواميس.
+    ستقوم هذه الأداة بجدولة إنشاء الملف وإرجاع رابط متابعة؛ انسخ الرابط كما هو في ردك.
     """
-    import json
-    try:
-        data = json.loads(data_json)
-        if not data or not isinstance(data, list):
-            return "يجب أن تكون البيانات قائمة من القواميس."
-        
-        filename = f"premium_report_{uuid.uuid4().hex[:8]}.pdf"
-        filepath = os.path.join(settings.MEDIA_ROOT, filename)
-        logo_path = os.path.join(settings.MEDIA_ROOT, 'assets/logo.png')
-        
-        # Color Palette - Premium Navy & Cyan
-        NAVY = colors.HexColor("#0F172A")
-        LIGHT_NAVY = colors.HexColor("#1E293B")
-        CYAN = colors.HexColor("#38BDF8")
-        BG_LIGHT = colors.HexColor("#F8FAFC")
-        
-        class PremiumDoc(BaseDocTemplate):
-            def __init__(self, filename, **kw):
-                super().__init__(filename, **kw)
-                frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height - 100, id='normal')
-                self.addPageTemplates([PageTemplate(id='First', frames=frame, onPage=self.on_page)])
-
-            def on_page(self, canvas, doc):
-                canvas.saveState()
-                # Background color for header
-                canvas.setFillColor(NAVY)
-                canvas.rect(0, A4[1]-120, A4[0], 120, fill=1)
-                
-                # Draw Logo if exists
-                if os.path.exists(logo_path):
-                    canvas.drawImage(logo_path, 40, A4[1]-100, width=80, height=80, mask='auto')
-                
-                # Header Text
-                canvas.setFillColor(colors.white)
-                canvas.setFont('Arabic-Bold', 22)
-                canvas.drawRightString(A4[0]-40, A4[1]-60, fix_arabic("المركز الطبي الذكي"))
-                canvas.setFont('Arabic', 10)
-                canvas.drawRightString(A4[0]-40, A4[1]-85, fix_arabic("Smart Clinic Center - Premium AI Intelligence"))
-                
-                # Bottom Decorative Line
-                canvas.setStrokeColor(CYAN)
-                canvas.setLineWidth(3)
-                canvas.line(40, A4[1]-120, A4[0]-40, A4[1]-120)
-                
-                # Footer
-                canvas.setFillColor(colors.grey)
-                canvas.setFont('Arabic', 9)
-                canvas.drawString(40, 20, fix_arabic(f"تاريخ الإصدار: {datetime.now().strftime('%Y-%m-%d')}"))
-                canvas.drawRightString(A4[0]-40, 20, fix_arabic(f"صفحة {canvas.getPageNumber()}"))
-                canvas.restoreState()
-
-        doc = PremiumDoc(filepath, pagesize=A4, rightMargin=40, leftMargin=40, topMargin=140, bottomMargin=40)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Dashboard Style Title
-        title_style = ParagraphStyle(
-            'TitleDash',
-            fontName='Arabic-Bold',
-            fontSize=16,
-            textColor=LIGHT_NAVY,
-            spaceAfter=30,
-            alignment=TA_RIGHT
-        )
-        elements.append(Paragraph(fix_arabic("تقرير تحليل البيانات والفرق الطبية"), title_style))
-        
-        # Summary Area (Mini Cards)
-        summary_data = [
-            [
-                Paragraph(fix_arabic(f"إجمالي السجلات: {len(data)}"), ParagraphStyle('S1', fontName='Arabic', fontSize=12, textColor=NAVY)),
-                Paragraph(fix_arabic("الحالة: تقرير رسمي"), ParagraphStyle('S2', fontName='Arabic', fontSize=12, textColor=colors.HexColor("#10B981"))) # Emerald
-            ]
-        ]
-        summary_table = Table(summary_data, colWidths=[150, 150])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,-1), colors.HexColor("#F1F5F9")),
-            ('BOX', (0,0), (-1,-1), 1, colors.HexColor("#E2E8F0")),
-            ('PADDING', (0,0), (-1,-1), 10),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ]))
-        elements.append(summary_table)
-        elements.append(Spacer(1, 40))
-        
-        # Main Data Table
-        headers = [fix_arabic(h) for h in list(data[0].keys())]
-        table_data = [headers]
-        for entry in data:
-            row = [fix_arabic(str(entry.get(h, ""))) for h in list(data[0].keys())]
-            table_data.append(row)
-            
-        main_table = Table(table_data, hAlign='CENTER', repeatRows=1)
-        main_table.setStyle(TableStyle([
-            # Modern Header
-            ('BACKGROUND', (0, 0), (-1, 0), LIGHT_NAVY),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Arabic-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('TOPPADDING', (0, 0), (-1, 0), 12),
-            
-            # Subtle Body
-            ('FONTNAME', (0, 1), (-1, -1), 'Arabic'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 1), (-1, -1), 10),
-            ('TOPPADDING', (0, 1), (-1, -1), 10),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor("#F8FAFC")]),
-            ('GRID', (0, 0), (-1, -1), 0.1, colors.HexColor("#CBD5E1")),
-            ('LINEBELOW', (0, 0), (-1, 0), 2, CYAN),
-        ]))
-        
-        elements.append(main_table)
-        elements.append(Spacer(1, 50))
-        
-        # Stamp / Signature Area
-        stamp_style = ParagraphStyle('Stamp', fontName='Arabic', fontSize=10, textColor=colors.lightgrey, alignment=TA_CENTER)
-        elements.append(Paragraph(fix_arabic("تمت المصادقة الرقمية بواسطة نظام ذكاء المركز الطبي"), stamp_style))
-        
-        doc.build(elements)
-        
-        file_url = f"{settings.MEDIA_URL}{filename}"
-        return f"تم إنشاء تقرير PDF استثنائي بنجاح. يمكنك تحميله من الرابط التالي: {file_url}"
-    except Exception as e:
-        import traceback
-        return f"حدث خطأ أثناء إنشاء ملف PDF الاستثنائي: {str(e)}\n{traceback.format_exc()}"
+    return _enqueue_report("pdf", data_json)
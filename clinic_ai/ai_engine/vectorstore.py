@@ -1,39 +1,258 @@
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, DirectoryLoader
+from langchain_core.retrievers import BaseRetriever
 from django.conf import settings
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any
+from .arabic import normalize_arabic
+from .docstore import SQLiteDocstore, SQLitePositionMap
+from .ingestion import IngestionPipeline
+from .ann import IndexConfig
+from .bm25 import reciprocal_rank_fusion
+from .metrics import record_stage
+import faiss
+import numpy as np
+import hashlib
+import json
 import os
+import shutil
+import threading
+import time
+import uuid
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite3"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 2
+SOURCE_EXTENSIONS = (".txt", ".pdf")
+
+# Serving indexes are memory-mapped read-only instead of copied into each worker.
+# IVF indexes map their inverted lists (IO_FLAG_MMAP); flat and HNSW indexes map
+# their vector codes (IO_FLAG_MMAP_IFC). FAISS rejects both flags on an IVF index
+IVF_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+CODES_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def mmap_flags(index_file):
+    """read_index() flags for a serving index, chosen from its FAISS fourcc header."""
+    with open(index_file, "rb") as f:
+        fourcc = f.read(4)
+    # IndexIVF* files start with "Iw" (or "Iv" in older FAISS versions)
+    return IVF_MMAP_FLAGS if fourcc[:2] in (b"Iw", b"Iv") else CODES_MMAP_FLAGS
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with a TTL, mapping a normalized query to its embedding
+    vector and the docstore IDs of its top-k hits.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry["created"] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, vector, doc_ids):
+        with self._lock:
+            self._entries[key] = {"vector": vector, "doc_ids": doc_ids, "created": time.monotonic()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class ClinicRetriever(BaseRetriever):
+    """Retriever over ClinicVectorStore.search, so lookups go through the query cache."""
+
+    vector_store: Any
+    k: int = 6
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.vector_store.search(query, k=self.k)
+
 
 class ClinicVectorStore:
-    def __init__(self):
+    """
+    FAISS index over clinic_docs/. Each build is written to its own directory
+    under faiss_index/versions/ and published by atomically replacing the
+    faiss_index/CURRENT pointer file; running workers poll that pointer and swap
+    the new version in without a restart.
+    """
+
+    def __init__(self, embeddings=None, index_config=None):
         # Using langchain-huggingface to avoid deprecation warnings
         # explicitly setting device to cpu to avoid meta tensor issues
-        self.embeddings = HuggingFaceEmbeddings(
+        self.embeddings = embeddings or HuggingFaceEmbeddings(
             model_name="sentence-transformers/all-MiniLM-L6-v2",
             model_kwargs={'device': 'cpu'},
             encode_kwargs={'normalize_embeddings': True}
         )
         self.vector_db = None
+        self.version = None
+        self.last_ingestion = None
+        self.query_cache = QueryCache(
+            max_size=getattr(settings, "QUERY_CACHE_SIZE", 1024),
+            ttl=getattr(settings, "QUERY_CACHE_TTL", 3600)
+        )
         self.index_path = settings.FAISS_INDEX_PATH
         self.docs_path = settings.DOCS_DIR
+        self.index_config = index_config or IndexConfig()
+        self.reload_interval = getattr(settings, "FAISS_RELOAD_INTERVAL", 30)
+        self._reload_lock = threading.Lock()
+        self._next_reload_check = 0.0
+
+    def _version_dir(self, version):
+        return os.path.join(self.index_path, VERSIONS_DIR, version)
+
+    def current_version(self):
+        """The published version name, or None if nothing was built yet."""
+        try:
+            with open(os.path.join(self.index_path, CURRENT_FILE), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
 
-    def load_index(self):
-        index_file = os.path.join(self.index_path, "index.faiss")
-        if os.path.exists(index_file):
+    def _publish(self, version):
+        # os.replace is atomic: readers see either the old or the new pointer
+        current_file = os.path.join(self.index_path, CURRENT_FILE)
+        with open(current_file + ".tmp", "w", encoding='utf-8') as f:
+            f.write(version)
+        os.replace(current_file + ".tmp", current_file)
+
+    def _prune_versions(self, keep):
+        versions_dir = os.path.join(self.index_path, VERSIONS_DIR)
+        current = self.current_version()
+        # Version names sort chronologically; workers still holding a removed
+        # version keep reading it through their open file handles (the mmapped
+        # index and the docstore's shared connection, opened when it was loaded)
+        for version in sorted(os.listdir(versions_dir))[:-keep]:
+            if version != current:
+                shutil.rmtree(self._version_dir(version), ignore_errors=True)
+
+    def _open_db(self, version, writable_dir=None):
+        """
+        FAISS store over a version's index.faiss and docstore.sqlite3. The
+        read-only variant memory-maps the vectors (shared between workers through
+        the page cache) and reads chunk text from SQLite per hit. With
+        `writable_dir`, the index is loaded into memory and the docstore copied
+        there, as the starting point of the next version.
+        """
+        version_dir = self._version_dir(version)
+        index_file = os.path.join(version_dir, INDEX_FILE)
+        docstore_file = os.path.join(version_dir, DOCSTORE_FILE)
+        if writable_dir:
+            new_docstore_file = os.path.join(writable_dir, DOCSTORE_FILE)
+            shutil.copyfile(docstore_file, new_docstore_file)
+            docstore = SQLiteDocstore(new_docstore_file)
+            index = self.index_config.tune(faiss.read_index(index_file))
+            return FAISS(self.embeddings, index, docstore, docstore.positions())
+
+        docstore = SQLiteDocstore(docstore_file, read_only=True)
+        index = self.index_config.tune(faiss.read_index(index_file, mmap_flags(index_file)))
+        return FAISS(self.embeddings, index, docstore, SQLitePositionMap(docstore))
+
+    def _has_index(self, version):
+        return version is not None and all(
+            os.path.exists(os.path.join(self._version_dir(version), name))
+            for name in (INDEX_FILE, DOCSTORE_FILE, MANIFEST_FILE)
+        )
+
+    def load_index(self, version=None):
+        version = version or self.current_version()
+        if self._has_index(version):
             try:
-                self.vector_db = FAISS.load_local(
-                    str(self.index_path), 
-                    self.embeddings, 
-                    allow_dangerous_deserialization=True
-                )
+                vector_db = self._open_db(version)
+                # Swapping the reference is atomic; searches already running
+                # finish on the store they started with
+                self.vector_db, self.version = vector_db, version
+                self.query_cache.clear()
                 return True
             except Exception as e:
                 print(f"Error loading FAISS index: {e}")
                 return False
         return False
 
-    def build_index(self):
+    def _maybe_reload(self):
+        """Picks up a newly published version, checking the pointer at most every reload_interval seconds."""
+        now = time.monotonic()
+        if now < self._next_reload_check or not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_reload_check = now + self.reload_interval
+            version = self.current_version()
+            if version is not None and version != self.version:
+                self.load_index(version)
+        finally:
+            self._reload_lock.release()
+
+    def _source_files(self):
+        """Indexable files in the docs folder, as {file name: sha256 of its content}."""
+        files = {}
+        for name in sorted(os.listdir(self.docs_path)):
+            if not name.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            path = os.path.join(self.docs_path, name)
+            if os.path.isfile(path):
+                files[name] = file_sha256(path)
+        return files
+
+    def _load_manifest(self, version):
+        with open(os.path.join(self._version_dir(version), MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, version_dir, manifest):
+        with open(os.path.join(version_dir, MANIFEST_FILE), "w", encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    def build_index(self, full=False, workers=None, batch_size=None, progress=None):
+        """
+        Brings the index in line with the docs folder and publishes the result
+        as a new version. The manifest records the content hash and chunk IDs of
+        every source file, so only added or changed files are split and
+        embedded, and the vectors of changed or deleted files are removed.
+        `full=True` re-embeds everything. Ingestion goes through
+        IngestionPipeline; `progress` receives its stats after every batch.
+        """
+        self.last_ingestion = None
         if not os.path.exists(self.docs_path):
             os.makedirs(self.docs_path)
             
@@ -43,39 +262,160 @@ class ClinicVectorStore:
             with open(welcome_file, "w", encoding='utf-8') as f:
                 f.write("مرحباً بكم في العيادة. نحن نقدم أفضل الخدمات الطبية.")
 
-        loaders = [
-            DirectoryLoader(str(self.docs_path), glob="*.txt", loader_cls=TextLoader),
-            DirectoryLoader(str(self.docs_path), glob="*.pdf", loader_cls=PyPDFLoader),
-        ]
-        
-        docs = []
-        for loader in loaders:
-            try:
-                docs.extend(loader.load())
-            except Exception as e:
-                print(f"Error loading from {loader}: {e}")
+        config = self.index_config
+        sources = self._source_files()
 
-        if not docs:
-            return False
+        base_version = self.current_version()
+        if full or not self._has_index(base_version):
+            base_version = None
+        manifest = self._load_manifest(base_version) if base_version else None
+        stale = []
+        if manifest is not None:
+            stale = [name for name, entry in manifest["files"].items() if sources.get(name) != entry["sha256"]]
+            # An older layout, a different index type/shape, or removals the
+            # index type cannot do, mean a full rebuild
+            if (manifest.get("version") != MANIFEST_VERSION
+                    or manifest.get("index") not in (config.signature(), config.signature(n_train=0))
+                    or (stale and not config.supports_removal)):
+                base_version, manifest, stale = None, None, []
+        if manifest is None:
+            manifest = {"version": MANIFEST_VERSION, "index": config.signature(), "files": {}}
+        indexed = manifest["files"]
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        splits = text_splitter.split_documents(docs)
+        pending = [name for name, sha in sources.items() if name not in indexed or indexed[name]["sha256"] != sha]
 
-        self.vector_db = FAISS.from_documents(splits, self.embeddings)
-        
-        if not os.path.exists(self.index_path):
-            os.makedirs(self.index_path)
-            
-        self.vector_db.save_local(str(self.index_path))
-        return True
+        if not stale and not pending:
+            if base_version and base_version != self.version:
+                self.load_index(base_version)
+            return base_version is not None and self.vector_db is not None
 
-    def get_retriever(self):
+        version = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+        version_dir = self._version_dir(version)
+        os.makedirs(version_dir)
+        try:
+            vector_db = self._open_db(base_version, writable_dir=version_dir) if base_version else None
+
+            # Vectors of deleted or changed files go first
+            stale_ids = [chunk_id for name in stale for chunk_id in indexed.pop(name)["chunk_ids"]]
+            if stale_ids and vector_db is not None:
+                vector_db.delete(stale_ids)
+
+            # Trainable indexes (IVF-PQ, SQ8) are created once train_size vectors
+            # have been buffered, or at the end for smaller corpora
+            buffered = []
+            buffered_count = 0
+
+            def flush_buffered():
+                nonlocal vector_db, buffered_count
+                training_vectors = np.array([v for batch in buffered for v in batch[1]], dtype=np.float32)
+                docstore = SQLiteDocstore(os.path.join(version_dir, DOCSTORE_FILE))
+                index = config.create(training_vectors.shape[1], training_vectors)
+                manifest["index"] = config.signature(len(training_vectors))
+                vector_db = FAISS(self.embeddings, index, docstore, {})
+                for texts, vectors, metadatas, ids in buffered:
+                    vector_db.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+                buffered.clear()
+                buffered_count = 0
+
+            def add_batch(texts, vectors, metadatas, ids):
+                nonlocal vector_db, buffered_count
+                if vector_db is None:
+                    buffered.append((texts, vectors, metadatas, ids))
+                    buffered_count += len(vectors)
+                    if not config.needs_training or buffered_count >= config.train_size:
+                        flush_buffered()
+                    return
+                vector_db.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+
+            def chunk_ids(name, count):
+                return [f"{name}:{sources[name][:12]}:{n}" for n in range(count)]
+
+            pipeline = IngestionPipeline(
+                self.embeddings,
+                batch_size=batch_size or getattr(settings, "INGEST_BATCH_SIZE", 64),
+                workers=workers or getattr(settings, "INGEST_WORKERS", 1),
+                progress=progress
+            )
+            paths = [(name, os.path.join(self.docs_path, name)) for name in pending]
+            for name, ids in pipeline.run(paths, add_batch, chunk_ids).items():
+                indexed[name] = {"sha256": sources[name], "chunk_ids": ids}
+            if buffered:
+                flush_buffered()
+            self.last_ingestion = pipeline.stats.as_dict()
+
+            if vector_db is None:
+                shutil.rmtree(version_dir, ignore_errors=True)
+                return False
+
+            # An ivfpq index that fell back to flat for lack of training data is
+            # rebuilt as IVF-PQ once the corpus can train it
+            n_train = min(vector_db.index.ntotal, config.train_size)
+            if manifest["index"] == config.signature(n_train=0) != config.signature(n_train):
+                vector_db.docstore.close()
+                shutil.rmtree(version_dir, ignore_errors=True)
+                return self.build_index(full=True, workers=workers, batch_size=batch_size, progress=progress)
+
+            vector_db.docstore.save_positions(vector_db.index_to_docstore_id)
+            vector_db.docstore.close()
+            faiss.write_index(vector_db.index, os.path.join(version_dir, INDEX_FILE))
+            self._save_manifest(version_dir, manifest)
+        except Exception:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+
+        self._publish(version)
+        self._prune_versions(getattr(settings, "FAISS_KEEP_VERSIONS", 3))
+        return self.load_index(version)
+
+    def ensure_index(self):
         if self.vector_db is None:
             if not self.load_index():
                 self.build_index()
+        else:
+            self._maybe_reload()
         
         if self.vector_db is None:
             # Fallback if building also fails for some reason
             raise Exception("Failed to initialize vector database.")
-            
-        return self.vector_db.as_retriever(search_kwargs={"k": 6})
+
+    def search(self, query, k=None):
+        """
+        Top-k documents for a query. Dense (FAISS) and lexical (BM25) candidates
+        are fused by reciprocal rank, so exact terms such as drug names, phone
+        numbers and clinic names are found even where MiniLM embeddings miss
+        them. Queries that normalize to the same Arabic text share one cache
+        entry, so repeats skip the embedding model and both searches.
+        """
+        k = k or getattr(settings, "RETRIEVER_K", 4)
+        self.ensure_index()
+        # One consistent store for the whole lookup, even if a reload swaps it meanwhile
+        vector_db, version = self.vector_db, self.version
+        key = (version, normalize_arabic(query), k)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            with record_stage("search"):
+                docs = [vector_db.docstore.search(doc_id) for doc_id in cached["doc_ids"]]
+            return [d for d in docs if not isinstance(d, str)]
+
+        with record_stage("embedding"):
+            vector = self.embeddings.embed_query(query)
+        with record_stage("search"):
+            if not getattr(settings, "HYBRID_SEARCH", True):
+                docs = vector_db.similarity_search_by_vector(vector, k=k)
+                self.query_cache.set(key, vector, [d.id for d in docs])
+                return docs
+
+            fetch_k = max(k, getattr(settings, "RETRIEVER_FETCH_K", 20))
+            dense_ids = [d.id for d in vector_db.similarity_search_by_vector(vector, k=fetch_k)]
+            lexical_ids = [doc_id for doc_id, _ in vector_db.docstore.bm25.search(query, k=fetch_k)]
+            doc_ids = reciprocal_rank_fusion([dense_ids, lexical_ids], k=getattr(settings, "RRF_K", 60))[:k]
+            self.query_cache.set(key, vector, doc_ids)
+            docs = [vector_db.docstore.search(doc_id) for doc_id in doc_ids]
+        return [d for d in docs if not isinstance(d, str)]
+
+    def cache_stats(self):
+        return self.query_cache.stats()
+
+    def get_retriever(self):
+        self.ensure_index()
+        return ClinicRetriever(vector_store=self, k=getattr(settings, "RETRIEVER_K", 4))
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ClinicAiConfig(AppConfig):
     name = 'clinic_ai'
+
+    def ready(self):
+        from . import signals  # noqa: F401
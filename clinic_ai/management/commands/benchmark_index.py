@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+from clinic_ai.ai_engine.ann import IndexConfig
+import faiss
+import numpy as np
+import time
+
+class Command(BaseCommand):
+    help = 'Compare FAISS index types (recall@k, query latency, memory) against the exact flat index on a synthetic corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=50000, help='Corpus size')
+        parser.add_argument('--dimension', type=int, default=384, help='Vector size (all-MiniLM-L6-v2 is 384)')
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('-k', type=int, default=6, help='Neighbours per query (the retriever uses 6)')
+        parser.add_argument('--train-size', type=int, default=10000, help='Vectors used to train IVF-PQ / SQ8')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def synthetic_corpus(self, rng, projection, n):
+        # Sentence embeddings have a low intrinsic dimension: clustered points in a
+        # small latent space, projected up to the embedding size, plus a little noise
+        latent_dimension, dimension = projection.shape
+        centers = rng.standard_normal((max(1, n // 200), latent_dimension))
+        latent = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, latent_dimension))
+        vectors = (latent @ projection + 0.05 * rng.standard_normal((n, dimension))).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def measure(self, index, queries, truth, k):
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            _, found = index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(found[0]) & set(expected))
+        return {
+            "recall": hits / (len(queries) * k),
+            "p50": float(np.percentile(latencies, 50)),
+            "p99": float(np.percentile(latencies, 99)),
+            "memory_mb": faiss.serialize_index(index).nbytes / (1 << 20),
+        }
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        k = options['k']
+        projection = rng.standard_normal((32, options['dimension'])) / np.sqrt(32)
+        corpus = self.synthetic_corpus(rng, projection, options['vectors'])
+        queries = self.synthetic_corpus(rng, projection, options['queries'])
+
+        flat = faiss.IndexFlatL2(options['dimension'])
+        flat.add(corpus)
+        _, truth = flat.search(queries, k)
+
+        candidates = [
+            ("flat", IndexConfig(index_type="flat", encoding="float"), [None]),
+            ("flat+sq8", IndexConfig(index_type="flat", encoding="sq8"), [None]),
+            ("hnsw", IndexConfig(index_type="hnsw", encoding="float"), [16, 32, 64, 128]),
+            ("hnsw+sq8", IndexConfig(index_type="hnsw", encoding="sq8"), [16, 32, 64, 128]),
+            ("ivfpq", IndexConfig(index_type="ivfpq"), [1, 4, 16, 64]),
+        ]
+
+        self.stdout.write(f"{options['vectors']} vectors x {options['dimension']} dims, {options['queries']} queries, k={k}")
+        self.stdout.write(f"{'index':<10} {'param':<14} {'build s':>8} {'recall@' + str(k):>9} {'p50 ms':>8} {'p99 ms':>8} {'MB':>8}")
+        for name, config, values in candidates:
+            start = time.perf_counter()
+            training = corpus[:options['train_size']] if config.needs_training else None
+            index = config.create(options['dimension'], training)
+            index.add(corpus)
+            build_seconds = time.perf_counter() - start
+
+            for value in values:
+                param = "-"
+                if value is not None:
+                    param_name = "efSearch" if config.index_type == "hnsw" else "nprobe"
+                    faiss.ParameterSpace().set_index_parameter(index, param_name, value)
+                    param = f"{param_name}={value}"
+                result = self.measure(index, queries, truth, k)
+                self.stdout.write(
+                    f"{name:<10} {param:<14} {build_seconds:>8.2f} {result['recall']:>9.3f} "
+                    f"{result['p50']:>8.3f} {result['p99']:>8.3f} {result['memory_mb']:>8.1f}"
+                )
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from clinic_ai.ai_engine.reports import fix_arabic, render_pdf, table_from_dicts, wrap_cell
+import os
+import reportlab
+import tempfile
+import time
+
+SPECIALTIES = ["طب الأسنان", "الجلدية", "الباطنية", "طب الأطفال", "العيون", "العظام"]
+STATUSES = ["مؤكد", "قيد الانتظار", "ملغي"]
+
+class Command(BaseCommand):
+    help = 'Time the PDF report renderer on synthetic appointment rows (100 / 10k / 50k rows by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 10000, 50000], help='Row counts to render')
+        parser.add_argument('--doctors', type=int, default=40, help='Distinct doctor names (cell values repeat like real data)')
+        parser.add_argument('--repeat', type=int, default=1, help='Renders per row count; the best time is reported')
+
+    def synthetic_rows(self, n, doctors):
+        return [
+            {
+                "رقم الموعد": str(i + 1),
+                "اسم الطبيب": f"د. طبيب رقم {i % doctors}",
+                "التخصص": SPECIALTIES[i % len(SPECIALTIES)],
+                "التاريخ": f"2026-{(i // 28) % 12 + 1:02d}-{i % 28 + 1:02d} {9 + i % 8}:00",
+                "الحالة": STATUSES[i % len(STATUSES)],
+            }
+            for i in range(n)
+        ]
+
+    def ensure_fonts(self):
+        registered = pdfmetrics.getRegisteredFontNames()
+        if 'Arabic' in registered and 'Arabic-Bold' in registered:
+            return
+        # Without the Noto Arabic fonts reports cannot render; ReportLab's bundled Vera
+        # lacks Arabic glyphs but has the same layout cost, which is what is measured
+        fonts = os.path.join(os.path.dirname(reportlab.__file__), 'fonts')
+        pdfmetrics.registerFont(TTFont('Arabic', os.path.join(fonts, 'Vera.ttf')))
+        pdfmetrics.registerFont(TTFont('Arabic-Bold', os.path.join(fonts, 'VeraBd.ttf')))
+        self.stderr.write(self.style.WARNING("Noto Arabic fonts not found, timing with ReportLab's Vera instead"))
+
+    def handle(self, *args, **options):
+        self.ensure_fonts()
+        self.stdout.write(f"{'rows':>8} {'seconds':>9} {'rows/s':>9} {'MB':>7} {'distinct':>9} {'reused':>8}")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.pdf')
+            for n in options['rows']:
+                rows = self.synthetic_rows(n, options['doctors'])
+                best = None
+                for _ in range(options['repeat']):
+                    fix_arabic.cache_clear()
+                    wrap_cell.cache_clear()
+                    start = time.perf_counter()
+                    render_pdf(*table_from_dicts(rows), path)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                cache = wrap_cell.cache_info()
+                self.stdout.write(
+                    f"{n:>8} {best:>9.2f} {n / best:>9.0f} {os.path.getsize(path) / (1 << 20):>7.1f} "
+                    f"{cache.misses:>9} {cache.hits:>8}"
+                )
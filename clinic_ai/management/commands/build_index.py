@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from clinic_ai.ai_engine.vectorstore import ClinicVectorStore
+import os
+
+class Command(BaseCommand):
+    help = 'Build or incrementally update the FAISS index from clinic_docs/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Re-embed every document instead of only added/changed ones')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes used for PDF text extraction')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'INGEST_BATCH_SIZE', 64), help='Chunks embedded per batch')
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(
+                f"{stats['files']} files, {stats['pages']} pages, {stats['chunks']} chunks "
+                f"({stats['pages_per_s']} pages/s, {stats['chunks_per_s']} chunks/s)"
+            )
+
+        self.stdout.write("Initializing Vector Store...")
+        vs = ClinicVectorStore()
+        self.stdout.write("Rebuilding FAISS Index..." if options['full'] else "Updating FAISS Index...")
+        if not vs.build_index(full=options['full'], workers=options['workers'], batch_size=options['batch_size'], progress=progress):
+            self.stderr.write(self.style.ERROR("Failed to build FAISS Index. Check if clinic_docs/ has files."))
+            return
+
+        if vs.last_ingestion is None:
+            self.stdout.write("FAISS Index is already up to date.")
+        else:
+            stats = vs.last_ingestion
+            self.stdout.write(
+                f"Ingested {stats['files']} files ({stats['failed']} failed), {stats['pages']} pages, {stats['chunks']} chunks "
+                f"in {stats['seconds']}s: {stats['pages_per_s']} pages/s, {stats['chunks_per_s']} chunks/s"
+            )
+        self.stdout.write(self.style.SUCCESS(f"FAISS Index built successfully at: {settings.FAISS_INDEX_PATH}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from clinic_ai.ai_engine.report_cache import evict
+
+class Command(BaseCommand):
+    help = 'Delete generated reports unused for too long, then the least recently used ones above the size limit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, default=getattr(settings, 'REPORT_CACHE_MAX_AGE', 7 * 24 * 3600) / 86400, help='Delete reports unused for longer than this')
+        parser.add_argument('--max-mb', type=float, default=getattr(settings, 'REPORT_CACHE_MAX_BYTES', 1 << 30) / (1 << 20), help='Total size the remaining reports must fit in')
+
+    def handle(self, *args, **options):
+        stats = evict(max_age=options['max_age_days'] * 86400, max_bytes=int(options['max_mb'] * (1 << 20)))
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {stats['deleted']} reports ({stats['freed'] / (1 << 20):.1f} MB); "
+            f"{stats['kept']} remain ({stats['bytes'] / (1 << 20):.1f} MB)"
+        ))
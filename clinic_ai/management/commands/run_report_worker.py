@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.conf import settings
+from clinic_ai.ai_engine.jobs import claim_next_job, requeue_stale_jobs, run_job
+from clinic_ai.ai_engine.report_cache import evict
+import os
+import socket
+import time
+
+class Command(BaseCommand):
+    help = 'Generate queued PDF/Excel reports (ReportJob rows) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait between polls of an empty queue')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty instead of polling')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after this many jobs')
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        processed = 0
+        cleanup_interval = getattr(settings, 'REPORT_CLEANUP_INTERVAL', 3600)
+        last_cleanup = None
+        self.stdout.write(f"Report worker {worker} started")
+        try:
+            while options['max_jobs'] is None or processed < options['max_jobs']:
+                close_old_connections()
+                requeue_stale_jobs()
+                if cleanup_interval and (last_cleanup is None or time.monotonic() - last_cleanup > cleanup_interval):
+                    # Keeps MEDIA_ROOT bounded without a separate cron entry
+                    stats = evict()
+                    last_cleanup = time.monotonic()
+                    if stats['deleted']:
+                        self.stdout.write(f"Evicted {stats['deleted']} reports ({stats['freed'] / (1 << 20):.1f} MB)")
+                job = claim_next_job(worker)
+                if job is None:
+                    if options['burst']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                job = run_job(job)
+                processed += 1
+                if job.status == 'done':
+                    self.stdout.write(f"Report #{job.pk} ({job.kind}) done: {job.filename}")
+                else:
+                    self.stderr.write(self.style.ERROR(f"Report #{job.pk} ({job.kind}) failed: {job.error}"))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Report worker {worker} stopped after {processed} jobs"))
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-16 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic_ai', '0007_remove_doctor_is_available_today_doctoravailability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='duration_minutes',
+            field=models.PositiveSmallIntegerField(default=30),
+        ),
+        migrations.AddField(
+            model_name='clinic',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=30, help_text="Default appointment length for the clinic's doctors"),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(blank=True, help_text="Overrides the clinic's appointment length", null=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'appointment_date'], name='clinic_ai_a_doctor__b249c9_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-17 00:05
+
+from django.db import migrations, models
+
+
+def cancel_double_bookings(apps, schema_editor):
+    # Keep the earliest booking of each (doctor, time) so the constraint can be added
+    Appointment = apps.get_model('clinic_ai', 'Appointment')
+    seen = set()
+    duplicates = []
+    active = Appointment.objects.exclude(status='cancelled').order_by('created_at', 'id')
+    for pk, doctor_id, appointment_date in active.values_list('pk', 'doctor_id', 'appointment_date'):
+        if (doctor_id, appointment_date) in seen:
+            duplicates.append(pk)
+        seen.add((doctor_id, appointment_date))
+    Appointment.objects.filter(pk__in=duplicates).update(status='cancelled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic_ai', '0008_slot_minutes_appointment_duration'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'cancelled'), _negated=True), fields=('doctor', 'appointment_date'), name='unique_active_doctor_appointment'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.0 on 2026-10-17 00:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_sessions(apps, schema_editor):
+    ChatLog = apps.get_model('clinic_ai', 'ChatLog')
+    ChatSession = apps.get_model('clinic_ai', 'ChatSession')
+    stats = (
+        ChatLog.objects.exclude(user=None).exclude(session_id=None).exclude(session_id='')
+        .values('user_id', 'session_id')
+        .annotate(count=models.Count('id'), first=models.Min('created_at'), last=models.Max('created_at'))
+    )
+    sessions = []
+    for row in stats.iterator():
+        first_log = (
+            ChatLog.objects.filter(user_id=row['user_id'], session_id=row['session_id'])
+            .order_by('created_at', 'id').values_list('question', flat=True).first()
+        )
+        sessions.append(ChatSession(
+            user_id=row['user_id'],
+            session_id=row['session_id'],
+            title=(first_log or '')[:255],
+            message_count=row['count'],
+            last_activity=row['last'],
+        ))
+    ChatSession.objects.bulk_create(sessions, batch_size=500)
+    # auto_now_add fills created_at on insert; keep the real start of each conversation
+    for row in stats.iterator():
+        ChatSession.objects.filter(user_id=row['user_id'], session_id=row['session_id']).update(created_at=row['first'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic_ai', '0009_appointment_unique_active_doctor_appointment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=100)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_activity', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_activity', '-id'], name='clinic_ai_c_user_id_2522e4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'session_id'), name='unique_user_chat_session')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chatlog',
+            index=models.Index(fields=['user', 'session_id', 'created_at'], name='clinic_ai_c_user_id_c3a15c_idx'),
+        ),
+        migrations.RunPython(create_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 02:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic_ai', '0011_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('total_ms', models.FloatField(default=0)),
+                ('history_ms', models.FloatField(default=0)),
+                ('retrieval_ms', models.FloatField(default=0)),
+                ('embedding_ms', models.FloatField(default=0)),
+                ('search_ms', models.FloatField(default=0)),
+                ('llm_ms', models.FloatField(default=0)),
+                ('tools_ms', models.FloatField(default=0)),
+                ('db_ms', models.FloatField(default=0)),
+                ('iterations', models.PositiveIntegerField(default=0)),
+                ('db_queries', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('tools', models.JSONField(blank=True, default=list)),
+                ('chat_log', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metrics', to='clinic_ai.chatlog')),
+            ],
+            options={
+                'verbose_name_plural': 'Chat metrics',
+            },
+        ),
+    ]
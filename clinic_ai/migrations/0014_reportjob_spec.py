@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic_ai', '0013_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='spec',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,11 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+# Appointment length when neither the doctor nor the clinic sets one
+DEFAULT_SLOT_MINUTES = 30
+
 class Clinic(models.Model):
     name = models.CharField(max_length=100)
     location = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     phone = models.CharField(max_length=20, blank=True)
+    slot_minutes = models.PositiveSmallIntegerField(default=DEFAULT_SLOT_MINUTES, help_text="Default appointment length for the clinic's doctors")
 
     def __str__(self):
         return self.name
@@ -14,10 +18,18 @@ class Doctor(models.Model):
     clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, related_name='doctors', null=True, blank=True)
     name = models.CharField(max_length=100)
     specialty = models.CharField(max_length=100)
+    slot_minutes = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Overrides the clinic's appointment length")
 
     def __str__(self):
         return f"{self.name} ({self.specialty}) - {self.clinic.name if self.clinic else 'No Clinic'}"
 
+    @property
+    def slot_length(self):
+        """Appointment length in minutes: the doctor's own, else the clinic's."""
+        if self.slot_minutes:
+            return self.slot_minutes
+        return self.clinic.slot_minutes if self.clinic else DEFAULT_SLOT_MINUTES
+
 class DoctorAvailability(models.Model):
     DAYS_OF_WEEK = [
         (0, 'Monday'),
@@ -46,9 +58,24 @@ class Appointment(models.Model):
     clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, related_name='appointments', null=True, blank=True)
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
     appointment_date = models.DateTimeField()
+    duration_minutes = models.PositiveSmallIntegerField(default=DEFAULT_SLOT_MINUTES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Booked intervals of a doctor over a date range (slot engine)
+            models.Index(fields=['doctor', 'appointment_date']),
+        ]
+        constraints = [
+            # A doctor cannot have two active appointments starting at the same time
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date'],
+                condition=~models.Q(status='cancelled'),
+                name='unique_active_doctor_appointment',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.user.username} at {self.clinic.name if self.clinic else 'N/A'} - {self.doctor.name} on {self.appointment_date}"
 
@@ -71,5 +98,111 @@ class ChatLog(models.Model):
     answer = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Transcript of one conversation, in order
+            models.Index(fields=['user', 'session_id', 'created_at']),
+        ]
+
     def __str__(self):
         return f"Chat by {self.user.username if self.user else 'Guest'} at {self.created_at}"
+
+class ChatMetrics(models.Model):
+    """Where the time and tokens of the request that produced a ChatLog went."""
+    chat_log = models.OneToOneField(ChatLog, on_delete=models.CASCADE, related_name='metrics')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Milliseconds; embedding and search are parts of retrieval, db overlaps tools
+    total_ms = models.FloatField(default=0)
+    history_ms = models.FloatField(default=0)
+    retrieval_ms = models.FloatField(default=0)
+    embedding_ms = models.FloatField(default=0)
+    search_ms = models.FloatField(default=0)
+    llm_ms = models.FloatField(default=0)
+    tools_ms = models.FloatField(default=0)
+    db_ms = models.FloatField(default=0)
+    iterations = models.PositiveIntegerField(default=0)
+    db_queries = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    # [{"name": tool name, "ms": duration}] in call order
+    tools = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Chat metrics"
+
+    def __str__(self):
+        return f"Metrics of chat {self.chat_log_id}: {self.total_ms:.0f} ms"
+
+class ChatSession(models.Model):
+    """
+    One conversation of a user, with its sidebar metadata kept up to date as
+    ChatLog rows are written (see clinic_ai.signals), so listing conversations
+    never aggregates over the messages.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_sessions')
+    session_id = models.CharField(max_length=100)
+    title = models.CharField(max_length=255, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_activity = models.DateTimeField()
+    # Rolling summary of the turns that no longer fit the history token budget,
+    # covering every ChatLog of the session up to the id in summarized_until
+    summary = models.TextField(blank=True)
+    summarized_until = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session_id'], name='unique_user_chat_session'),
+        ]
+        indexes = [
+            # Keyset pagination of a user's conversations, most recent first
+            models.Index(fields=['user', '-last_activity', '-id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.title or self.session_id}"
+
+class ReportJob(models.Model):
+    """
+    A PDF/Excel report requested from the chat, generated by the
+    run_report_worker command instead of inside the agent loop.
+    """
+    KIND_CHOICES = [
+        ('pdf', 'PDF'),
+        ('xlsx', 'Excel'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('expired', 'Expired'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs', null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Rows of the report: a list of dicts, the first one's keys are the headers...
+    payload = models.JSONField(default=list)
+    # ...or a parsed report spec, read from the database by the worker (see ai_engine.report_specs)
+    spec = models.JSONField(null=True, blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest pending job
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    @property
+    def file_url(self):
+        from django.conf import settings
+        return f"{settings.MEDIA_URL}{self.filename}" if self.filename else None
+
+    def __str__(self):
+        return f"{self.get_kind_display()} report #{self.pk} ({self.status})"
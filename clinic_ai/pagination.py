@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+
+class ChatSessionCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the history sidebar: each page continues from the
+    (last_activity, id) position encoded in the cursor, served by the
+    (user, -last_activity, -id) index, so deep pages cost the same as the first.
+    """
+    ordering = ('-last_activity', '-id')
+    page_size = 30
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_message_cursor(created_at, pk):
+    """Keyset position of a ChatLog row: '<microseconds since epoch>.<id>'."""
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}.{pk}"
+
+
+def decode_message_cursor(cursor):
+    """Inverse of encode_message_cursor; raises ValueError for a malformed cursor."""
+    micros, pk = cursor.split(".")
+    return EPOCH + timedelta(microseconds=int(micros)), int(pk)
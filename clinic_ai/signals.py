@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .ai_engine.resolver import resolver
+from .ai_engine.schedule import schedule_cache
+from .ai_engine.tool_cache import tool_cache
+from .models import ChatLog, ChatSession, Clinic, ClinicInfo, Doctor, DoctorAvailability
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+@receiver([post_save, post_delete], sender=Clinic)
+def invalidate_entity_resolver(sender, **kwargs):
+    resolver.invalidate()
+    # A rebuild that ran while the transaction was open may have read the old rows
+    transaction.on_commit(resolver.invalidate)
+
+
+@receiver([post_save, post_delete], sender=DoctorAvailability)
+def invalidate_schedule_block(sender, instance, **kwargs):
+    schedule_cache.invalidate(instance.doctor_id)
+    transaction.on_commit(lambda: schedule_cache.invalidate(instance.doctor_id))
+
+
+@receiver([post_save, post_delete], sender=ClinicInfo)
+@receiver([post_save, post_delete], sender=DoctorAvailability)
+@receiver([post_save, post_delete], sender=Doctor)
+@receiver([post_save, post_delete], sender=Clinic)
+def invalidate_tool_cache(sender, **kwargs):
+    tool_cache.invalidate()
+    transaction.on_commit(tool_cache.invalidate)
+
+
+@receiver(post_save, sender=ChatLog)
+def update_chat_session(sender, instance, created, **kwargs):
+    if not created or not instance.user_id or not instance.session_id:
+        return
+    session, new = ChatSession.objects.get_or_create(
+        user_id=instance.user_id,
+        session_id=instance.session_id,
+        defaults={"title": instance.question[:255], "message_count": 1, "last_activity": instance.created_at}
+    )
+    if not new:
+        # F() so that concurrent messages of one conversation are all counted
+        ChatSession.objects.filter(pk=session.pk).update(
+            message_count=F("message_count") + 1,
+            last_activity=Greatest(F("last_activity"), Value(instance.created_at))
+        )
+
+
+@receiver(post_delete, sender=ChatLog)
+def uncount_chat_message(sender, instance, **kwargs):
+    if instance.user_id and instance.session_id:
+        ChatSession.objects.filter(user_id=instance.user_id, session_id=instance.session_id, message_count__gt=0).update(
+            message_count=F("message_count") - 1
+        )
@@ -1,3 +1,1034 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from langchain_core.callbacks import CallbackManager
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from asgiref.sync import async_to_sync
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from io import StringIO
+from itertools import combinations
+from types import SimpleNamespace
+from unittest import mock
+from time import perf_counter
+import json
+import logging
+import numpy as np
+import openpyxl
+import os
+import re
+import reportlab
+import tempfile
+import warnings
+import zlib
+from clinic_ai.context import current_user
+from clinic_ai.models import Appointment, ChatLog, ChatSession, Clinic, ClinicInfo, Doctor, DoctorAvailability, ReportJob
+from clinic_ai.ai_engine import booking, jobs, memory, report_cache, reports
+from clinic_ai.ai_engine.ann import INDEX_TYPES, MIN_TRAINING_VECTORS, IndexConfig
+from clinic_ai.ai_engine.arabic import STOPWORDS
+from clinic_ai.ai_engine.bm25 import reciprocal_rank_fusion, terms
+from clinic_ai.ai_engine.chains import TOOL_STATUS_MESSAGES, ClinicAIChat
+from clinic_ai.ai_engine.docstore import SQLiteDocstore
+from clinic_ai.ai_engine.metrics import RequestMetrics, current_metrics
+from clinic_ai.ai_engine.resolver import resolver
+from clinic_ai.ai_engine.router import IntentRouter
+from clinic_ai.ai_engine.router import IntentRouter
+from clinic_ai.ai_engine.schedule import schedule_cache
+from clinic_ai.ai_engine.slots import BusyIntervals, free_slots, is_slot_start, next_free_slots, to_db, to_local
+from clinic_ai.ai_engine.tool_cache import tool_cache
+from clinic_ai.ai_engine.tools import book_appointment, generate_excel_report, generate_report, get_clinic_general_info, get_doctor_availability, list_all_doctors, list_clinics
+from clinic_ai.ai_engine.vectorstore import IVF_MMAP_FLAGS, ClinicVectorStore, QueryCache, mmap_flags
+from clinic_ai.views import ChatHistoryView
 
-# Create your tests here.
+logger = logging.getLogger(__name__)
+
+
+class FakeAgent:
+    """Stands in for the AgentExecutor: runs one tool, then streams the answer through the callbacks."""
+
+    def __init__(self, answer, tool="list_clinics", error=None):
+        self.answer = answer
+        self.tool = tool
+        self.error = error
+
+    def invoke(self, inputs, config=None):
+        manager = CallbackManager.configure(inheritable_callbacks=config["callbacks"])
+        manager.on_tool_start({"name": self.tool}, inputs["input"]).on_tool_end("")
+        if self.error:
+            raise self.error
+        run = manager.on_chat_model_start({}, [[HumanMessage(content=inputs["input"])]])[0]
+        for token in re.findall(r"\S+\s*", self.answer):
+            run.on_llm_new_token(token)
+        run.on_llm_end(LLMResult(generations=[[ChatGeneration(message=AIMessage(content=self.answer))]]))
+        return {"output": self.answer}
+
+
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="patient")
+        self.client.force_login(self.user)
+        self.chat = ClinicAIChat.__new__(ClinicAIChat)
+        self.chat.vector_store = mock.Mock(**{"get_retriever.return_value.invoke.return_value": []})
+        self.chat.router = None
+
+    def test_tool_and_answer_tokens_are_forwarded(self):
+        answer = "العيادات المتوفرة: الأسنان والجلدية"
+        self.chat.agent_executor = FakeAgent(answer)
+        events = list(self.chat.stream("ما هي العيادات؟", user=self.user))
+
+        self.assertEqual(events[0], {"type": "tool", "name": "list_clinics", "message": TOOL_STATUS_MESSAGES["list_clinics"]})
+        self.assertEqual("".join(event["text"] for event in events[1:-1]), answer)
+        self.assertEqual({event["type"] for event in events[1:-1]}, {"token"})
+        self.assertEqual(events[-1], {"type": "done", "answer": answer})
+
+    def test_agent_error_ends_the_stream(self):
+        self.chat.agent_executor = FakeAgent("", error=RuntimeError("timeout"))
+        events = list(self.chat.stream("ما هي العيادات؟", user=self.user))
+        self.assertEqual([event["type"] for event in events], ["tool", "error"])
+        self.assertEqual(events[-1]["message"], "timeout")
+
+    def test_view_sends_sse_frames_and_logs_after_done(self):
+        events = [
+            {"type": "tool", "name": "list_clinics", "message": TOOL_STATUS_MESSAGES["list_clinics"]},
+            {"type": "token", "text": "أهلاً "},
+            {"type": "token", "text": "بك"},
+            {"type": "done", "answer": "أهلاً بك"},
+        ]
+        chat = mock.Mock(stream=mock.Mock(return_value=iter(events)))
+        with mock.patch("clinic_ai.ai_engine.chains.get_ai_chat", return_value=chat):
+            response = self.client.post("/api/chat/", {"query": "مرحبا", "session_id": "s1", "stream": True}, content_type="application/json")
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            self.assertEqual(response["Cache-Control"], "no-cache")
+            frames = iter(response.streaming_content)
+            head = [next(frames) for _ in range(3)]
+            # Nothing is logged until the answer is complete
+            self.assertFalse(ChatLog.objects.exists())
+            frames = [frame.decode() for frame in head + list(frames)]
+
+        for frame in frames:
+            self.assertTrue(frame.startswith("data: ") and frame.endswith("\n\n"))
+        self.assertEqual([json.loads(frame[len("data: "):]) for frame in frames], events)
+        log = ChatLog.objects.get()
+        self.assertEqual((log.user, log.session_id, log.question, log.answer), (self.user, "s1", "مرحبا", "أهلاً بك"))
+
+
+class AsyncChatViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="patient")
+        self.chat = mock.Mock(aask=mock.AsyncMock(return_value="أهلاً"))
+        self.enterContext(mock.patch("clinic_ai.ai_engine.chains.get_ai_chat", return_value=self.chat))
+
+    def test_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post("/api/chat/async/", {"query": "مرحبا"}, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        self.chat.aask.assert_not_called()
+
+    def test_rejects_non_json_body(self):
+        self.client.force_login(self.user)
+        response = self.client.post("/api/chat/async/", {"query": "مرحبا"})
+        self.assertEqual(response.status_code, 415)
+        self.chat.aask.assert_not_called()
+
+    def test_answers_json_body(self):
+        self.client.force_login(self.user)
+        response = self.client.post("/api/chat/async/", {"query": "مرحبا", "session_id": "s1"}, content_type="application/json")
+        self.assertEqual(response.json()["answer"], "أهلاً")
+        self.assertEqual(ChatLog.objects.get().answer, "أهلاً")
+
+
+class CharacterEmbeddings(Embeddings):
+    """Stands in for MiniLM: normalized bag-of-character-bigram vectors (crc32, so runs are reproducible)."""
+
+    def __init__(self, dimension=512):
+        self.dimension = dimension
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for i in range(len(text) - 1):
+            vector[zlib.crc32(text[i:i + 2].encode()) % self.dimension] += 1
+        return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def paragraph(i):
+    # About 300 characters, so the splitter keeps every paragraph as its own chunk
+    words = ["العيادة", "الطبيب", "الموعد", "العلاج", "الأسنان", "الجلدية", "الأطفال", "المختبر"]
+    body = " ".join(words[(i * 7 + n) % len(words)] + str((i * 13 + n) % 97) for n in range(30))
+    return f"code{i}x {body}"[:300]
+
+
+class VectorStoreTestCase(TestCase):
+    """Runs ClinicVectorStore on temporary docs/index folders with CharacterEmbeddings."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.docs_dir = os.path.join(tmp.name, "docs")
+        os.makedirs(self.docs_dir)
+        self.enterContext(override_settings(DOCS_DIR=self.docs_dir, FAISS_INDEX_PATH=os.path.join(tmp.name, "index")))
+
+    def store(self, index_type="flat", embeddings=None):
+        # A small dimension and two PQ sub-quantizers keep IVF-PQ training fast
+        config = IndexConfig(index_type=index_type, pq_m=2)
+        return ClinicVectorStore(embeddings=embeddings or CharacterEmbeddings(64), index_config=config)
+
+    def write_doc(self, name, paragraphs):
+        with open(os.path.join(self.docs_dir, name), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+
+
+class QueryCacheTests(VectorStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_doc("guide.txt", [paragraph(i) for i in range(20)])
+        self.embeddings = CharacterEmbeddings(64)
+        self.vector_store = self.store(embeddings=self.embeddings)
+        self.vector_store.build_index()
+        self.embeddings.calls = 0
+
+    def test_repeated_query_skips_embedding(self):
+        first = self.vector_store.search("العِيادة code7x", k=3)
+        # Same normalized text: served from the cache
+        second = self.vector_store.search("العيادة  code7x", k=3)
+        self.assertEqual([d.id for d in first], [d.id for d in second])
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual(self.vector_store.cache_stats(), {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5})
+        # k is part of the key
+        self.vector_store.search("العيادة code7x", k=2)
+        self.assertEqual(self.embeddings.calls, 2)
+
+    def test_entries_expire(self):
+        self.vector_store.query_cache.ttl = 60
+        with mock.patch("clinic_ai.ai_engine.vectorstore.time.monotonic", return_value=1000.0) as monotonic:
+            self.vector_store.search("code7x")
+            monotonic.return_value = 1059.0
+            self.vector_store.search("code7x")
+            self.assertEqual(self.embeddings.calls, 1)
+            monotonic.return_value = 1061.0
+            self.vector_store.search("code7x")
+            self.assertEqual(self.embeddings.calls, 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryCache(max_size=2)
+        cache.set("a", [0.0], ["1"])
+        cache.set("b", [0.0], ["2"])
+        cache.get("a")
+        cache.set("c", [0.0], ["3"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a")["doc_ids"], ["1"])
+        self.assertEqual(cache.stats()["size"], 2)
+
+
+class IncrementalBuildTests(VectorStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_doc("a.txt", [paragraph(i) for i in range(0, 3)])
+        self.write_doc("b.txt", [paragraph(i) for i in range(3, 6)])
+        self.write_doc("c.txt", [paragraph(i) for i in range(6, 9)])
+        self.embeddings = CharacterEmbeddings(64)
+        self.vector_store = self.store(embeddings=self.embeddings)
+        self.assertTrue(self.vector_store.build_index())
+        self.manifest = self.vector_store._load_manifest(self.vector_store.version)
+        self.embeddings.calls = 0
+
+    def codes(self):
+        vector_db = self.vector_store.vector_db
+        return sorted(vector_db.docstore.search(doc_id).page_content.split()[0] for doc_id in vector_db.index_to_docstore_id.values())
+
+    def test_unchanged_docs_are_not_rebuilt(self):
+        version = self.vector_store.version
+        # Also from a fresh store, which starts from the published version
+        for vector_store in (self.vector_store, self.store(embeddings=self.embeddings)):
+            self.assertTrue(vector_store.build_index())
+            self.assertEqual(vector_store.version, version)
+        self.assertEqual(self.embeddings.calls, 0)
+
+    def test_only_changed_files_are_embedded(self):
+        self.write_doc("b.txt", [paragraph(i) for i in range(3, 6)] + [paragraph(20)])
+        os.remove(os.path.join(self.docs_dir, "c.txt"))
+        self.assertTrue(self.vector_store.build_index())
+
+        # b.txt's four chunks are embedded again; a.txt is carried over and c.txt removed
+        self.assertEqual(self.embeddings.calls, 4)
+        self.assertEqual(self.vector_store.vector_db.index.ntotal, 7)
+        self.assertEqual(self.codes(), sorted(f"code{i}x" for i in (0, 1, 2, 3, 4, 5, 20)))
+
+        manifest = self.vector_store._load_manifest(self.vector_store.version)
+        self.assertEqual(sorted(manifest["files"]), ["a.txt", "b.txt"])
+        self.assertEqual(manifest["files"]["a.txt"], self.manifest["files"]["a.txt"])
+        self.assertNotEqual(manifest["files"]["b.txt"]["sha256"], self.manifest["files"]["b.txt"]["sha256"])
+
+    def test_full_rebuild(self):
+        self.assertTrue(self.vector_store.build_index(full=True))
+        self.assertEqual(self.embeddings.calls, 9)
+        self.assertEqual(self.codes(), sorted(f"code{i}x" for i in range(9)))
+
+
+class IngestionTests(VectorStoreTestCase):
+    def test_unreadable_file_is_logged_and_skipped(self):
+        self.write_doc("guide.txt", [paragraph(i) for i in range(5)])
+        with open(os.path.join(self.docs_dir, "broken.txt"), "wb") as f:
+            f.write("عيادة".encode("cp1256"))
+        vector_store = self.store()
+        with self.assertLogs("clinic_ai.ai_engine.ingestion", "WARNING") as logs:
+            self.assertTrue(vector_store.build_index(batch_size=2))
+        self.assertIn("broken.txt", logs.output[0])
+        self.assertEqual((vector_store.last_ingestion["files"], vector_store.last_ingestion["failed"]), (1, 1))
+        self.assertEqual((vector_store.last_ingestion["chunks"], vector_store.vector_db.index.ntotal), (5, 5))
+
+
+class IndexReloadTests(VectorStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_doc("a.txt", [paragraph(i) for i in range(3)])
+        self.builder = self.store()
+        self.builder.build_index()
+        # A serving worker on the same index folder
+        self.worker = self.store()
+        self.worker.ensure_index()
+
+    def publish(self, paragraphs):
+        self.write_doc("b.txt", paragraphs)
+        self.builder.build_index()
+        self.assertNotEqual(self.builder.version, self.worker.version)
+
+    def test_new_version_is_picked_up(self):
+        self.worker.search("code1x")
+        self.publish([paragraph(7)])
+        self.worker._next_reload_check = 0.0
+        self.worker.ensure_index()
+
+        self.assertEqual(self.worker.version, self.builder.version)
+        self.assertEqual(self.worker.vector_db.index.ntotal, 4)
+        # Cached hits point into the old version
+        self.assertEqual(self.worker.cache_stats()["size"], 0)
+        self.assertIn("code7x", [doc.page_content.split()[0] for doc in self.worker.search("code7x", k=4)])
+
+    def test_pointer_is_polled_at_most_every_interval(self):
+        version = self.worker.version
+        self.worker.reload_interval = 30
+        with mock.patch("clinic_ai.ai_engine.vectorstore.time.monotonic", return_value=1000.0) as monotonic:
+            self.worker.ensure_index()
+            self.publish([paragraph(7)])
+            monotonic.return_value = 1029.0
+            self.worker.ensure_index()
+            self.assertEqual(self.worker.version, version)
+            monotonic.return_value = 1030.0
+            self.worker.ensure_index()
+            self.assertEqual(self.worker.version, self.builder.version)
+
+    def test_old_versions_are_pruned(self):
+        with override_settings(FAISS_KEEP_VERSIONS=2):
+            for i in range(3):
+                self.publish([paragraph(10 + i)])
+        versions = sorted(os.listdir(os.path.join(settings.FAISS_INDEX_PATH, "versions")))
+        self.assertEqual(versions[-1], self.builder.current_version())
+        self.assertEqual(len(versions), 2)
+
+    def test_pruned_version_stays_readable(self):
+        version = self.worker.version
+        with override_settings(FAISS_KEEP_VERSIONS=1):
+            self.publish([paragraph(7)])
+        self.assertFalse(os.path.exists(self.worker._version_dir(version)))
+        # The worker has not polled the pointer yet, and new request threads
+        # have never opened the docstore
+        self.worker._next_reload_check = float("inf")
+        with ThreadPoolExecutor(2) as pool:
+            docs = pool.submit(self.worker.search, "code1x", 3).result()
+        self.assertEqual(self.worker.version, version)
+        self.assertEqual(sorted(doc.page_content.split()[0] for doc in docs), ["code0x", "code1x", "code2x"])
+
+
+class VectorIndexTypeTests(VectorStoreTestCase):
+    def index_file(self, store):
+        return os.path.join(store._version_dir(store.version), "index.faiss")
+
+    def test_each_index_type_builds_reloads_and_searches(self):
+        # Above MIN_TRAINING_VECTORS, so ivfpq really builds an IVF index
+        self.write_doc("guide.txt", [paragraph(i) for i in range(1100)])
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type):
+                self.assertTrue(self.store(index_type).build_index())
+                # A fresh store goes through the memory-mapped load path
+                store = self.store(index_type)
+                self.assertTrue(store.load_index())
+                self.assertEqual(store.vector_db.index.ntotal, 1100)
+                self.assertEqual(mmap_flags(self.index_file(store)) == IVF_MMAP_FLAGS, index_type == "ivfpq")
+                # IVF-PQ distances are approximate; the BM25 half of the fusion still finds the chunk
+                docs = store.search("code417x", k=3)
+                self.assertIn("code417x", [doc.page_content.split()[0] for doc in docs])
+
+    def test_ivfpq_fallback_is_upgraded_once_trainable(self):
+        self.write_doc("a.txt", [paragraph(i) for i in range(MIN_TRAINING_VECTORS - 100)])
+        store = self.store("ivfpq")
+        self.assertTrue(store.build_index())
+        self.assertEqual(store._load_manifest(store.version)["index"], store.index_config.signature(n_train=0))
+        self.assertNotEqual(mmap_flags(self.index_file(store)), IVF_MMAP_FLAGS)
+
+        self.write_doc("b.txt", [paragraph(i) for i in range(MIN_TRAINING_VECTORS - 100, MIN_TRAINING_VECTORS + 100)])
+        self.assertTrue(store.build_index())
+        self.assertEqual(store.vector_db.index.ntotal, MIN_TRAINING_VECTORS + 100)
+        self.assertEqual(store._load_manifest(store.version)["index"], store.index_config.signature())
+        self.assertEqual(mmap_flags(self.index_file(store)), IVF_MMAP_FLAGS)
+
+
+class BM25Tests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.docstore = SQLiteDocstore(os.path.join(tmp.name, "docstore.sqlite3"))
+        self.addCleanup(self.docstore.close)
+        texts = {
+            "short": "عيادة الأسنان في الطابق الأول",
+            "long": "عيادة الأسنان تستقبل المرضى من السبت إلى الخميس في الطابق الثاني بجانب المختبر والصيدلية",
+            "derm": "عيادة الجلدية في الطابق الثالث",
+            "lab": "المختبر يفتح من الساعة السابعة صباحاً",
+        }
+        self.docstore.add({doc_id: Document(page_content=text) for doc_id, text in texts.items()})
+
+    def test_rare_terms_and_shorter_chunks_score_higher(self):
+        ranked = self.docstore.bm25.search("الأسنان")
+        self.assertEqual([doc_id for doc_id, _ in ranked], ["short", "long"])
+        scores = dict(self.docstore.bm25.search("عيادة الجلدية"))
+        # "جلديه" is in one chunk, "عياده" in three: the rare term decides the ranking
+        self.assertEqual(max(scores, key=scores.get), "derm")
+        self.assertGreater(scores["derm"] - scores["short"], scores["short"])
+
+    def test_stopwords_are_ignored(self):
+        self.assertEqual(self.docstore.bm25.search("في من إلى"), [])
+        self.assertEqual(self.docstore.bm25.search("ما هو المختبر؟"), self.docstore.bm25.search("المختبر"))
+        self.assertFalse(STOPWORDS & set(terms(" ".join(["في", "الذي", "إلى", "على"]))))
+
+    def test_reciprocal_rank_fusion(self):
+        # "c" is third and first, so it beats "a" which only one list ranks first
+        self.assertEqual(reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]]), ["c", "a", "b", "d"])
+
+
+class HybridSearchTests(VectorStoreTestCase):
+    def test_dense_and_lexical_hits_are_fused(self):
+        self.write_doc("guide.txt", [paragraph(i) for i in range(4)])
+        store = self.store()
+        store.build_index()
+        docstore = store.vector_db.docstore
+        by_code = {docstore.search(doc_id).page_content.split()[0]: doc_id for doc_id in docstore.positions().values()}
+        dense = [docstore.search(by_code[code]) for code in ("code0x", "code1x", "code2x")]
+        lexical = [(by_code["code2x"], 3.0), (by_code["code3x"], 1.0)]
+        with mock.patch.object(store.vector_db, "similarity_search_by_vector", return_value=dense), \
+                mock.patch.object(docstore.bm25, "search", return_value=lexical):
+            docs = store.search("code2x", k=4)
+        self.assertEqual([doc.page_content.split()[0] for doc in docs], ["code2x", "code0x", "code1x", "code3x"])
+
+    @override_settings(HYBRID_SEARCH=False)
+    def test_dense_only(self):
+        self.write_doc("guide.txt", [paragraph(i) for i in range(4)])
+        store = self.store()
+        store.build_index()
+        with mock.patch.object(store.vector_db.docstore.bm25, "search") as bm25_search:
+            self.assertEqual(len(store.search("code2x", k=2)), 2)
+        bm25_search.assert_not_called()
+
+
+class DoctorAvailabilityToolTests(TestCase):
+    def setUp(self):
+        resolver.invalidate()
+        schedule_cache.invalidate()
+        self.clinic = Clinic.objects.create(name="عيادة الأسنان", location="الطابق الأول")
+
+    def add_doctors(self, count):
+        for i in range(count):
+            doctor = Doctor.objects.create(name=f"د. طبيب {i}", specialty="طب الأسنان", clinic=self.clinic)
+            DoctorAvailability.objects.create(doctor=doctor, day_of_week=i % 7, start_time=time(9), end_time=time(13))
+            DoctorAvailability.objects.create(doctor=doctor, day_of_week=(i + 3) % 7, start_time=time(16), end_time=time(20))
+        # The name resolver is warmed separately; only the tool's own queries are counted
+        resolver.doctors("أسنان")
+
+    def test_query_count_does_not_depend_on_matches(self):
+        # Doctors with their clinics, then all their schedules
+        for count in (1, 25):
+            with self.subTest(doctors=count):
+                Doctor.objects.all().delete()
+                self.add_doctors(count)
+                with self.assertNumQueries(2):
+                    result = get_doctor_availability.func("أسنان")
+                self.assertEqual(len(result.splitlines()), count)
+
+    def test_cached_schedule_blocks(self):
+        self.add_doctors(10)
+        first = get_doctor_availability.func("أسنان")
+        with self.assertNumQueries(1):
+            self.assertEqual(get_doctor_availability.func("أسنان"), first)
+
+    def test_availability_change_invalidates_block(self):
+        self.add_doctors(1)
+        self.assertIn("09:00 AM", get_doctor_availability.func("أسنان"))
+        DoctorAvailability.objects.filter(start_time=time(9)).get().delete()
+        result = get_doctor_availability.func("أسنان")
+        self.assertNotIn("09:00 AM", result)
+        self.assertIn("04:00 PM", result)
+
+
+class ToolCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinic = Clinic.objects.create(name="عيادة الأسنان", location="الطابق الأول")
+        Doctor.objects.create(name="د. سارة محمد", specialty="طب الأسنان", clinic=self.clinic)
+
+    def test_repeated_calls_skip_database(self):
+        before = tool_cache.stats()
+        first = list_all_doctors.func("")
+        with self.assertNumQueries(0):
+            self.assertEqual(list_all_doctors.func(""), first)
+            list_all_doctors.func("")
+        stats = tool_cache.stats()["tools"]["list_all_doctors"]
+        previous = before["tools"].get("list_all_doctors", {"hits": 0, "misses": 0})
+        self.assertEqual((stats["hits"] - previous["hits"], stats["misses"] - previous["misses"]), (2, 1))
+
+    def test_model_changes_invalidate(self):
+        self.assertNotIn("عيادة الجلدية", list_clinics.func(""))
+        Clinic.objects.create(name="عيادة الجلدية", location="الطابق الثاني")
+        self.assertIn("عيادة الجلدية", list_clinics.func(""))
+
+        self.assertIn("لا تتوفر", get_clinic_general_info.func(""))
+        ClinicInfo.objects.create(working_hours="9 ص - 9 م", location="الرياض", phone="0110000000")
+        self.assertIn("الرياض", get_clinic_general_info.func(""))
+
+
+class IntentRouterTests(TransactionTestCase):
+    # aask() runs the tool in an executor thread, which needs the data committed
+    def setUp(self):
+        cache.clear()
+        ClinicInfo.objects.create(working_hours="9 ص - 9 م", location="الرياض", phone="0110000000")
+        self.chat = ClinicAIChat.__new__(ClinicAIChat)
+        self.chat.router = IntentRouter(CharacterEmbeddings())
+        # Routed queries never reach retrieval or the agent
+        self.chat.vector_store = self.chat.agent_executor = None
+
+    def test_common_queries_are_routed(self):
+        self.assertEqual(self.chat.router.classify("ما هي ساعات العمل؟").name, "clinic_info")
+        self.assertEqual(self.chat.router.classify("مواعيدي").name, "my_appointments")
+        self.assertEqual(self.chat.router.classify("قائمة العيادات من فضلك").name, "clinics")
+
+    def test_specific_queries_go_to_agent(self):
+        for query in ("قائمة الأطباء في عيادة الأسنان", "أريد حجز موعد غداً", "مواعيد د. سارة", ""):
+            with self.subTest(query=query):
+                self.assertIsNone(self.chat.router.classify(query))
+
+    def test_routed_answer_skips_llm(self):
+        metrics = RequestMetrics()
+        answer = self.chat.ask("رقم الهاتف", user=User.objects.create(username="patient"), metrics=metrics)
+        self.assertIn("0110000000", answer)
+        self.assertEqual(metrics.llm_calls, 0)
+        self.assertEqual([call["name"] for call in metrics.tools], ["get_clinic_general_info"])
+
+    def test_async_answer_resets_metrics(self):
+        async def run():
+            answer = await self.chat.aask("رقم الهاتف", user=await User.objects.acreate(username="patient"), metrics=RequestMetrics())
+            return answer, current_metrics.get()
+
+        answer, metrics = async_to_sync(run)()
+        self.assertIn("0110000000", answer)
+        self.assertIsNone(metrics)
+
+
+class SlotEngineTests(TestCase):
+    # A Monday; the doctor works 09:00-12:00 and 14:00-17:00 on Mondays, 09:00-10:00 on Tuesdays
+    MONDAY = datetime(2030, 1, 7)
+
+    def setUp(self):
+        resolver.invalidate()
+        self.clinic = Clinic.objects.create(name="عيادة الأسنان", location="الطابق الأول", slot_minutes=30)
+        self.doctor = Doctor.objects.create(name="د. سارة محمد", specialty="طب الأسنان", clinic=self.clinic)
+        for day, start, end in ((0, 9, 12), (0, 14, 17), (1, 9, 10)):
+            DoctorAvailability.objects.create(doctor=self.doctor, day_of_week=day, start_time=time(start), end_time=time(end))
+        self.user = User.objects.create(username="patient")
+
+    def at(self, hour, minute=0, days=0):
+        return self.MONDAY + timedelta(days=days, hours=hour, minutes=minute)
+
+    def test_busy_interval_overlap_and_adjacency(self):
+        busy = BusyIntervals([(self.at(10), self.at(10, 30)), (self.at(10, 30), self.at(11)), (self.at(14), self.at(14, 30))])
+        # Touching intervals merge
+        self.assertEqual(len(busy), 2)
+        self.assertTrue(busy.overlaps(self.at(10, 45), self.at(11, 15)))
+        self.assertTrue(busy.overlaps(self.at(9, 30), self.at(14, 30)))
+        # [start, end): back-to-back appointments do not overlap
+        self.assertFalse(busy.overlaps(self.at(9, 30), self.at(10)))
+        self.assertFalse(busy.overlaps(self.at(11), self.at(11, 30)))
+        self.assertFalse(BusyIntervals().overlaps(self.at(9), self.at(10)))
+
+    def test_free_slots_skip_bookings_and_stay_inside_windows(self):
+        busy = BusyIntervals([(self.at(9, 30), self.at(10, 30))])
+        starts = [slot.start for slot in free_slots(self.doctor, self.at(0), self.at(23), busy)]
+        self.assertEqual(starts[:3], [self.at(9), self.at(10, 30), self.at(11)])
+        # The last slot of each window ends exactly at its close
+        self.assertIn(self.at(11, 30), starts)
+        self.assertNotIn(self.at(12), starts)
+        self.assertEqual(starts[-1], self.at(16, 30))
+        self.assertEqual(len(starts), 4 + 6)
+
+    def test_next_free_slots_across_days_and_window_edges(self):
+        Appointment.objects.create(user=self.user, clinic=self.clinic, doctor=self.doctor, appointment_date=to_db(self.at(16, 30)), duration_minutes=30)
+        # Starting off the grid, near the end of Monday: the next slots are on Tuesday
+        slots = next_free_slots([self.doctor], n=3, start=self.at(16, 10))
+        self.assertEqual([slot.start for slot in slots], [self.at(9, days=1), self.at(9, 30, days=1), self.at(9, days=7)])
+
+    def test_slot_start_must_fit_window_and_grid(self):
+        self.assertTrue(is_slot_start(self.doctor, self.at(16, 30)))
+        self.assertTrue(is_slot_start(self.doctor, self.at(14)))
+        self.assertFalse(is_slot_start(self.doctor, self.at(17)))
+        self.assertFalse(is_slot_start(self.doctor, self.at(16, 45)))
+        self.assertFalse(is_slot_start(self.doctor, self.at(9, 10)))
+        self.assertFalse(is_slot_start(self.doctor, self.at(12)))
+        self.assertFalse(is_slot_start(self.doctor, self.at(9, days=2)))
+
+    def test_booking_tool_rejects_times_past_the_window(self):
+        token = current_user.set(self.user)
+        self.addCleanup(current_user.reset, token)
+        for when in ("17:00", "16:45", "09:10"):
+            with self.subTest(when=when):
+                reply = book_appointment.func(f"عيادة الأسنان، د. سارة محمد، 2030-01-07 {when}")
+                self.assertIn("لا يمكن حجز", reply)
+                self.assertIn("2030-01-07", reply)
+        self.assertFalse(Appointment.objects.exists())
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self.assertIn("تم حجز الموعد بنجاح", book_appointment.func("عيادة الأسنان، د. سارة محمد، 2030-01-07 16:30"))
+        self.assertEqual(to_local(Appointment.objects.get().appointment_date), self.at(16, 30))
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 40
+
+    def setUp(self):
+        clinic = Clinic.objects.create(name="عيادة الأسنان", location="الطابق الأول", slot_minutes=30)
+        self.doctor = Doctor.objects.create(name="د. سارة محمد", specialty="طب الأسنان", clinic=clinic)
+        for day in range(7):
+            DoctorAvailability.objects.create(doctor=self.doctor, day_of_week=day, start_time=time(9), end_time=time(17))
+        self.users = [User.objects.create(username=f"patient{i}") for i in range(self.THREADS)]
+        tomorrow = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        # Few slots, many patients: every slot is contended, and half the requested
+        # times are off the grid so they overlap their neighbours instead of colliding exactly
+        self.times = [tomorrow + timedelta(minutes=15 * i) for i in range(16)]
+
+    def book_many(self, user):
+        booked = conflicts = 0
+        try:
+            for i in range(self.ATTEMPTS_PER_THREAD):
+                start = self.times[(i * 7 + user.id) % len(self.times)]
+                try:
+                    booking.book_appointment(user, self.doctor.clinic, self.doctor, start)
+                    booked += 1
+                except booking.SlotTaken:
+                    conflicts += 1
+        finally:
+            connection.close()
+        return booked, conflicts
+
+    def test_no_double_booking_under_concurrency(self):
+        started = perf_counter()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+                results = list(pool.map(self.book_many, self.users))
+        elapsed = perf_counter() - started
+        # Such as naive datetimes saved while USE_TZ is on
+        self.assertEqual([str(w.message) for w in caught], [])
+
+        attempts = self.THREADS * self.ATTEMPTS_PER_THREAD
+        booked = sum(b for b, _ in results)
+        self.assertEqual(booked + sum(c for _, c in results), attempts)
+        # 16 quarter-hour start times hold at most 8 non-overlapping 30-minute appointments
+        self.assertGreaterEqual(booked, 1)
+        self.assertLessEqual(booked, len(self.times) // 2)
+        logger.info(f"{attempts} concurrent booking attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s), {booked} booked")
+
+        appointments = list(Appointment.objects.filter(doctor=self.doctor).values_list("appointment_date", "duration_minutes"))
+        self.assertEqual(len(appointments), booked)
+        # Stored as the local times that were requested
+        self.assertLessEqual({to_local(start) for start, _ in appointments}, set(self.times))
+        intervals = [(start, start + timedelta(minutes=minutes)) for start, minutes in appointments]
+        overlapping = [(a, b) for a, b in combinations(intervals, 2) if a[0] < b[1] and b[0] < a[1]]
+        self.assertEqual(overlapping, [])
+
+
+class ChatHistoryViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="patient")
+        self.client.force_login(self.user)
+        start = datetime(2026, 3, 1, 9, tzinfo=dt_timezone.utc)
+        for i in range(7):
+            ChatLog.objects.create(user=self.user, session_id=f"s{i}", question=f"سؤال {i}", answer="جواب")
+            # Two conversations share each activity time, so the id breaks the tie
+            ChatSession.objects.filter(session_id=f"s{i}").update(last_activity=start + timedelta(hours=i // 2))
+        ChatLog.objects.create(user=User.objects.create(username="other"), session_id="s0", question="سؤال", answer="جواب")
+
+    def test_pages_follow_the_cursor(self):
+        url, seen = "/api/history/?limit=3", []
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 3)
+            seen += [session["session_id"] for session in page["results"]]
+            url = page["next"]
+        self.assertEqual(seen, ["s6", "s5", "s4", "s3", "s2", "s1", "s0"])
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(ChatHistoryView.pagination_class, "max_page_size", 2):
+            self.assertEqual(len(self.client.get("/api/history/?limit=1000").json()["results"]), 2)
+
+    def test_malformed_cursor(self):
+        # DRF's CursorPagination answers an undecodable cursor with 404
+        self.assertEqual(self.client.get("/api/history/?cursor=garbage").status_code, 404)
+
+
+class ChatMessagesViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="patient")
+        self.client.force_login(self.user)
+        for i in range(5):
+            ChatLog.objects.create(user=self.user, session_id="s1", question=f"سؤال {i}", answer=f"جواب {i}")
+        ChatLog.objects.create(user=User.objects.create(username="other"), session_id="s1", question="سؤال", answer="جواب")
+
+    def get(self, query="", etag=None):
+        response = self.client.get(f"/api/history/s1/{query}", headers={"If-None-Match": etag} if etag else {})
+        if response.status_code != 200:
+            return response, None
+        return response, json.loads(b"".join(response.streaming_content))
+
+    def test_before_cursor_pages_back(self):
+        _, page = self.get("?limit=2")
+        self.assertEqual([m["question"] for m in page["messages"]], ["سؤال 4", "سؤال 3"])
+        self.assertEqual(page["latest"], page["messages"][0]["cursor"])
+        questions = []
+        while page["next"]:
+            questions += [m["question"] for m in page["messages"]]
+            _, page = self.get(f"?limit=2&before={page['next']}")
+        questions += [m["question"] for m in page["messages"]]
+        self.assertEqual(questions, [f"سؤال {i}" for i in range(4, -1, -1)])
+
+    def test_since_cursor_returns_new_exchanges(self):
+        _, page = self.get()
+        latest = page["latest"]
+        _, page = self.get(f"?since={latest}")
+        self.assertEqual((page["messages"], page["latest"]), ([], None))
+
+        for i in (5, 6):
+            ChatLog.objects.create(user=self.user, session_id="s1", question=f"سؤال {i}", answer=f"جواب {i}")
+        _, page = self.get(f"?since={latest}")
+        # Oldest first, and "latest" is the cursor to poll from next
+        self.assertEqual([m["question"] for m in page["messages"]], ["سؤال 5", "سؤال 6"])
+        self.assertEqual(page["latest"], page["messages"][-1]["cursor"])
+
+    def test_unchanged_conversation_is_not_modified(self):
+        response, _ = self.get("?limit=2")
+        etag = response["ETag"]
+        response, _ = self.get("?limit=2", etag=etag)
+        self.assertEqual((response.status_code, response["ETag"]), (304, etag))
+        # The ETag also covers the query string: another page is a different resource
+        self.assertNotEqual(self.get("?limit=3")[0]["ETag"], etag)
+
+        ChatLog.objects.create(user=self.user, session_id="s1", question="سؤال 5", answer="جواب 5")
+        response, page = self.get("?limit=2", etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(page["messages"][0]["question"], "سؤال 5")
+
+    def test_malformed_cursor_or_limit(self):
+        for query in ("?before=abc", "?since=12", "?before=1.2.3", "?limit=x", "?limit=0", "?limit=-1"):
+            with self.subTest(query=query):
+                self.assertEqual(self.get(query)[0].status_code, 400)
+
+
+class WordEncoding:
+    """Stands in for tiktoken: one token per word."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class ConversationMemoryTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(memory, "get_encoding", return_value=WordEncoding()))
+        self.user = User.objects.create(username="patient")
+        self.summaries = []
+        llm = SimpleNamespace(invoke=lambda prompt: self.summaries.append(prompt) or SimpleNamespace(content="ملخص المحادثة"))
+        self.memory = memory.ConversationMemory(budget=100, summary_tokens=40)
+        self.memory._llm = llm
+
+    def add_turns(self, count):
+        # 10 words each way: 28 tokens per turn with the message overhead
+        return [
+            ChatLog.objects.create(user=self.user, session_id="s1", question=f"سؤال {i} " + "كلمة " * 8, answer=f"جواب {i} " + "كلمة " * 8)
+            for i in range(count)
+        ]
+
+    def history_tokens(self, history):
+        return sum(memory.count_tokens(message.content) for message in history)
+
+    def test_short_history_is_verbatim(self):
+        self.add_turns(3)
+        history = self.memory.messages(self.user, "s1")
+        self.assertEqual(len(history), 6)
+        self.assertEqual(self.summaries, [])
+
+    def test_overflow_is_folded_once(self):
+        logs = self.add_turns(30)
+        history = self.memory.messages(self.user, "s1")
+
+        # The newest turn fits half the budget; the 20 turns before it are folded
+        self.assertEqual(len(self.summaries), 1)
+        self.assertIn("سؤال 28", self.summaries[0])
+        self.assertNotIn("سؤال 29", self.summaries[0])
+        session = ChatSession.objects.get(session_id="s1")
+        self.assertEqual((session.summary, session.summarized_until), ("ملخص المحادثة", logs[-2].id))
+        self.assertEqual(history[0].content, "ملخص ما سبق من المحادثة: ملخص المحادثة")
+        self.assertEqual(history[-1].content, logs[-1].answer)
+        self.assertLessEqual(self.history_tokens(history), self.memory.budget)
+
+        # Only the turns after summarized_until are read next time: no new fold
+        self.add_turns(1)
+        history = self.memory.messages(self.user, "s1")
+        self.assertEqual(len(self.summaries), 1)
+        self.assertLessEqual(self.history_tokens(history), self.memory.budget)
+
+    def test_counts_without_tokenizer(self):
+        with mock.patch.object(memory, "get_encoding", return_value=None):
+            self.assertEqual(memory.count_tokens("ا" * 30), 10 + memory.MESSAGE_OVERHEAD)
+            self.assertEqual(memory.truncate_tokens("ا" * 30, 2), "ا" * 6 + " …")
+
+
+class TokenizerFallbackTests(TestCase):
+    def test_offline_tokenizer_falls_back(self):
+        self.enterContext(mock.patch.object(memory, "_encoding", None))
+        self.enterContext(mock.patch.object(memory, "_encoding_retry_at", 0.0))
+        # tiktoken raises a requests ConnectionError when it cannot download the encoding
+        with mock.patch("tiktoken.encoding_for_model", side_effect=ConnectionError("offline")) as load:
+            with self.assertLogs("clinic_ai.ai_engine.memory", "WARNING"):
+                self.assertEqual(memory.count_tokens("ا" * 30), 10 + memory.MESSAGE_OVERHEAD)
+            # Not retried on every call
+            memory.count_tokens("ا")
+            self.assertEqual(load.call_count, 1)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="patient")
+        self.chat = ClinicAIChat.__new__(ClinicAIChat)
+        self.chat.vector_store = mock.Mock(**{"get_retriever.return_value.ainvoke": mock.AsyncMock(return_value=[])})
+        self.chat.router = None
+
+    def test_async_answer_is_measured_and_metrics_reset(self):
+        self.chat.agent_executor = mock.Mock(ainvoke=mock.AsyncMock(return_value={"output": "أهلاً"}))
+        metrics = RequestMetrics()
+
+        async def run():
+            answer = await self.chat.aask("مرحبا", user=self.user, metrics=metrics)
+            return answer, current_metrics.get()
+
+        self.assertEqual(async_to_sync(run)(), ("أهلاً", None))
+        self.assertIn("retrieval", metrics.stages)
+        self.assertIs(self.chat.agent_executor.ainvoke.call_args.kwargs["config"]["callbacks"][0], metrics)
+
+    def test_async_stream_resets_metrics(self):
+        async def events(inputs, version, config):
+            yield {"event": "on_chain_end", "name": "AgentExecutor", "data": {"output": {"output": "أهلاً"}}}
+
+        self.chat.agent_executor = mock.Mock(astream_events=events)
+
+        async def run():
+            answer = [event async for event in self.chat.astream("مرحبا", user=self.user, metrics=RequestMetrics())]
+            return answer, current_metrics.get()
+
+        self.assertEqual(async_to_sync(run)(), ([{"type": "done", "answer": "أهلاً"}], None))
+
+
+class ReportJobQueueTests(TransactionTestCase):
+    # The worker closes stale connections between jobs, which TestCase's wrapping transaction does not survive
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.media_root = media.name
+        self.user = User.objects.create(username="patient")
+        self.client.force_login(self.user)
+        token = current_user.set(self.user)
+        self.addCleanup(current_user.reset, token)
+
+    def run_worker(self):
+        call_command("run_report_worker", "--burst", stdout=StringIO(), stderr=StringIO())
+
+    def test_tool_enqueues_and_worker_generates(self):
+        rows = [{"اسم الطبيب": f"د. طبيب {i}", "التخصص": "طب الأسنان"} for i in range(50)]
+        reply = generate_excel_report.func(json.dumps(rows, ensure_ascii=False))
+
+        # Nothing is rendered inside the agent loop
+        job = ReportJob.objects.get()
+        self.assertEqual((job.kind, job.status, job.user), ("xlsx", "pending", self.user))
+        self.assertIn(f"/api/reports/{job.id}/", reply)
+        self.assertEqual(os.listdir(self.media_root), [])
+        self.assertEqual(self.client.get(f"/api/reports/{job.id}/").json()["status"], "pending")
+
+        self.run_worker()
+        status = self.client.get(f"/api/reports/{job.id}/").json()
+        self.assertEqual(status["status"], "done")
+        job.refresh_from_db()
+        self.assertEqual(status["url"], f"/media/{job.filename}")
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, job.filename)))
+
+    def test_identical_report_reuses_cached_file(self):
+        rows = json.dumps([{"العيادة": f"عيادة {i}"} for i in range(10)], ensure_ascii=False)
+        generate_excel_report.func(rows)
+        self.run_worker()
+        first = ReportJob.objects.get()
+
+        # Same rows again: answered from the cache without a worker
+        reply = generate_excel_report.func(rows)
+        second = ReportJob.objects.latest("id")
+        self.assertEqual((second.status, second.filename), ("done", first.filename))
+        self.assertIn(second.file_url, reply)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "reports")), [os.path.basename(first.filename)])
+
+    def test_eviction_expires_jobs(self):
+        for i in range(3):
+            generate_excel_report.func(json.dumps([{"رقم": i}]))
+        self.run_worker()
+        jobs = list(ReportJob.objects.order_by("id"))
+        for age, job in zip((300, 200, 100), jobs):
+            path = os.path.join(self.media_root, job.filename)
+            os.utime(path, (os.path.getmtime(path) - age,) * 2)
+
+        size = os.path.getsize(os.path.join(self.media_root, jobs[0].filename))
+        stats = report_cache.evict(max_age=3600, max_bytes=int(size * 1.5))
+        # Least recently used first, until the rest fit
+        self.assertEqual((stats["deleted"], stats["kept"]), (2, 1))
+        self.assertEqual([job.status for job in ReportJob.objects.order_by("id")], ["expired", "expired", "done"])
+        status = self.client.get(f"/api/reports/{jobs[0].id}/").json()
+        self.assertEqual(status["status"], "expired")
+        self.assertTrue(status["error"])
+
+        stats = report_cache.evict(max_age=0, max_bytes=1 << 30)
+        self.assertEqual((stats["deleted"], stats["kept"]), (1, 0))
+
+    def test_spec_report_reads_rows_from_database(self):
+        resolver.invalidate()
+        clinic = Clinic.objects.create(name="عيادة الأسنان", location="الطابق الأول")
+        doctor = Doctor.objects.create(name="د. سارة محمد", specialty="طب الأسنان", clinic=clinic)
+        other = User.objects.create(username="other")
+        start = datetime(2026, 3, 1, 9)
+        for i in range(30):
+            Appointment.objects.create(user=self.user if i % 3 else other, clinic=clinic, doctor=doctor, appointment_date=to_db(start + timedelta(hours=i)))
+
+        spec = {"entity": "appointments", "format": "xlsx", "clinic": "الاسنان", "from": "2026-03-01", "columns": ["date", "doctor", "status"]}
+        reply = generate_report.func(json.dumps(spec, ensure_ascii=False))
+        self.assertIn("(20 سجل)", reply)
+        self.run_worker()
+
+        job = ReportJob.objects.get()
+        self.assertEqual((job.status, job.payload), ("done", []))
+        rows = list(openpyxl.load_workbook(os.path.join(self.media_root, job.filename)).active.values)
+        # Header, then only this patient's appointments
+        self.assertEqual(rows[0], ("التاريخ والوقت", "الطبيب", "الحالة"))
+        self.assertEqual(len(rows), 21)
+        self.assertEqual(rows[1], ("2026-03-01 10:00", "د. سارة محمد", "قيد الانتظار"))
+
+    def test_spec_rows_are_queried_once_and_cached(self):
+        clinic = Clinic.objects.create(name="عيادة الأسنان", location="الطابق الأول")
+        doctor = Doctor.objects.create(name="د. سارة محمد", specialty="طب الأسنان", clinic=clinic)
+        for i in range(5):
+            Appointment.objects.create(user=self.user, clinic=clinic, doctor=doctor, appointment_date=to_db(datetime(2026, 3, 1, 9 + i)))
+        spec = {"entity": "appointments", "format": "xlsx", "columns": ["date", "doctor"]}
+
+        filenames = []
+        for _ in range(2):
+            job = jobs.enqueue_report(self.user, "xlsx", spec=spec)
+            with CaptureQueriesContext(connection) as queries:
+                job = jobs.run_job(jobs.claim_next_job("test"))
+            filenames.append(job.filename)
+            # Hashed while rendering, so the rows are read once
+            reads = [q["sql"] for q in queries if "clinic_ai_appointment" in q["sql"] and q["sql"].startswith("SELECT")]
+            self.assertEqual(len(reads), 1)
+        # The second, identical report keeps the first file
+        self.assertEqual(filenames[0], filenames[1])
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "reports")), [os.path.basename(filenames[0])])
+
+    def test_invalid_spec_is_explained(self):
+        reply = generate_report.func('{"entity": "appointments", "columns": ["salary"]}')
+        self.assertIn("salary", reply)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_failed_job_is_reported(self):
+        job = ReportJob.objects.create(user=self.user, kind="xlsx", payload=[])
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(self.client.get(f"/api/reports/{job.id}/").json()["status"], "failed")
+
+    def test_other_users_jobs_are_hidden(self):
+        job = ReportJob.objects.create(user=User.objects.create(username="other"), kind="xlsx", payload=[{"a": 1}])
+        self.assertEqual(self.client.get(f"/api/reports/{job.id}/").status_code, 404)
+
+
+class PdfReportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Without the Noto Arabic fonts, lay out with ReportLab's bundled Vera, as benchmark_reports does
+        if "Arabic" not in pdfmetrics.getRegisteredFontNames():
+            fonts = os.path.join(os.path.dirname(reportlab.__file__), "fonts")
+            pdfmetrics.registerFont(TTFont("Arabic", os.path.join(fonts, "Vera.ttf")))
+            pdfmetrics.registerFont(TTFont("Arabic-Bold", os.path.join(fonts, "VeraBd.ttf")))
+
+    def test_long_values_wrap_and_grow_their_row(self):
+        note = "يراجع المريض العيادة بعد أسبوعين لإجراء فحص شامل ومتابعة نتائج التحاليل المخبرية " * 3
+        text, lines = reports.wrap_cell(note, 150)
+        self.assertGreater(lines, 1)
+        self.assertEqual(len(text.splitlines()), lines)
+        for line in text.splitlines():
+            self.assertLessEqual(pdfmetrics.stringWidth(line, "Arabic", reports.BODY_FONT_SIZE), 150)
+
+        table = next(reports.table_chunks(["a", "b"], [["مؤكد", note], ["مؤكد", "ملغي"]], [100, 162]))
+        self.assertEqual(table._argH[1:], [reports.BODY_ROW_HEIGHT + (lines - 1) * reports.BODY_LEADING, reports.BODY_ROW_HEIGHT])
+
+    def test_rows_are_read_one_chunk_at_a_time(self):
+        consumed = []
+        rows = (consumed.append(i) or [str(i)] for i in range(25))
+        with mock.patch.object(reports, "PDF_CHUNK_ROWS", 10):
+            chunks = reports.table_chunks(["n"], rows, [50])
+            self.assertEqual(len(next(chunks)._cellvalues), 11)
+            self.assertEqual(len(consumed), 10)
+            self.assertEqual([len(table._cellvalues) for table in chunks], [11, 6])
+
+    def test_render_pdf(self):
+        data = [{"الطبيب": f"د. طبيب {i}", "ملاحظات": "متابعة " * (40 if i == 3 else 1)} for i in range(120)]
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(reports, "PDF_CHUNK_ROWS", 50):
+            path = os.path.join(directory, "report.pdf")
+            reports.render_pdf(*reports.table_from_dicts(data), path)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(5), b"%PDF-")
+
+    def test_render_pdf_takes_the_count_from_rows(self):
+        count = mock.Mock(return_value=3)
+        rows = reports.Rows(([str(i), "مؤكد"] for i in range(3)), count)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.pdf")
+            reports.render_pdf(["رقم", "الحالة"], rows, path)
+            self.assertTrue(os.path.getsize(path))
+        count.assert_called_once_with()
@@ -1,6 +1,6 @@
-from django.urls import path
+from django.urls import path, re_path
 from django.views.generic import TemplateView
-from .views import ChatAPIView, SignupView, LoginView, LogoutView, ChatHistoryView, ChatMessagesView, landing_view, chat_ui_view, dashboard_view, appointments_view
+from .views import ChatAPIView, SignupView, LoginView, LogoutView, ChatHistoryView, ChatMessagesView, ReportJobView, AppointmentExportView, chat_api_async_view, readiness_view, landing_view, chat_ui_view, dashboard_view, appointments_view
 
 urlpatterns = [
     path('', landing_view, name='landing'),
@@ -8,9 +8,13 @@ urlpatterns = [
     path('appointments/', appointments_view, name='appointments'),
     path('chat/', chat_ui_view, name='chat-ui'),
     path('api/chat/', ChatAPIView.as_view(), name='api-chat'),
+    path('api/chat/async/', chat_api_async_view, name='api-chat-async'),
+    path('api/ready/', readiness_view, name='api-ready'),
     path('api/signup/', SignupView.as_view(), name='api-signup'),
     path('api/login/', LoginView.as_view(), name='api-login'),
     path('api/logout/', LogoutView.as_view(), name='api-logout'),
     path('api/history/', ChatHistoryView.as_view(), name='api-history'),
     path('api/history/<str:session_id>/', ChatMessagesView.as_view(), name='api-messages'),
+    path('api/reports/<int:job_id>/', ReportJobView.as_view(), name='api-report'),
+    re_path(r'^api/exports/appointments\.(?P<export_format>csv|xlsx)$', AppointmentExportView.as_view(), name='api-export-appointments'),
 ]
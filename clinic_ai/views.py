@@ -1,17 +1,24 @@
-from django.db import models
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, authentication
-from rest_framework.decorators import api_view, permission_classes
 from django.contrib.auth import authenticate, login, logout
-from .serializers import UserSerializer, AppointmentSerializer
+from .serializers import UserSerializer, ChatSessionSerializer
+from .pagination import ChatSessionCursorPagination, decode_message_cursor, encode_message_cursor
 
 
-from .models import ChatLog
+from .models import Appointment, ChatLog, ChatSession, ReportJob
 from .context import current_user
+import hashlib
+import json
 import logging
+import tempfile
+from datetime import datetime, timedelta
 
 from django.shortcuts import render, redirect
+from django.http import FileResponse, StreamingHttpResponse, JsonResponse, HttpResponseNotModified
+from django.db import models
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
@@ -70,7 +77,17 @@ class LogoutView(APIView):
         logout(request)
         return Response({"message": "تم تسجيل الخروج"})
 
-from langchain_core.messages import HumanMessage, AIMessage
+CHAT_ERROR_MESSAGE = "عذراً، حدث خطأ في معالجة طلبك. يرجى المحاولة لاحقاً."
+
+def _sse(event):
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def _save_metrics(metrics, chat_log):
+    # Best effort: a failed metrics insert must not fail the chat turn
+    try:
+        metrics.save(chat_log)
+    except Exception as e:
+        logger.error(f"Could not save metrics of chat {chat_log.pk}: {e}")
 
 @method_decorator(csrf_exempt, name='dispatch')
 class ChatAPIView(APIView):
@@ -85,29 +102,32 @@ class ChatAPIView(APIView):
         
         try:
             user = request.user
-            
-            # Retrieve recent chat history for the user and specific session
-            recent_logs = []
-            if session_id:
-                recent_logs = ChatLog.objects.filter(user=user, session_id=session_id).order_by('-created_at')[:20]
-            
-            chat_history = []
-            # Reversed to get chronological order [oldest -> newest] for the AI
-            for log in reversed(recent_logs):
-                chat_history.append(HumanMessage(content=log.question))
-                chat_history.append(AIMessage(content=log.answer))
+            from .ai_engine.metrics import RequestMetrics
+            metrics = RequestMetrics()
+            with metrics.stage("history"):
+                chat_history = self._get_chat_history(user, session_id)
+
+            if request.data.get("stream"):
+                response = StreamingHttpResponse(
+                    self._stream_events(query, user, session_id, chat_history, metrics),
+                    content_type="text/event-stream"
+                )
+                response["Cache-Control"] = "no-cache"
+                response["X-Accel-Buffering"] = "no"
+                return response
             
             # Set user context for tools
             token = current_user.set(user)
             try:
                 from .ai_engine.chains import get_ai_chat
                 ai_chat = get_ai_chat()
-                answer = ai_chat.ask(query, user=user, chat_history=chat_history)
+                answer = ai_chat.ask(query, user=user, chat_history=chat_history, metrics=metrics)
             finally:
                 current_user.reset(token)
             
             # Log the Q&A with the user and session linked
-            ChatLog.objects.create(user=user, session_id=session_id, question=query, answer=answer)
+            chat_log = ChatLog.objects.create(user=user, session_id=session_id, question=query, answer=answer)
+            _save_metrics(metrics, chat_log)
             
             return Response({
                 "status": "success",
@@ -118,30 +138,272 @@ class ChatAPIView(APIView):
             logger.error(f"Error in ChatAPIView: {str(e)}")
             return Response({
                 "status": "error",
-                "message": "عذراً، حدث خطأ في معالجة طلبك. يرجى المحاولة لاحقاً."
+                "message": CHAT_ERROR_MESSAGE
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _get_chat_history(self, user, session_id):
+        # Recent turns within the token budget, after the session's rolling summary
+        from .ai_engine.memory import get_memory
+        return get_memory().messages(user, session_id)
+
+    def _stream_events(self, query, user, session_id, chat_history, metrics):
+        """Server-Sent Events body: tool/token events, then a final done/error event."""
+        from .ai_engine.chains import get_ai_chat
+        try:
+            ai_chat = get_ai_chat()
+            for event in ai_chat.stream(query, user=user, chat_history=chat_history, metrics=metrics):
+                if event["type"] == "done":
+                    # The ChatLog row is only written once the full answer is known
+                    chat_log = ChatLog.objects.create(user=user, session_id=session_id, question=query, answer=event["answer"])
+                    _save_metrics(metrics, chat_log)
+                elif event["type"] == "error":
+                    logger.error(f"Error in ChatAPIView stream: {event['message']}")
+                    event = {"type": "error", "message": CHAT_ERROR_MESSAGE}
+                yield _sse(event)
+        except Exception as e:
+            logger.error(f"Error in ChatAPIView stream: {str(e)}")
+            yield _sse({"type": "error", "message": CHAT_ERROR_MESSAGE})
+
+async def _astream_events(ai_chat, query, user, session_id, chat_history, metrics):
+    # Set inside the generator: it is consumed by the response task, after the view returned
+    current_user.set(user)
+    async for event in ai_chat.astream(query, user=user, chat_history=chat_history, metrics=metrics):
+        if event["type"] == "done":
+            chat_log = await ChatLog.objects.acreate(user=user, session_id=session_id, question=query, answer=event["answer"])
+            await sync_to_async(_save_metrics)(metrics, chat_log)
+        elif event["type"] == "error":
+            logger.error(f"Error in chat_api_async_view stream: {event['message']}")
+            event = {"type": "error", "message": CHAT_ERROR_MESSAGE}
+        yield _sse(event)
+
+@require_POST
+async def chat_api_async_view(request):
+    """
+    Async counterpart of ChatAPIView for ASGI deployments (same request and
+    response shapes, session authentication only). The agent, the retriever and
+    the ChatLog reads/writes are all awaited, so a waiting conversation does not
+    hold a worker thread.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_403_FORBIDDEN)
+    if request.content_type != "application/json":
+        return JsonResponse({"error": "Content-Type must be application/json"}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+
+    query = data.get("query")
+    session_id = data.get("session_id")
+    if not query:
+        return JsonResponse({"error": "Query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        from .ai_engine.memory import get_memory
+        from .ai_engine.metrics import RequestMetrics
+        metrics = RequestMetrics()
+        with metrics.stage("history"):
+            chat_history = await sync_to_async(get_memory().messages)(user, session_id)
+
+        from .ai_engine.chains import get_ai_chat
+        ai_chat = await sync_to_async(get_ai_chat)()
+
+        if data.get("stream"):
+            response = StreamingHttpResponse(
+                _astream_events(ai_chat, query, user, session_id, chat_history, metrics),
+                content_type="text/event-stream"
+            )
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+
+        # Each request runs in its own task, so the context var stays per conversation
+        token = current_user.set(user)
+        try:
+            answer = await ai_chat.aask(query, user=user, chat_history=chat_history, metrics=metrics)
+        finally:
+            current_user.reset(token)
+
+        chat_log = await ChatLog.objects.acreate(user=user, session_id=session_id, question=query, answer=answer)
+        await sync_to_async(_save_metrics)(metrics, chat_log)
+
+        return JsonResponse({
+            "status": "success",
+            "answer": answer,
+            "is_authenticated": True
+        })
+    except Exception as e:
+        logger.error(f"Error in chat_api_async_view: {str(e)}")
+        return JsonResponse({
+            "status": "error",
+            "message": CHAT_ERROR_MESSAGE
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def readiness_view(request):
+    """Reports whether the embedding model, FAISS index and agent are loaded (503 until they are)."""
+    from .ai_engine.chains import get_engine_status
+    engine = get_engine_status()
+    return JsonResponse(engine, status=status.HTTP_200_OK if engine["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
 class ChatHistoryView(APIView):
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ChatSessionCursorPagination
     
     def get(self, request):
-        user = request.user
-        # Get unique sessions for this user, ordered by latest activity
-        sessions = ChatLog.objects.filter(user=user).values('session_id').annotate(
-            latest=models.Max('created_at'),
-            title=models.Min('question') # Use first question as title
-        ).order_by('-latest')
-        
-        return Response(list(sessions))
+        # Conversations of this user, most recent first, one page at a time
+        sessions = ChatSession.objects.filter(user=request.user)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(sessions, request, view=self)
+        return paginator.get_paginated_response(ChatSessionSerializer(page, many=True).data)
 
 class ChatMessagesView(APIView):
+    """
+    Transcript of one conversation, newest exchange first, one page at a time:
+    `?before=<cursor>` continues with older exchanges and `?since=<cursor>`
+    returns only the exchanges after it (oldest first). Rows are streamed from
+    a server-side cursor, and the ETag follows the session's message count and
+    last activity, so an unchanged conversation costs a 304.
+    """
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    page_size = 50
+    max_page_size = 200
     
     def get(self, request, session_id):
         user = request.user
-        messages = ChatLog.objects.filter(user=user, session_id=session_id).order_by('created_at')
-        result = []
-        for msg in messages:
-            result.append({"type": "human", "text": msg.question})
-            result.append({"type": "ai", "text": msg.answer})
-        return Response(result)
+        try:
+            before = decode_message_cursor(request.query_params["before"]) if "before" in request.query_params else None
+            since = decode_message_cursor(request.query_params["since"]) if "since" in request.query_params else None
+            limit = min(int(request.query_params.get("limit", self.page_size)), self.max_page_size)
+            if limit < 1:
+                raise ValueError(limit)
+        except ValueError:
+            return Response({"error": "Invalid cursor or limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+        session = ChatSession.objects.filter(user=user, session_id=session_id).values_list("message_count", "last_activity").first()
+        version = f"{session[0]}-{session[1].timestamp()}" if session else "0"
+        etag = f'W/"{version}-{hashlib.md5(request.get_full_path().encode()).hexdigest()[:12]}"'
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        logs = ChatLog.objects.filter(user=user, session_id=session_id)
+        if since:
+            created_at, pk = since
+            logs = logs.filter(models.Q(created_at__gt=created_at) | models.Q(created_at=created_at, id__gt=pk)).order_by("created_at", "id")
+        else:
+            if before:
+                created_at, pk = before
+                logs = logs.filter(models.Q(created_at__lt=created_at) | models.Q(created_at=created_at, id__lt=pk))
+            # One extra row tells whether there is an older page
+            logs = logs.order_by("-created_at", "-id")[:limit + 1]
+
+        response = StreamingHttpResponse(
+            self._stream_page(logs.values_list("id", "question", "answer", "created_at").iterator(chunk_size=200), limit if not since else None),
+            content_type="application/json"
+        )
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    def _stream_page(self, rows, limit):
+        """JSON body: {"messages": [...], "next": older-page cursor, "latest": newest cursor seen}."""
+        yield '{"messages": ['
+        count = 0
+        newest = oldest = None
+        for pk, question, answer, created_at in rows:
+            if limit is not None and count == limit:
+                yield f'], "next": {json.dumps(oldest)}, "latest": {json.dumps(newest)}}}'
+                return
+            cursor = encode_message_cursor(created_at, pk)
+            if newest is None or limit is None:
+                newest = cursor
+            oldest = cursor
+            item = {"cursor": cursor, "question": question, "answer": answer, "created_at": created_at.isoformat()}
+            yield ("," if count else "") + json.dumps(item, ensure_ascii=False)
+            count += 1
+        yield f'], "next": null, "latest": {json.dumps(newest)}}}'
+
+REPORT_JOB_ERRORS = {
+    "failed": "تعذر إنشاء التقرير، يرجى المحاولة مرة أخرى.",
+    "expired": "انتهت صلاحية هذا التقرير وحُذف الملف، يرجى طلبه من جديد.",
+}
+
+class ReportJobView(APIView):
+    """
+    Status of a queued report, polled by the chat UI until the worker is done:
+    {"id", "kind", "status": pending|running|done|failed|expired, "url", "error"}.
+    """
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = ReportJob.objects.filter(pk=job_id, user=request.user).first()
+        if job is None:
+            return Response({"error": "Report not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "url": job.file_url if job.status == 'done' else None,
+            "error": REPORT_JOB_ERRORS.get(job.status),
+        }, headers={"Cache-Control": "no-store"})
+
+APPOINTMENT_EXPORT_HEADERS = ["رقم الموعد", "التاريخ والوقت", "المريض", "الطبيب", "العيادة", "المدة (دقيقة)", "الحالة"]
+
+class AppointmentExportView(APIView):
+    """
+    Appointments from ?from= to ?to= (YYYY-MM-DD, inclusive; default the current
+    year) as a CSV or xlsx download. Rows are read from the queryset with
+    .iterator() and written out one at a time, so memory does not grow with the
+    export. Staff get every patient's appointments, other users their own.
+    """
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, export_format):
+        from .ai_engine.reports import csv_stream, write_xlsx
+        from .ai_engine.slots import to_db
+
+        try:
+            today = datetime.now().date()
+            start = datetime.strptime(request.query_params.get("from") or f"{today.year}-01-01", "%Y-%m-%d")
+            last = datetime.strptime(request.query_params.get("to") or f"{today.year}-12-31", "%Y-%m-%d")
+        except ValueError:
+            return Response({"error": "from and to must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+
+        appointments = Appointment.objects.filter(
+            appointment_date__gte=to_db(start),
+            appointment_date__lt=to_db(last + timedelta(days=1))
+        )
+        if not request.user.is_staff:
+            appointments = appointments.filter(user=request.user)
+        rows = self._rows(
+            appointments.order_by("appointment_date", "id")
+            .values_list("id", "appointment_date", "user__username", "doctor__name", "clinic__name", "duration_minutes", "status")
+            .iterator(chunk_size=2000)
+        )
+        filename = f"appointments_{start:%Y%m%d}_{last:%Y%m%d}.{export_format}"
+
+        if export_format == "csv":
+            response = StreamingHttpResponse(csv_stream(APPOINTMENT_EXPORT_HEADERS, rows), content_type="text/csv; charset=utf-8")
+        else:
+            # An xlsx file is a zip whose directory comes last, so it cannot be sent as it is
+            # written; it is spooled row by row to a temporary file and streamed from disk
+            spool = tempfile.TemporaryFile()
+            write_xlsx(APPOINTMENT_EXPORT_HEADERS, rows, spool, title="Appointments")
+            spool.seek(0)
+            response = FileResponse(spool, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    def _rows(self, values):
+        from .ai_engine.slots import to_local
+
+        statuses = dict(Appointment.STATUS_CHOICES)
+        for pk, appointment_date, username, doctor, clinic, duration, appointment_status in values:
+            yield [pk, to_local(appointment_date), username, doctor, clinic or "", duration, statuses.get(appointment_status, appointment_status)]
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'clinic_project.settings')
 
 application = get_asgi_application()
+
+# Load the AI engine now rather than on the first chat request
+from clinic_ai.ai_engine.chains import preload_ai_chat
+
+preload_ai_chat()
@@ -80,10 +80,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Transactions take the write lock when they begin, so concurrent
+            # check-then-insert bookings queue up instead of failing at commit
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # The default in-memory test database uses SQLite's shared cache, whose
+        # table locks fail immediately instead of waiting; the booking stress
+        # test needs the same locking as production
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Local memory per process by default; set REDIS_URL to share one cache (and
+# its invalidations) between all web and worker processes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'clinic-ai',
+    }
+}
+if os.getenv("REDIS_URL"):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL"),
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -137,6 +167,75 @@ CORS_ALLOW_ALL_ORIGINS = True
 # Vector DB & Docs
 DOCS_DIR = BASE_DIR / "clinic_docs"
 FAISS_INDEX_PATH = BASE_DIR / "faiss_index"
+# Seconds between checks of faiss_index/CURRENT for a newly published index version
+FAISS_RELOAD_INTERVAL = 30
+# Index versions kept on disk (older ones are deleted after each build)
+FAISS_KEEP_VERSIONS = 3
+
+# Index type: "flat" (exact), "hnsw" or "ivfpq"; see `manage.py benchmark_index`.
+# Changing a build-time value triggers a full rebuild on the next build_index.
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_VECTOR_ENCODING = "float"  # "sq8" stores flat/HNSW vectors as int8
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_CONSTRUCTION = 80
+FAISS_HNSW_EF_SEARCH = 64
+FAISS_IVF_NLIST = 256
+FAISS_PQ_M = 48
+FAISS_IVF_NPROBE = 16
+FAISS_TRAIN_SIZE = 20000
+
+# Document ingestion (build_index): PDF extraction processes, chunks per embedding batch
+INGEST_WORKERS = 1
+INGEST_BATCH_SIZE = 64
+
+# Retrieval: chunks passed to the LLM, candidates fetched from FAISS and BM25
+# before reciprocal rank fusion, and the RRF constant
+RETRIEVER_K = 4
+RETRIEVER_FETCH_K = 20
+RRF_K = 60
+HYBRID_SEARCH = True
+
+# Chat history sent to the agent: tokens of recent turns kept verbatim (the
+# rolling summary included) and the summary's own length limit
+HISTORY_TOKEN_BUDGET = 2000
+HISTORY_SUMMARY_TOKENS = 400
+
+# Intent router in front of the agent (router.IntentRouter): short queries
+# that match one read-only tool (own appointments, opening hours/phone,
+# clinics, doctors) with at least this cosine similarity to its examples, and
+# by this margin over any other intent, are answered without the LLM
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+INTENT_ROUTER_THRESHOLD = 0.85
+INTENT_ROUTER_MARGIN = 0.05
+
+# Query embedding cache in ClinicVectorStore (entries, seconds)
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 3600
+
+# Doctor/clinic name resolver used by the agent tools. Saves in this process
+# invalidate it immediately; this bounds staleness for saves made elsewhere (seconds)
+ENTITY_RESOLVER_TTL = 300
+
+# Outputs of list_clinics, list_all_doctors and get_clinic_general_info in the
+# default cache (seconds); model saves invalidate them at once in every process
+# sharing the cache, this bounds staleness for the others
+TOOL_CACHE_TTL = 3600
+
+# Rendered per-doctor schedule blocks in get_doctor_availability (seconds);
+# DoctorAvailability saves in this process invalidate them immediately
+SCHEDULE_CACHE_TTL = 300
+
+# Report jobs left running this long (seconds) are assumed lost with their
+# worker and are queued again by run_report_worker
+REPORT_JOB_TIMEOUT = 600
+
+# Generated reports are cached by content under MEDIA_ROOT/reports/ and evicted
+# by run_report_worker (every REPORT_CLEANUP_INTERVAL seconds) or cleanup_reports:
+# first those unused for REPORT_CACHE_MAX_AGE seconds, then the least recently
+# used until the rest fit in REPORT_CACHE_MAX_BYTES
+REPORT_CACHE_MAX_AGE = 7 * 24 * 3600
+REPORT_CACHE_MAX_BYTES = 1 << 30
+REPORT_CLEANUP_INTERVAL = 3600
 
 import os
 from dotenv import load_dotenv
@@ -145,6 +244,9 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Build the AI engine (model, index, agent) when the WSGI/ASGI app is loaded
+AI_ENGINE_PRELOAD = os.getenv("AI_ENGINE_PRELOAD", "1") == "1"
+
 # REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [